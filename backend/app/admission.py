@@ -0,0 +1,326 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+import openai
+from starlette.responses import JSONResponse
+
+from app.metrics import (
+    ADMISSION_LIMIT_DECREASES,
+    ADMISSION_REJECTED,
+    ADMISSION_WAIT_SECONDS,
+    REGISTRY,
+    UPSTREAM_RATE_LIMITS,
+    current_trace,
+)
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+# concurrent chat requests per worker; the limit adapts between these two
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "32"))
+ADMISSION_MIN_CONCURRENCY = int(os.getenv("ADMISSION_MIN_CONCURRENCY", "2"))
+# concurrent (and, separately, queued) chat requests per client
+ADMISSION_PER_CLIENT = int(os.getenv("ADMISSION_PER_CLIENT", "8"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "64"))
+# seconds a request may wait for a slot before it gets a 429
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+# time to first token (after admission) above which the limit is cut
+ADMISSION_LATENCY_TARGET = float(os.getenv("ADMISSION_LATENCY_TARGET", "10"))
+# factor applied to the limit on upstream rate limits or slow answers, at most once per cooldown
+ADMISSION_BACKOFF = float(os.getenv("ADMISSION_BACKOFF", "0.7"))
+ADMISSION_COOLDOWN = float(os.getenv("ADMISSION_COOLDOWN", "5"))
+# request header identifying the client (e.g. x-forwarded-for behind a proxy), the peer address otherwise
+ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER", "").lower()
+# trusted proxies appending to that header; the client is the entry the
+# outermost of them appended, anything left of it is set by the caller
+ADMISSION_TRUSTED_HOPS = max(int(os.getenv("ADMISSION_TRUSTED_HOPS", "1")), 1)
+
+logger = logging.getLogger("uvicorn")
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def is_rate_limit(error: BaseException) -> bool:
+    '''
+    Whether an OpenAI rate limit error is anywhere in the cause chain (or
+    exception group) of `error`
+    '''
+    seen = set()
+    pending = [error]
+    while pending:
+        e = pending.pop()
+        if e is None or id(e) in seen:
+            continue
+        seen.add(id(e))
+        if isinstance(e, openai.RateLimitError):
+            return True
+        pending.extend(getattr(e, "exceptions", ()))
+        pending.extend((e.__cause__, e.__context__))
+    return False
+
+
+class AdmissionController:
+    '''
+    Bounds the chat requests a worker runs at once, so a traffic spike queues
+    here instead of fanning out into unbounded OpenAI calls and database
+    connections.
+
+    A request runs when a slot is free and its client is under its own cap;
+    otherwise it waits in a FIFO queue (skipping clients at their cap) for at
+    most `queue_timeout` seconds. A full queue, or a client with too many
+    queued requests, is rejected right away with a Retry-After estimate.
+
+    The limit follows AIMD: it is cut by `backoff` when OpenAI answered with
+    a 429 while a request ran (see `observe_response`) or its first token
+    took longer than `latency_target`, and grows by one slot per limit's
+    worth of requests that streamed an answer with the limit in use.
+    '''
+
+    def __init__(
+        self,
+        max_limit: int = ADMISSION_MAX_CONCURRENCY,
+        min_limit: int = ADMISSION_MIN_CONCURRENCY,
+        per_client: int = ADMISSION_PER_CLIENT,
+        queue_size: int = ADMISSION_QUEUE_SIZE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+        latency_target: float = ADMISSION_LATENCY_TARGET,
+        backoff: float = ADMISSION_BACKOFF,
+        cooldown: float = ADMISSION_COOLDOWN,
+    ):
+        self.max_limit = max(max_limit, 1)
+        self.min_limit = min(max(min_limit, 1), self.max_limit)
+        self.per_client = max(per_client, 1)
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.limit = float(self.max_limit)
+        self.active = 0
+        self._active_by_client: Dict[str, int] = {}
+        self._queued_by_client: Dict[str, int] = {}
+        self._waiters: Deque[Tuple[str, asyncio.Future]] = deque()
+        self._last_decrease = -math.inf
+        # set from the HTTP client hooks, possibly on a worker thread
+        self._rate_limited_at = -math.inf
+        # moving average of how long an admitted request holds its slot
+        self._service_time = 1.0
+
+    @property
+    def capacity(self) -> int:
+        return max(int(self.limit), 1)
+
+    def _has_slot(self, client: str) -> bool:
+        return self.active < self.capacity and self._active_by_client.get(client, 0) < self.per_client
+
+    def _admit(self, client: str) -> None:
+        self.active += 1
+        self._active_by_client[client] = self._active_by_client.get(client, 0) + 1
+
+    def _dequeue(self, client: str) -> None:
+        if self._queued_by_client[client] == 1:
+            del self._queued_by_client[client]
+        else:
+            self._queued_by_client[client] -= 1
+
+    def retry_after(self) -> int:
+        # seconds until the queue ahead would have drained
+        estimate = (len(self._waiters) + 1) * self._service_time / self.capacity
+        return min(max(math.ceil(estimate), 1), 60)
+
+    async def acquire(self, client: str) -> float:
+        '''
+        Wait for a slot and return the seconds waited, or raise Overloaded
+        '''
+        # every release dispatches the queue, so whoever still waits while a
+        # slot is free is waiting on their own client's cap, not ahead of us
+        if self._has_slot(client):
+            self._admit(client)
+            return 0.0
+        if len(self._waiters) >= self.queue_size:
+            raise Overloaded("queue_full", self.retry_after())
+        if self._queued_by_client.get(client, 0) >= self.per_client:
+            raise Overloaded("client_queue_full", self.retry_after())
+
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        waiter = (client, future)
+        self._waiters.append(waiter)
+        self._queued_by_client[client] = self._queued_by_client.get(client, 0) + 1
+        try:
+            await asyncio.wait((future,), timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            if future.done():
+                # admitted just as the request was cancelled
+                self._free(client)
+            else:
+                self._abandon(waiter)
+            raise
+        if not future.done():
+            self._abandon(waiter)
+            raise Overloaded("timeout", self.retry_after())
+        return time.perf_counter() - start
+
+    def _abandon(self, waiter: Tuple[str, asyncio.Future]) -> None:
+        self._waiters.remove(waiter)
+        self._dequeue(waiter[0])
+        waiter[1].cancel()
+
+    def _free(self, client: str) -> None:
+        self.active -= 1
+        if self._active_by_client[client] == 1:
+            del self._active_by_client[client]
+        else:
+            self._active_by_client[client] -= 1
+        self._dispatch()
+
+    def note_rate_limit(self) -> None:
+        '''
+        Record an upstream 429; safe to call from any thread
+        '''
+        UPSTREAM_RATE_LIMITS.inc()
+        self._rate_limited_at = time.monotonic()
+
+    def observe_response(self, response) -> None:
+        '''
+        OpenAI HTTP response hook (see `app.context.with_response_hooks`). The
+        OpenAI client retries rate limited calls and llama_index swallows
+        errors raised inside a stream, so the responses themselves are the
+        only reliable signal.
+        '''
+        if response.status_code == 429:
+            self.note_rate_limit()
+
+    def release(
+        self, client: str, held: float, latency: float, rate_limited: bool = False, succeeded: bool = True
+    ) -> None:
+        '''
+        Give the slot back. `held` is how long the request ran, `latency` its
+        time to first byte, and `succeeded` whether it streamed an answer.
+        '''
+        saturated = self.active >= self.capacity
+        # a 429 to any request running meanwhile counts: the quota is shared
+        rate_limited = rate_limited or self._rate_limited_at >= time.monotonic() - held
+        self._service_time += 0.2 * (held - self._service_time)
+        self._adapt(latency, rate_limited, saturated and succeeded)
+        self._free(client)
+
+    def _adapt(self, latency: float, rate_limited: bool, grow: bool) -> None:
+        if rate_limited or latency > self.latency_target:
+            now = time.monotonic()
+            # one burst of slow or failed requests is one signal, not many
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            limit = max(self.limit * self.backoff, self.min_limit)
+            if limit < self.limit:
+                cause = "rate_limit" if rate_limited else "latency"
+                ADMISSION_LIMIT_DECREASES.inc(cause=cause)
+                logger.warning(f"Admission limit {self.limit:.1f} -> {limit:.1f} ({cause})")
+                self.limit = limit
+        elif grow:
+            self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+
+    def _dispatch(self) -> None:
+        for waiter in list(self._waiters):
+            if self.active >= self.capacity:
+                break
+            client, future = waiter
+            if self._active_by_client.get(client, 0) >= self.per_client:
+                continue
+            self._waiters.remove(waiter)
+            self._dequeue(client)
+            self._admit(client)
+            future.set_result(None)
+
+    def metrics(self):
+        yield "chat_admission_queue_depth", "Chat requests waiting for a slot", "gauge", {(): len(self._waiters)}
+        yield "chat_admission_active", "Chat requests holding a slot", "gauge", {(): self.active}
+        yield "chat_admission_limit", "Current adaptive concurrency limit", "gauge", {(): self.limit}
+
+
+class AdmissionMiddleware:
+    '''
+    ASGI middleware admitting POST /api/chat through an AdmissionController.
+    The slot is held until the last streamed byte, and rejected requests get
+    a 429 with a Retry-After header.
+    '''
+
+    def __init__(self, app, controller: Optional[AdmissionController] = None, path: str = "/api/chat"):
+        self.app = app
+        self.controller = controller or admission
+        self.path = path
+
+    def _client(self, scope) -> str:
+        if ADMISSION_CLIENT_HEADER:
+            entries = [
+                entry.strip()
+                for name, value in scope.get("headers", [])
+                if name.decode("latin-1") == ADMISSION_CLIENT_HEADER
+                for entry in value.decode("latin-1").split(",")
+                if entry.strip()
+            ]
+            # proxies append, so only the rightmost entries can be trusted
+            if len(entries) >= ADMISSION_TRUSTED_HOPS:
+                return entries[-ADMISSION_TRUSTED_HOPS]
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"].rstrip("/") != self.path:
+            await self.app(scope, receive, send)
+            return
+        client = self._client(scope)
+        try:
+            waited = await self.controller.acquire(client)
+        except Overloaded as e:
+            ADMISSION_REJECTED.inc(reason=e.reason)
+            response = JSONResponse(
+                {"detail": "Too many requests, retry later"},
+                status_code=429,
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        ADMISSION_WAIT_SECONDS.observe(waited)
+        trace = current_trace()
+        if trace is not None:
+            trace.add_stage("admission", waited)
+
+        admitted = time.perf_counter()
+        first_byte = None
+        status = 500
+        rate_limited = False
+
+        async def send_wrapper(message):
+            nonlocal first_byte, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            if first_byte is None and message["type"] == "http.response.body" and message.get("body"):
+                first_byte = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            rate_limited = is_rate_limit(e)
+            raise
+        finally:
+            now = time.perf_counter()
+            latency = (first_byte or now) - admitted
+            # an answer that failed inside the stream ends with an empty body, not an error
+            succeeded = first_byte is not None and status < 400
+            self.controller.release(client, now - admitted, latency, rate_limited, succeeded)
+
+
+admission = AdmissionController()
+REGISTRY.register_collector(admission.metrics)
+
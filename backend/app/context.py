@@ -1,11 +1,35 @@
 import os
+from typing import Callable, Sequence
 
+import httpx
+import openai
 from llama_index import ServiceContext
 from llama_index.llms import OpenAI
 
+ResponseHook = Callable[[httpx.Response], None]
 
-def create_base_context():
+
+def with_response_hooks(model, hooks: Sequence[ResponseHook]):
+    '''
+    Give an OpenAI LLM or embedding model clients that call each of `hooks`
+    with every HTTP response, including the ones the OpenAI client retries
+    '''
+    if not hooks:
+        return model
+
+    async def ahook(response: httpx.Response) -> None:
+        for hook in hooks:
+            hook(response)
+
+    kwargs = model._get_credential_kwargs()
+    kwargs.pop("http_client", None)
+    model._client = openai.OpenAI(**kwargs, http_client=httpx.Client(event_hooks={"response": list(hooks)}))
+    model._aclient = openai.AsyncOpenAI(**kwargs, http_client=httpx.AsyncClient(event_hooks={"response": [ahook]}))
+    return model
+
+
+def create_base_context(response_hooks: Sequence[ResponseHook] = ()):
     model = os.getenv("MODEL", "gpt-3.5-turbo")
     return ServiceContext.from_defaults(
-        llm=OpenAI(model=model),
+        llm=with_response_hooks(OpenAI(model=model), response_hooks),
     )
@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import QueuePool
+
+# Shared by the chat backend, the index generator and data_pipe, so every
+# process keeps a single pool per database instead of one engine per call site.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# serverless Postgres (Neon) drops idle connections, recycle before it does
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "300"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+
+class PoolMetrics:
+    '''
+    Counters for one connection pool. `checkout_wait_*` is the time callers
+    spent in `pool.connect()`, i.e. waiting for a free slot plus opening a
+    new connection when the pool had none.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.invalidations = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+
+    def count(self, counter: str) -> None:
+        # pool events fire on whichever thread opens or checks out the connection
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def record_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.checkout_wait_total += seconds
+            self.checkout_wait_max = max(self.checkout_wait_max, seconds)
+
+    def snapshot(self) -> Dict[str, float]:
+        # totals only, rates and averages are left to the scraper
+        with self._lock:
+            return {
+                "connects_total": self.connects,
+                "checkouts_total": self.checkouts,
+                "invalidations_total": self.invalidations,
+                "checkout_wait_seconds_total": self.checkout_wait_total,
+                "checkout_wait_seconds_max": self.checkout_wait_max,
+            }
+
+
+class TimedQueuePool(QueuePool):
+    metrics: PoolMetrics
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            self.metrics.record_wait(time.perf_counter() - start)
+
+    def recreate(self):
+        # engine.dispose() swaps in a new pool, keep counting into the same metrics
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def _instrument(engine: Engine, metrics: PoolMetrics) -> None:
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        metrics.count("connects")
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.count("checkouts")
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.count("invalidations")
+
+
+_engines: Dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(uri: Optional[str] = None) -> Engine:
+    '''
+    Process-wide pooled engine for `uri` (defaults to POSTGRES_URI).
+    '''
+    uri = uri or os.environ["POSTGRES_URI"]
+    engine = _engines.get(uri)
+    if engine is not None:
+        return engine
+    with _engines_lock:
+        engine = _engines.get(uri)
+        if engine is None:
+            if make_url(uri).get_backend_name() == "sqlite":
+                engine = create_engine(uri)
+            else:
+                engine = create_engine(
+                    uri,
+                    poolclass=TimedQueuePool,
+                    pool_size=DB_POOL_SIZE,
+                    max_overflow=DB_MAX_OVERFLOW,
+                    pool_timeout=DB_POOL_TIMEOUT,
+                    pool_recycle=DB_POOL_RECYCLE,
+                    pool_pre_ping=DB_POOL_PRE_PING,
+                )
+                engine.pool.metrics = PoolMetrics()
+                _instrument(engine, engine.pool.metrics)
+            _engines[uri] = engine
+    return engine
+
+
+def pool_metrics() -> Dict[str, Dict[str, float]]:
+    '''
+    Metrics for every pooled engine, keyed by database name.
+    '''
+    result = {}
+    for uri, engine in list(_engines.items()):
+        metrics = getattr(engine.pool, "metrics", None)
+        if metrics is not None:
+            snapshot = metrics.snapshot()
+            snapshot["checked_out"] = engine.pool.checkedout()
+            snapshot["pool_size"] = engine.pool.size()
+            snapshot["overflow"] = engine.pool.overflow()
+            url = make_url(uri)
+            # /metrics is unauthenticated, never label it with the password
+            result[url.database or url.render_as_string(hide_password=True)] = snapshot
+    return result
+
+
+def dispose_engines() -> None:
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
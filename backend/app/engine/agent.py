@@ -0,0 +1,281 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, List, Optional, Tuple, Union, get_args
+
+from llama_index.agent import OpenAIAgent, OpenAIAgentWorker
+from llama_index.agent.openai.step import (
+    DEFAULT_MAX_FUNCTION_CALLS,
+    acall_function,
+    call_function,
+    get_function_by_name,
+)
+from llama_index.agent.runner.base import AgentRunner
+from llama_index.agent.types import Task, TaskStep, TaskStepOutput
+from llama_index.agent.utils import add_user_step_to_memory
+from llama_index.callbacks import CallbackManager, CBEventType, EventPayload
+from llama_index.chat_engine.types import ChatResponseMode
+from llama_index.llms.base import ChatMessage
+from llama_index.llms.openai import OpenAI
+from llama_index.llms.openai_utils import OpenAIToolCall
+from llama_index.llms.types import MessageRole
+from llama_index.memory.types import BaseMemory
+from llama_index.objects.base import ObjectRetriever
+from llama_index.tools import BaseTool, ToolOutput
+
+# run the tool calls of one agent step concurrently instead of one by one
+AGENT_PARALLEL_TOOLS = os.getenv("AGENT_PARALLEL_TOOLS", "true").lower() in ("1", "true", "yes")
+AGENT_TOOL_TIMEOUT = float(os.getenv("AGENT_TOOL_TIMEOUT", "60"))
+# used by the blocking agent path only, the async path awaits the tools directly
+AGENT_TOOL_THREADS = int(os.getenv("AGENT_TOOL_THREADS", "8"))
+
+logger = logging.getLogger("uvicorn")
+
+FunctionResult = Tuple[ChatMessage, ToolOutput]
+
+_tool_executor = None
+_tool_executor_lock = threading.Lock()
+
+
+def _get_tool_executor() -> ThreadPoolExecutor:
+    # kept apart from the chat worker pool: in thread mode the agent itself
+    # runs there, and waiting on tools queued behind it could deadlock
+    global _tool_executor
+    if _tool_executor is None:
+        with _tool_executor_lock:
+            if _tool_executor is None:
+                _tool_executor = ThreadPoolExecutor(
+                    max_workers=AGENT_TOOL_THREADS, thread_name_prefix="agent-tool"
+                )
+    return _tool_executor
+
+
+def shutdown_tool_executor() -> None:
+    global _tool_executor
+    with _tool_executor_lock:
+        if _tool_executor is not None:
+            _tool_executor.shutdown(wait=False, cancel_futures=True)
+            _tool_executor = None
+
+
+def _error_result(tool_call: OpenAIToolCall, message: str, error: Exception = None) -> FunctionResult:
+    name = tool_call.function.name
+    output = ToolOutput(
+        content=message,
+        tool_name=name,
+        raw_input={"kwargs": tool_call.function.arguments},
+        raw_output=error,
+    )
+    function_message = ChatMessage(
+        content=message,
+        role=MessageRole.TOOL,
+        additional_kwargs={"name": name, "tool_call_id": tool_call.id},
+    )
+    return function_message, output
+
+
+def _validate_tool_call(tool_call: OpenAIToolCall) -> None:
+    if not isinstance(tool_call, get_args(OpenAIToolCall)):
+        raise ValueError("Invalid tool_call object")
+    if tool_call.type != "function":
+        raise ValueError("Invalid tool type. Unsupported by OpenAI")
+
+
+class ParallelOpenAIAgentWorker(OpenAIAgentWorker):
+    '''
+    OpenAIAgentWorker that runs all tool calls the model emits in one step at
+    the same time, e.g. `University_DB` and "Location and University" for a
+    question about programmes and the city they are in.
+
+    Every call gets `tool_timeout` seconds; a call that fails or times out is
+    answered with an error message so the others still reach the model. The
+    tool messages are written to memory in the order the model issued the
+    calls, whatever order they finish in.
+    '''
+
+    def __init__(self, *args: Any, tool_timeout: float = AGENT_TOOL_TIMEOUT, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._tool_timeout = tool_timeout
+
+    def _function_event(self, tools: List[BaseTool], tool_call: OpenAIToolCall):
+        return self.callback_manager.event(
+            CBEventType.FUNCTION_CALL,
+            payload={
+                EventPayload.FUNCTION_CALL: tool_call.function.arguments,
+                EventPayload.TOOL: get_function_by_name(
+                    tools, tool_call.function.name
+                ).metadata,
+            },
+        )
+
+    def _call_one(self, tools: List[BaseTool], tool_call: OpenAIToolCall) -> FunctionResult:
+        start = time.perf_counter()
+        try:
+            with self._function_event(tools, tool_call) as event:
+                result = call_function(tools, tool_call, verbose=self._verbose)
+                event.on_end(payload={EventPayload.FUNCTION_OUTPUT: str(result[1])})
+        except Exception as e:
+            result = _error_result(tool_call, f"Error: {e!s}", e)
+        logger.info(f"Tool {tool_call.function.name} took {time.perf_counter() - start:.2f}s")
+        return result
+
+    async def _acall_one(self, tools: List[BaseTool], tool_call: OpenAIToolCall) -> FunctionResult:
+        start = time.perf_counter()
+        try:
+            with self._function_event(tools, tool_call) as event:
+                result = await asyncio.wait_for(
+                    acall_function(tools, tool_call, verbose=self._verbose),
+                    timeout=self._tool_timeout,
+                )
+                event.on_end(payload={EventPayload.FUNCTION_OUTPUT: str(result[1])})
+        except asyncio.TimeoutError as e:
+            result = _error_result(
+                tool_call, f"Error: {tool_call.function.name} timed out after {self._tool_timeout:g}s", e
+            )
+        except Exception as e:
+            result = _error_result(tool_call, f"Error: {e!s}", e)
+        logger.info(f"Tool {tool_call.function.name} took {time.perf_counter() - start:.2f}s")
+        return result
+
+    def _call_functions(
+        self, tools: List[BaseTool], tool_calls: List[OpenAIToolCall]
+    ) -> List[FunctionResult]:
+        # a single call goes through the pool as well, for the timeout
+        executor = _get_tool_executor()
+        futures = [
+            executor.submit(contextvars.copy_context().run, self._call_one, tools, tool_call)
+            for tool_call in tool_calls
+        ]
+        wait(futures, timeout=self._tool_timeout)
+        results = []
+        for tool_call, future in zip(tool_calls, futures):
+            if future.done():
+                results.append(future.result())
+            else:
+                # the thread cannot be interrupted, its late result is dropped
+                future.cancel()
+                results.append(_error_result(
+                    tool_call, f"Error: {tool_call.function.name} timed out after {self._tool_timeout:g}s"
+                ))
+        return results
+
+    async def _acall_functions(
+        self, tools: List[BaseTool], tool_calls: List[OpenAIToolCall]
+    ) -> List[FunctionResult]:
+        return await asyncio.gather(
+            *(self._acall_one(tools, tool_call) for tool_call in tool_calls)
+        )
+
+    def _record_results(self, task: Task, results: List[FunctionResult]) -> None:
+        for function_message, tool_output in results:
+            task.extra_state["sources"].append(tool_output)
+            task.extra_state["new_memory"].put(function_message)
+        task.extra_state["n_function_calls"] += len(results)
+
+    def _step_output(self, step: TaskStep, agent_chat_response: Any, is_done: bool) -> TaskStepOutput:
+        new_steps = (
+            [step.get_next_step(step_id=str(uuid.uuid4()), input=None)]
+            if not is_done
+            else []
+        )
+        return TaskStepOutput(
+            output=agent_chat_response,
+            task_step=step,
+            is_last=is_done,
+            next_steps=new_steps,
+        )
+
+    def _run_step(
+        self,
+        step: TaskStep,
+        task: Task,
+        mode: ChatResponseMode = ChatResponseMode.WAIT,
+        tool_choice: Union[str, dict] = "auto",
+    ) -> TaskStepOutput:
+        if step.input is not None:
+            add_user_step_to_memory(
+                step, task.extra_state["new_memory"], verbose=self._verbose
+            )
+        tools = self.get_tools(task.input)
+        openai_tools = [tool.metadata.to_openai_tool() for tool in tools]
+        llm_chat_kwargs = self._get_llm_chat_kwargs(task, openai_tools, tool_choice)
+        agent_chat_response = self._get_agent_response(task, mode=mode, **llm_chat_kwargs)
+
+        latest_tool_calls = self.get_latest_tool_calls(task) or []
+        is_done = not self._should_continue(
+            latest_tool_calls, task.extra_state["n_function_calls"]
+        )
+        if not is_done:
+            for tool_call in latest_tool_calls:
+                _validate_tool_call(tool_call)
+            self._record_results(task, self._call_functions(tools, latest_tool_calls))
+        return self._step_output(step, agent_chat_response, is_done)
+
+    async def _arun_step(
+        self,
+        step: TaskStep,
+        task: Task,
+        mode: ChatResponseMode = ChatResponseMode.WAIT,
+        tool_choice: Union[str, dict] = "auto",
+    ) -> TaskStepOutput:
+        if step.input is not None:
+            add_user_step_to_memory(
+                step, task.extra_state["new_memory"], verbose=self._verbose
+            )
+        tools = self.get_tools(task.input)
+        openai_tools = [tool.metadata.to_openai_tool() for tool in tools]
+        llm_chat_kwargs = self._get_llm_chat_kwargs(task, openai_tools, tool_choice)
+        agent_chat_response = await self._get_async_agent_response(
+            task, mode=mode, **llm_chat_kwargs
+        )
+
+        latest_tool_calls = self.get_latest_tool_calls(task) or []
+        is_done = not self._should_continue(
+            latest_tool_calls, task.extra_state["n_function_calls"]
+        )
+        if not is_done:
+            for tool_call in latest_tool_calls:
+                _validate_tool_call(tool_call)
+            self._record_results(task, await self._acall_functions(tools, latest_tool_calls))
+        return self._step_output(step, agent_chat_response, is_done)
+
+
+class ParallelOpenAIAgent(OpenAIAgent):
+    '''
+    OpenAIAgent running on a ParallelOpenAIAgentWorker, built the same way
+    through `from_tools`.
+    '''
+
+    def __init__(
+        self,
+        tools: List[BaseTool],
+        llm: OpenAI,
+        memory: BaseMemory,
+        prefix_messages: List[ChatMessage],
+        verbose: bool = False,
+        max_function_calls: int = DEFAULT_MAX_FUNCTION_CALLS,
+        callback_manager: Optional[CallbackManager] = None,
+        tool_retriever: Optional[ObjectRetriever[BaseTool]] = None,
+    ) -> None:
+        callback_manager = callback_manager or llm.callback_manager
+        step_engine = ParallelOpenAIAgentWorker(
+            tools=tools,
+            tool_retriever=tool_retriever,
+            llm=llm,
+            verbose=verbose,
+            max_function_calls=max_function_calls,
+            callback_manager=callback_manager,
+            prefix_messages=prefix_messages,
+        )
+        AgentRunner.__init__(
+            self,
+            step_engine,
+            memory=memory,
+            llm=llm,
+            callback_manager=callback_manager,
+        )
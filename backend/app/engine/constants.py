@@ -1,3 +1,7 @@
+import os
+
 DATA_DIR = "data"  # directory containing the documents to index
 CHUNK_SIZE = 1024
 CHUNK_OVERLAP = 20
+# texts per embedding request (OpenAI accepts up to 2048)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
@@ -1,14 +1,17 @@
+from typing import Sequence
+
 from llama_index import ServiceContext
+from llama_index.embeddings import OpenAIEmbedding
 
-from app.context import create_base_context
-from app.engine.constants import CHUNK_SIZE, CHUNK_OVERLAP
+from app.context import ResponseHook, create_base_context, with_response_hooks
+from app.engine.constants import CHUNK_SIZE, CHUNK_OVERLAP, EMBED_BATCH_SIZE
 
 
-def create_service_context():
-    base = create_base_context()
+def create_service_context(response_hooks: Sequence[ResponseHook] = ()):
+    base = create_base_context(response_hooks)
     return ServiceContext.from_defaults(
         llm=base.llm,
-        embed_model=base.embed_model,
+        embed_model=with_response_hooks(OpenAIEmbedding(embed_batch_size=EMBED_BATCH_SIZE), response_hooks),
         chunk_size=CHUNK_SIZE,
         chunk_overlap=CHUNK_OVERLAP,
     )
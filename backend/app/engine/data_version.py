@@ -0,0 +1,71 @@
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+
+# how long a read of the version stamp is trusted before asking the database again
+POLL_INTERVAL = float(os.getenv("DATA_VERSION_POLL_SECONDS", "30"))
+
+# written by data_pipe after every load, see data_pipe/data_converter.py
+VERSION_TABLE = "DataVersion"
+
+logger = logging.getLogger("uvicorn")
+
+
+class DataVersion:
+    '''
+    Cached view of the data version stamp the data_pipe loader bumps whenever
+    it rewrites the university tables. Caches key their entries on `current()`
+    so a reload invalidates them without any coordination.
+    '''
+
+    def __init__(self, engine, poll_interval: float = POLL_INTERVAL):
+        self._engine = engine
+        self._poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+
+    def _read(self) -> str:
+        try:
+            with self._engine.connect() as conn:
+                row = conn.execute(
+                    text(f'SELECT version FROM "{VERSION_TABLE}" WHERE id = 1')
+                ).fetchone()
+        except SQLAlchemyError as e:
+            if self._table_missing():
+                # tables loaded before the stamp existed; treat them as version 0
+                logger.debug(f"Could not read data version: {e}")
+                return "0"
+            # a dropped connection or pool timeout says nothing about the data,
+            # flipping to "0" and back would wipe every cache twice
+            logger.warning(f"Could not read data version, keeping {self._version}: {e}")
+            return self._version if self._version is not None else "0"
+        return str(row[0]) if row else "0"
+
+    def _table_missing(self) -> bool:
+        try:
+            with self._engine.connect() as conn:
+                return not inspect(conn).has_table(VERSION_TABLE)
+        except SQLAlchemyError:
+            return False
+
+    def current(self) -> str:
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self._poll_interval:
+            return self._version
+        with self._lock:
+            if self._version is None or now - self._checked_at >= self._poll_interval:
+                version = self._read()
+                if self._version is not None and version != self._version:
+                    logger.info(f"Data version changed {self._version} -> {version}")
+                self._version = version
+                self._checked_at = now
+        return self._version
+
+    def refresh(self) -> str:
+        self._checked_at = 0.0
+        return self.current()
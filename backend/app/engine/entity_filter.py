@@ -0,0 +1,238 @@
+import logging
+import os
+import re
+import threading
+import unicodedata
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Set, Tuple
+
+from llama_index import VectorStoreIndex
+from llama_index.callbacks import CallbackManager
+from llama_index.core.base_retriever import BaseRetriever
+from llama_index.schema import NodeWithScore, QueryBundle
+from llama_index.vector_stores.types import (
+    FilterCondition,
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+)
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.engine.data_version import DataVersion
+
+ENTITY_PREFILTER = os.getenv("ENTITY_PREFILTER", "true").lower() in ("1", "true", "yes")
+# minimum difflib ratio for a fuzzy match between a question n-gram and a name
+ENTITY_MATCH_THRESHOLD = float(os.getenv("ENTITY_MATCH_THRESHOLD", "0.88"))
+# a filtered search only looks at the matched entities' chunks, fewer are needed
+ENTITY_FILTER_TOP_K = int(os.getenv("ENTITY_FILTER_TOP_K", "10"))
+
+logger = logging.getLogger("uvicorn")
+
+_NON_WORD_RE = re.compile(r"[^\w]+")
+_ACRONYM_RE = re.compile(r"\b[A-Z]{2,6}\b")
+_ACRONYM_SKIP = {"of", "the", "and", "for", "in", "at", "de", "di", "du", "la", "le"}
+# shorter names are only matched exactly, fuzzy matching them is mostly noise
+_MIN_FUZZY_LENGTH = 5
+
+
+def normalize(value: str) -> str:
+    value = unicodedata.normalize("NFKD", value)
+    value = "".join(c for c in value if not unicodedata.combining(c))
+    return _NON_WORD_RE.sub(" ", value.lower()).strip()
+
+
+def _acronym(name: str) -> Optional[str]:
+    words = [w for w in _NON_WORD_RE.split(name) if w and w.lower() not in _ACRONYM_SKIP]
+    acronym = "".join(w[0] for w in words if w[0].isupper())
+    return acronym if len(acronym) >= 3 else None
+
+
+class EntityMatcher:
+    '''
+    Finds the universities and cities a question mentions, by exact or fuzzy
+    matching of its word n-grams against the known `uni_name` / `location`
+    values, plus upper-case acronyms of university names ("TUM", "MIT").
+
+    Overlapping matches are resolved longest first, so "Technical University
+    of Munich" is not also read as a "University of Munich".
+    '''
+
+    def __init__(self, universities: Dict[str, Optional[str]], threshold: float = ENTITY_MATCH_THRESHOLD):
+        self._threshold = threshold
+        self._location = dict(universities)
+        self._universities_in: Dict[str, Set[str]] = {}
+        for uni, location in universities.items():
+            if location:
+                self._universities_in.setdefault(location, set()).add(uni)
+
+        # normalized name -> [(kind, value)]
+        self._names: Dict[str, List[Tuple[str, str]]] = {}
+        self._acronyms: Dict[str, List[str]] = {}
+        for uni in universities:
+            self._names.setdefault(normalize(uni), []).append(("uni_name", uni))
+            acronym = _acronym(uni)
+            if acronym:
+                self._acronyms.setdefault(acronym, []).append(uni)
+        for location in self._universities_in:
+            self._names.setdefault(normalize(location), []).append(("location", location))
+        self._names.pop("", None)
+        self._lengths = sorted({len(name.split()) for name in self._names}, reverse=True)
+        self._by_length: Dict[int, List[str]] = {}
+        for name in self._names:
+            self._by_length.setdefault(len(name.split()), []).append(name)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def _candidates(self, words: List[str]) -> List[Tuple[int, int, float, str]]:
+        candidates = []
+        for n in self._lengths:
+            names = self._by_length[n]
+            for start in range(len(words) - n + 1):
+                gram = " ".join(words[start:start + n])
+                if gram in self._names:
+                    candidates.append((start, start + n, 1.0, gram))
+                    continue
+                if len(gram) < _MIN_FUZZY_LENGTH:
+                    continue
+                best, best_ratio = None, self._threshold
+                for name in names:
+                    if len(name) < _MIN_FUZZY_LENGTH:
+                        continue
+                    matcher = SequenceMatcher(None, gram, name)
+                    if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                        continue
+                    ratio = matcher.ratio()
+                    if ratio >= best_ratio:
+                        best, best_ratio = name, ratio
+                if best is not None:
+                    candidates.append((start, start + n, best_ratio, best))
+        return candidates
+
+    def match(self, question: str) -> Tuple[Set[str], Set[str]]:
+        '''
+        (uni_name values, location values) mentioned in `question`
+        '''
+        universities: Set[str] = set()
+        locations: Set[str] = set()
+        words = normalize(question).split()
+        taken = [False] * len(words)
+        candidates = self._candidates(words)
+        candidates.sort(key=lambda c: (c[1] - c[0], c[2]), reverse=True)
+        for start, end, _, name in candidates:
+            if any(taken[start:end]):
+                continue
+            taken[start:end] = [True] * (end - start)
+            for kind, value in self._names[name]:
+                (universities if kind == "uni_name" else locations).add(value)
+        for acronym in _ACRONYM_RE.findall(question):
+            universities.update(self._acronyms.get(acronym, ()))
+        return universities, locations
+
+    def filters(self, question: str) -> Optional[MetadataFilters]:
+        '''
+        Metadata filters selecting the chunks about the mentioned universities
+        and cities, or None when the question names neither. A named city
+        brings the universities located there and every university its city,
+        as chunks are tagged with one or the other.
+        '''
+        universities, locations = self.match(question)
+        if not universities and not locations:
+            return None
+        for location in list(locations):
+            universities |= self._universities_in.get(location, set())
+        locations |= {self._location[uni] for uni in universities if self._location.get(uni)}
+        # MetadataFilter only takes scalar values, so one equality per name
+        filters = [
+            MetadataFilter(key="uni_name", value=uni, operator=FilterOperator.EQ)
+            for uni in sorted(universities)
+        ] + [
+            MetadataFilter(key="location", value=location, operator=FilterOperator.EQ)
+            for location in sorted(locations)
+        ]
+        return MetadataFilters(filters=filters, condition=FilterCondition.OR)
+
+
+def load_universities(engine) -> Dict[str, Optional[str]]:
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text('SELECT uni_name, location FROM "University" WHERE uni_name IS NOT NULL')
+        ).fetchall()
+    return {uni: location for uni, location in rows}
+
+
+class EntityFilteredRetriever(BaseRetriever):
+    '''
+    Vector retriever that restricts the similarity search to the chunks
+    tagged with the universities / cities named in the question, using
+    EntityMatcher instead of an LLM call. Questions without a known entity,
+    or whose filtered search comes back empty, get the plain top-k search.
+
+    The names are loaded from the University table and reloaded whenever the
+    data version changes.
+    '''
+
+    def __init__(
+        self,
+        index: VectorStoreIndex,
+        engine,
+        data_version: DataVersion,
+        similarity_top_k: int = 20,
+        filtered_top_k: int = ENTITY_FILTER_TOP_K,
+        callback_manager: Optional[CallbackManager] = None,
+    ):
+        super().__init__(callback_manager=callback_manager)
+        self._index = index
+        self._engine = engine
+        self._data_version = data_version
+        self._similarity_top_k = similarity_top_k
+        self._filtered_top_k = filtered_top_k
+        self._lock = threading.Lock()
+        self._matcher = None
+        self._version = None
+
+    def _get_matcher(self) -> EntityMatcher:
+        version = self._data_version.current()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    try:
+                        self._matcher = EntityMatcher(load_universities(self._engine))
+                        logger.info(f"Loaded {len(self._matcher)} university and city names for prefiltering")
+                    except SQLAlchemyError as e:
+                        logger.warning(f"Could not load university names, not prefiltering: {e}")
+                        self._matcher = EntityMatcher({})
+                    self._version = version
+        return self._matcher
+
+    def _filtered_retriever(self, query_bundle: QueryBundle) -> Optional[BaseRetriever]:
+        filters = self._get_matcher().filters(query_bundle.query_str)
+        if filters is None:
+            return None
+        logger.info(f"Prefiltering retrieval on {[(f.key, f.value) for f in filters.filters]}")
+        return self._index.as_retriever(similarity_top_k=self._filtered_top_k, filters=filters)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        retriever = self._filtered_retriever(query_bundle)
+        if retriever is not None:
+            try:
+                nodes = retriever.retrieve(query_bundle)
+                if nodes:
+                    return nodes
+            except Exception as e:
+                logger.warning(f"Filtered retrieval failed, searching everything: {e}")
+        return self._index.as_retriever(similarity_top_k=self._similarity_top_k).retrieve(query_bundle)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        retriever = self._filtered_retriever(query_bundle)
+        if retriever is not None:
+            try:
+                nodes = await retriever.aretrieve(query_bundle)
+                if nodes:
+                    return nodes
+            except Exception as e:
+                logger.warning(f"Filtered retrieval failed, searching everything: {e}")
+        return await self._index.as_retriever(
+            similarity_top_k=self._similarity_top_k
+        ).aretrieve(query_bundle)
@@ -0,0 +1,141 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, List, Optional
+
+from llama_index.llms.base import ChatMessage
+from llama_index.tools import BaseTool, ToolMetadata, ToolOutput
+from llama_index.tools.types import AsyncBaseTool
+
+# "async" streams through the agent's astream_chat, "thread" runs the blocking
+# stream_chat in the worker pool and hands tokens back to the event loop
+EXECUTION_MODE = os.getenv("CHAT_EXECUTION_MODE", "async")
+WORKER_THREADS = int(os.getenv("CHAT_WORKER_THREADS", "16"))
+# max tokens a worker thread may get ahead of a slow client
+STREAM_BUFFER = int(os.getenv("CHAT_STREAM_BUFFER", "64"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    '''
+    Bounded pool shared by every blocking call made on behalf of a chat request
+    (tool calls in async mode, the whole agent run in thread mode).
+    '''
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=WORKER_THREADS, thread_name_prefix="chat-worker"
+                )
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+async def run_blocking(fn, *args: Any, **kwargs: Any) -> Any:
+    loop = asyncio.get_running_loop()
+    # carry the request's context (its metrics trace) into the worker thread
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), partial(context.run, fn, *args, **kwargs))
+
+
+class OffloadedTool(AsyncBaseTool):
+    '''
+    Tool wrapper whose async path runs the synchronous tool in the worker pool.
+
+    The query engines behind our tools (SQLDatabase, MongoDB) only do blocking
+    I/O, so their "async" methods would otherwise stall the event loop.
+    '''
+
+    def __init__(self, tool: BaseTool):
+        self._tool = tool
+
+    @property
+    def metadata(self) -> ToolMetadata:
+        return self._tool.metadata
+
+    @property
+    def tool(self) -> BaseTool:
+        return self._tool
+
+    def call(self, *args: Any, **kwargs: Any) -> ToolOutput:
+        return self._tool(*args, **kwargs)
+
+    async def acall(self, *args: Any, **kwargs: Any) -> ToolOutput:
+        return await run_blocking(self._tool, *args, **kwargs)
+
+
+async def _astream(chat_engine, message: str, history: List[ChatMessage]) -> AsyncIterator[str]:
+    response = await chat_engine.astream_chat(message, history)
+    async for token in response.async_response_gen():
+        yield token
+
+
+async def _threaded_stream(chat_engine, message: str, history: List[ChatMessage]) -> AsyncIterator[str]:
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    # free places in the queue, taken by the worker and given back by the reader
+    slots = threading.Semaphore(STREAM_BUFFER)
+    stopped = threading.Event()
+    done = object()
+
+    def hand_off(item) -> None:
+        # blocks the worker while the buffer is full, so a slow client
+        # throttles the producer instead of growing an unbounded buffer
+        while not stopped.is_set():
+            if slots.acquire(timeout=1.0):
+                if not stopped.is_set():
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+                return
+
+    def produce() -> None:
+        try:
+            response = chat_engine.stream_chat(message, history)
+            for token in response.response_gen:
+                if stopped.is_set():
+                    break
+                hand_off(token)
+        except BaseException as e:
+            hand_off(e)
+        finally:
+            hand_off(done)
+
+    loop.run_in_executor(get_executor(), contextvars.copy_context().run, produce)
+    try:
+        while True:
+            item = await queue.get()
+            slots.release()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # the producer notices `stopped` at its next token and exits on its own;
+        # a free slot wakes it if it waits on a full buffer
+        stopped.set()
+        slots.release()
+
+
+def stream_chat(
+    chat_engine, message: str, history: List[ChatMessage], mode: Optional[str] = None
+) -> AsyncIterator[str]:
+    '''
+    Stream the agent's answer without blocking the event loop.
+    '''
+    mode = mode or EXECUTION_MODE
+    if mode == "thread" or not hasattr(chat_engine, "astream_chat"):
+        return _threaded_stream(chat_engine, message, history)
+    return _astream(chat_engine, message, history)
@@ -3,20 +3,19 @@ from dotenv import load_dotenv
 load_dotenv()
 import os
 import logging
-from llama_index.vector_stores import MongoDBAtlasVectorSearch
 
+from app.db import get_engine
 from app.engine.constants import CHUNK_SIZE
 from app.engine.context import create_service_context
-
-from sqlalchemy import create_engine
+from app.engine.indexing import IndexingPipeline, split_documents
+from app.engine.vector_store import create_chunk_manifest, create_vector_store
+from app.engine.wiki_cache import WikiPageCache
 
 from llama_index import (
     SimpleDirectoryReader,
     VectorStoreIndex,
-    StorageContext,
 )
 
-from llama_index.readers import WikipediaReader
 from llama_index.node_parser import TokenTextSplitter
 from llama_index.vector_stores.types import MetadataInfo, VectorStoreInfo
 from llama_index.indices.vector_store import VectorIndexAutoRetriever
@@ -49,50 +48,28 @@ def generate_datasource(service_context):
 # See https://github.com/run-llama/mongodb-demo/tree/main?tab=readme-ov-file#create-a-vector-search-index"""
 #     )
     
-    engine = create_engine(os.environ["POSTGRES_URI"])
+    engine = get_engine()
 
     node_parser = TokenTextSplitter(chunk_size= CHUNK_SIZE)
 
-    store= MongoDBAtlasVectorSearch(
-        db_name = os.environ["MONGODB_DATABASE"],
-        collection_name=os.environ["MONGODB_VECTORS"],
-    )
-    storage_context = StorageContext.from_defaults(vector_store= store)
-    vector_index = VectorStoreIndex([], storage_context=storage_context)
+    store= create_vector_store()
 
     with engine.connect() as cursor:
 
-        uni_name = [x[0] for x in cursor.exec_driver_sql('SELECT DISTINCT uni_name FROM "University"').fetchall()]
-        cities = [x[0] for x in cursor.exec_driver_sql('SELECT DISTINCT location FROM "University"').fetchall()]
+        uni_name = [x[0] for x in cursor.exec_driver_sql('SELECT DISTINCT uni_name FROM "University" WHERE uni_name IS NOT NULL').fetchall()]
+        cities = [x[0] for x in cursor.exec_driver_sql('SELECT DISTINCT location FROM "University" WHERE location IS NOT NULL').fetchall()]
 
-        uni_docs = WikipediaReader().load_data(pages= uni_name[:-1])
-        cities_docs = WikipediaReader().load_data(pages= cities[:-1])
-        
-        # print(uni_docs, cities_docs, sep="\n\n\n")
-    
-    # print(node_parser.get_nodes_from_documents(uni_docs))
-        
-    # for (city, city_node), (uni, uni_node) in zip(zip(cities, cities_nodes), zip(uni_name, uni_nodes)):
+    # one concurrent fetch for both lists, served from the page cache when current
+    docs = WikiPageCache().load(uni_name + cities)
 
-    #     city_node.metadata = {"location": city}
-    #     uni_node.metadata = {"uni_name": uni}
-
-    # vector_index.insert_nodes(cities_nodes)
-    # vector_index.insert_nodes(uni_nodes)
-    
-    for (city, city_doc), (uni, uni_doc) in zip(zip(cities, cities_docs), zip(uni_name, uni_docs)):
-        city_nodes = node_parser.get_nodes_from_documents([city_doc])
-        uni_nodes = node_parser.get_nodes_from_documents([uni_doc])
-
-        for node in city_nodes:
-            node.metadata = {"location": city}
-            # Additional processing specific to city nodes if needed
-        
-        for node in uni_nodes:
-            node.metadata = {"uni_name": uni}
-            # Additional processing specific to university nodes if needed
-
-        vector_index.insert_nodes(nodes=city_nodes + uni_nodes)
+    # split everything up front, then embed and write in large batches
+    nodes = split_documents(
+        node_parser,
+        [(docs[city], {"location": city}) for city in cities]
+        + [(docs[uni], {"uni_name": uni}) for uni in uni_name],
+    )
+    # only new or changed chunks are embedded, vanished ones are deleted
+    IndexingPipeline(service_context.embed_model, store).sync(nodes, create_chunk_manifest())
 
     vector_store_info = VectorStoreInfo(
         content_info="articles about different universities and their location",
@@ -110,6 +87,8 @@ def generate_datasource(service_context):
         ]
     )
 
+    vector_index = VectorStoreIndex.from_vector_store(store, service_context=service_context)
+
     VectorIndexAutoRetriever(
         index= vector_index,
         vector_store_info= vector_store_info
@@ -1,70 +1,218 @@
 import logging
 import os
-
-from sqlalchemy import create_engine
+import threading
 
 from llama_index import (
     VectorStoreIndex,
     SQLDatabase
 )
-from llama_index.vector_stores import MongoDBAtlasVectorSearch
-from llama_index.indices.struct_store.sql_query import NLSQLTableQueryEngine
+from llama_index.query_engine import RetrieverQueryEngine
 from llama_index.tools import QueryEngineTool, ToolMetadata
 from llama_index.agent import ReActAgent, OpenAIAgentWorker, AgentRunner, OpenAIAgent
 
+from app.db import get_engine, pool_metrics
+from app.engine.agent import AGENT_PARALLEL_TOOLS, ParallelOpenAIAgent
 from app.engine.context import create_service_context
+from app.engine.data_version import DataVersion
+from app.engine.entity_filter import ENTITY_PREFILTER, EntityFilteredRetriever
+from app.engine.sql_cache import CachedNLSQLTableQueryEngine, CachedSQLDatabase, SQLCache
+from app.engine.executor import OffloadedTool
+from app.engine.memory import ConversationMemory
+from app.engine.postprocessors import BudgetedMMRPostprocessor
+from app.engine.semantic_cache import SEMANTIC_CACHE_ENABLED, SemanticCache
+from app.engine.sessions import create_session_store
+from app.engine.single_flight import SingleFlight
+from app.engine.tracing import MetricsCallbackHandler
+from app.metrics import REGISTRY, timed
+from app.engine.vector_store import VECTOR_STORE, create_vector_store
 
 
+SQL_TABLES = ["University", "Programme", "ProgrammeDescription", "TestType"]
 
-def get_chat_engine():
-    service_context = create_service_context()
-    logger = logging.getLogger("uvicorn")
-    logger.info("Connecting to index from MongoDB...")
-    store = MongoDBAtlasVectorSearch(
-        db_name=os.environ["MONGODB_DATABASE"],
-        collection_name=os.environ["MONGODB_VECTORS"],
-        index_name=os.environ["MONGODB_VECTOR_INDEX"],
-    )
-    
-    vector_index = VectorStoreIndex.from_vector_store(store, service_context)
-    vector_query_engine = vector_index.as_query_engine(similarity_top_k=20)
-    logger.info("Finished connecting to index from MongoDB.")
-
-    engine = create_engine(os.environ['POSTGRES_URI'])
-    sql_db = SQLDatabase(
-        engine= engine,
-        include_tables= ["University", "Programme", "ProgrammeDescription", "TestType"]
-    )
-
-    # sql_db._engine.
-    sql_query_engine = NLSQLTableQueryEngine(
-        sql_database= sql_db,
-        tables= ["University", "Programme", "ProgrammeDescription", "TestType"]
-    )
-
-    query_engine_tools = [
-        QueryEngineTool(
-            query_engine= sql_query_engine,
-            metadata= ToolMetadata(
-                name="University_DB",
-                description='''
-                    Useful for translating a natural language query into a SQL query over"
-                    different tables containing information about different programs at "
-                    each universityy
-                    '''
+
+class EngineRegistry:
+    '''
+    Process-wide holder for everything that is expensive to build: the service
+    context and its OpenAI client, the vector store, the SQLAlchemy
+    engine (and its pool), the reflected SQLDatabase and the query engine tools.
+
+    `warm()` builds them once (normally from the FastAPI lifespan hook); every
+    chat request then gets its own lightweight agent over the shared tools.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # conversations outlive a rebuild of the engine components
+        self.sessions = create_session_store()
+        self.flights = SingleFlight()
+        # called with every OpenAI HTTP response, registered before warm()
+        self.response_hooks = []
+        self._reset()
+
+    def _reset(self):
+        self.service_context = None
+        self.vector_store = None
+        self.vector_index = None
+        self.sql_engine = None
+        self.sql_database = None
+        self.data_version = None
+        self.sql_cache = None
+        self.semantic_cache = None
+        self.memory = None
+        self.tools = None
+
+    @property
+    def is_warm(self):
+        return self.tools is not None
+
+    def warm(self):
+        if self.is_warm:
+            return
+        with self._lock:
+            if self.is_warm:
+                return
+            self._build()
+
+    def _build(self):
+        logger = logging.getLogger("uvicorn")
+        service_context = create_service_context(self.response_hooks)
+        # shared by the LLM, the embedding model and the query engines
+        service_context.callback_manager.add_handler(MetricsCallbackHandler())
+
+        logger.info(f"Connecting to index from {VECTOR_STORE} vector store...")
+        store = create_vector_store()
+
+        vector_index = VectorStoreIndex.from_vector_store(store, service_context)
+        logger.info("Finished connecting to index.")
+
+        engine = get_engine()
+        data_version = DataVersion(engine)
+
+        if ENTITY_PREFILTER:
+            # search only the chunks of the universities / cities the question names
+            vector_query_engine = RetrieverQueryEngine.from_args(
+                EntityFilteredRetriever(vector_index, engine, data_version, similarity_top_k=20),
+                service_context=service_context,
+                node_postprocessors=[BudgetedMMRPostprocessor()]
             )
-        ),
-        QueryEngineTool(
-            query_engine= vector_query_engine,
-            metadata=  ToolMetadata(
-                name = "Location and University",
-                description= "helps in giving historical, geographical, cultural information about the university and where its located."
+        else:
+            vector_query_engine = vector_index.as_query_engine(
+                similarity_top_k=20,
+                node_postprocessors=[BudgetedMMRPostprocessor()]
             )
+        sql_cache = SQLCache(data_version)
+        sql_db = CachedSQLDatabase(
+            engine= engine,
+            include_tables= SQL_TABLES,
+            sql_cache= sql_cache
+        )
+
+        sql_query_engine = CachedNLSQLTableQueryEngine(
+            sql_database= sql_db,
+            sql_cache= sql_cache,
+            tables= SQL_TABLES,
+            service_context= service_context
         )
-    ]
 
+        query_engine_tools = [
+            QueryEngineTool(
+                query_engine= sql_query_engine,
+                metadata= ToolMetadata(
+                    name="University_DB",
+                    description='''
+                        Useful for translating a natural language query into a SQL query over"
+                        different tables containing information about different programs at "
+                        each universityy
+                        '''
+                )
+            ),
+            QueryEngineTool(
+                query_engine= vector_query_engine,
+                metadata=  ToolMetadata(
+                    name = "Location and University",
+                    description= "helps in giving historical, geographical, cultural information about the university and where its located."
+                )
+            )
+        ]
+
+        self.service_context = service_context
+        self.vector_store = store
+        self.vector_index = vector_index
+        self.sql_engine = engine
+        self.sql_database = sql_db
+        self.data_version = data_version
+        self.sql_cache = sql_cache
+        if SEMANTIC_CACHE_ENABLED:
+            self.semantic_cache = SemanticCache(service_context.embed_model, data_version)
+        self.memory = ConversationMemory(service_context.llm)
+        self.tools = [OffloadedTool(tool) for tool in query_engine_tools]
+        logger.info("Chat engine components are ready.")
+
+    def create_agent(self, chat_history=None):
+        '''
+        Build a per-conversation agent. Only the agent and its memory are new,
+        the LLM client, connection pools and reflected schema are shared.
+        '''
+        self.warm()
+        agent_cls = ParallelOpenAIAgent if AGENT_PARALLEL_TOOLS else OpenAIAgent
+        return agent_cls.from_tools(
+            self.tools,
+            llm= self.service_context.llm,
+            chat_history= chat_history,
+            verbose= True
+        )
+
+    def metrics(self):
+        '''
+        Cache, session and connection pool statistics for /metrics
+        '''
+        caches = {}
+        if self.sql_cache is not None:
+            caches.update(self.sql_cache.stats())
+        if self.semantic_cache is not None:
+            caches["semantic"] = self.semantic_cache.stats()
+        if self.memory is not None:
+            caches["summary"] = self.memory.stats()
+        caches["sessions"] = self.sessions.stats()
+        for stat in ("size", "hits", "misses", "evictions"):
+            kind = "gauge" if stat == "size" else "counter"
+            values = {
+                (("cache", name),): stats[stat] for name, stats in caches.items() if stat in stats
+            }
+            yield f"chat_cache_{stat}", f"Cache {stat} by cache", kind, values
+
+        pools = pool_metrics()
+        if pools:
+            for stat in next(iter(pools.values())):
+                kind = "counter" if stat.endswith("_total") else "gauge"
+                values = {(("database", database),): stats[stat] for database, stats in pools.items()}
+                yield f"db_pool_{stat}", f"Connection pool {stat.replace('_', ' ')}", kind, values
+
+        yield "chat_coalesce_in_flight", "Answers currently streamed to coalesced requests", "gauge", {
+            (): self.flights.stats()["in_flight"]
+        }
+
+    def close(self):
+        with self._lock:
+            if self.sql_engine is not None:
+                self.sql_engine.dispose()
+            if self.vector_store is not None and self.vector_store.client is not None:
+                self.vector_store.client.close()
+            self._reset()
+
+
+registry = EngineRegistry()
+REGISTRY.register_collector(registry.metrics)
+
+
+def get_chat_engine():
     # agent = ReActAgent.from_tools(query_engine_tools, llm = service_context.llm, verbose= True)
     # agent = AgentRunner(agent)
-    
-    
-    return OpenAIAgent.from_tools(query_engine_tools, llm = service_context.llm, verbose= True)
+
+    with timed("engine"):
+        return registry.create_agent()
+
+
+def get_chat_engine_factory():
+    # the agent is only built by requests that run it, not for cached or coalesced answers
+    return get_chat_engine
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import logging
+import os
+import uuid
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from llama_index.schema import BaseNode, MetadataMode, NodeRelationship, RelatedNodeInfo
+
+INDEX_MANIFEST_DIR = os.getenv("INDEX_MANIFEST_DIR", "storage/index")
+# bump when chunk ids are derived differently so old manifests trigger a rebuild
+MANIFEST_FORMAT = 1
+
+logger = logging.getLogger()
+
+
+def chunk_hash(node: BaseNode) -> str:
+    text = node.get_content(metadata_mode=MetadataMode.NONE)
+    metadata = json.dumps(node.metadata, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f"{metadata}\n{text}".encode()).hexdigest()
+
+
+def assign_content_ids(nodes: Sequence[BaseNode]) -> List[BaseNode]:
+    '''
+    Give every chunk an id derived from its text and metadata, so the same
+    chunk gets the same id on every run, and drop repeated chunks. Previous /
+    next relationships are pointed at the new ids.
+    '''
+    new_ids = {node.node_id: str(uuid.UUID(chunk_hash(node)[:32])) for node in nodes}
+    unique = {}
+    for node in nodes:
+        node.id_ = new_ids[node.node_id]
+        for relation in (NodeRelationship.PREVIOUS, NodeRelationship.NEXT):
+            related = node.relationships.get(relation)
+            if isinstance(related, RelatedNodeInfo) and related.node_id in new_ids:
+                related.node_id = new_ids[related.node_id]
+        unique.setdefault(node.node_id, node)
+    return list(unique.values())
+
+
+class ChunkManifest:
+    '''
+    Record of the chunks currently in a vector store: node id -> chunk hash,
+    plus the embedding model that produced the vectors.
+
+    `diff` tells which chunks have to be embedded and which stored ones are
+    gone (changed chunks, or pages and universities that disappeared). It is
+    only saved once the store has been written, so an interrupted run simply
+    redoes its changes.
+    '''
+
+    def __init__(self, path: str):
+        self._path = path
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def load(self, embed_model_name: str) -> Optional[Dict[str, str]]:
+        '''
+        Stored node id -> hash, or None when the store contents are unknown
+        and it has to be rebuilt from scratch
+        '''
+        try:
+            with open(self._path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable index manifest {self._path}: {e}")
+            return None
+        if manifest.get("format") != MANIFEST_FORMAT:
+            return None
+        if manifest.get("embed_model") != embed_model_name:
+            logger.info("Embedding model changed, rebuilding the index")
+            return None
+        return manifest["chunks"]
+
+    def save(self, nodes: Sequence[BaseNode], embed_model_name: str) -> None:
+        os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "format": MANIFEST_FORMAT,
+                "embed_model": embed_model_name,
+                "chunks": {node.node_id: chunk_hash(node) for node in nodes},
+            }, f)
+        os.replace(tmp_path, self._path)
+
+    @staticmethod
+    def diff(
+        nodes: Sequence[BaseNode], stored: Dict[str, str]
+    ) -> Tuple[List[BaseNode], List[str]]:
+        '''
+        (chunks to embed and write, stored node ids to delete)
+        '''
+        current = {node.node_id for node in nodes}
+        new_nodes = [node for node in nodes if node.node_id not in stored]
+        stale_ids = [node_id for node_id in stored if node_id not in current]
+        return new_nodes, stale_ids
@@ -0,0 +1,153 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from llama_index.embeddings.base import BaseEmbedding
+from llama_index.node_parser import NodeParser
+from llama_index.schema import BaseNode, Document, MetadataMode
+from llama_index.utils import get_tokenizer
+from llama_index.vector_stores.types import VectorStore
+
+from app.engine.index_manifest import ChunkManifest, assign_content_ids
+from app.engine.vector_store import clear_vector_store, delete_vector_nodes, persist_vector_store
+
+# embedding requests in flight at the same time
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+# nodes per vector_store.add call
+VECTOR_WRITE_BATCH = int(os.getenv("VECTOR_WRITE_BATCH", "1000"))
+
+logger = logging.getLogger()
+
+
+def split_documents(
+    node_parser: NodeParser, documents: Sequence[Tuple[Document, Dict[str, Any]]]
+) -> List[BaseNode]:
+    '''
+    Split every document up front, giving each chunk its document's metadata
+    and an id derived from its content
+    '''
+    nodes = []
+    for document, metadata in documents:
+        for node in node_parser.get_nodes_from_documents([document]):
+            node.metadata = dict(metadata)
+            nodes.append(node)
+    return assign_content_ids(nodes)
+
+
+class IndexingPipeline:
+    '''
+    Embeds chunks in batches of `batch_size` texts with up to `concurrency`
+    requests in flight, and writes them to `vector_store` in batches of
+    `write_batch` nodes, in the order they were given.
+
+    `run` returns throughput figures (chunks and embedding tokens per second)
+    and logs them, so runs against the real or a fake embedding model can be
+    compared.
+    '''
+
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        vector_store: VectorStore,
+        batch_size: Optional[int] = None,
+        concurrency: int = EMBED_CONCURRENCY,
+        write_batch: int = VECTOR_WRITE_BATCH,
+    ):
+        self._embed_model = embed_model
+        self._vector_store = vector_store
+        self._batch_size = max(batch_size or embed_model.embed_batch_size, 1)
+        self._concurrency = max(concurrency, 1)
+        self._write_batch = max(write_batch, 1)
+        self._tokenizer = get_tokenizer()
+
+    def _embed_batch(self, nodes: List[BaseNode]) -> Tuple[List[BaseNode], int]:
+        # same text VectorStoreIndex embeds
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        embeddings = self._embed_model.get_text_embedding_batch(texts)
+        for node, embedding in zip(nodes, embeddings):
+            node.embedding = embedding
+        return nodes, sum(len(self._tokenizer(text)) for text in texts)
+
+    def embed(self, nodes: Sequence[BaseNode]) -> Iterator[Tuple[List[BaseNode], int]]:
+        '''
+        Yield (embedded nodes, token count) per batch, in input order
+        '''
+        batches = [
+            list(nodes[i:i + self._batch_size]) for i in range(0, len(nodes), self._batch_size)
+        ]
+        if len(batches) <= 1 or self._concurrency == 1:
+            for batch in batches:
+                yield self._embed_batch(batch)
+            return
+        with ThreadPoolExecutor(max_workers=self._concurrency, thread_name_prefix="embed") as executor:
+            futures = [executor.submit(self._embed_batch, batch) for batch in batches]
+            try:
+                for future in futures:
+                    yield future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def run(self, nodes: Sequence[BaseNode]) -> Dict[str, float]:
+        start = time.perf_counter()
+        tokens = 0
+        written = 0
+        write_seconds = 0.0
+        pending: List[BaseNode] = []
+        for batch, batch_tokens in self.embed(nodes):
+            tokens += batch_tokens
+            pending.extend(batch)
+            if len(pending) >= self._write_batch:
+                write_start = time.perf_counter()
+                self._vector_store.add(pending)
+                write_seconds += time.perf_counter() - write_start
+                written += len(pending)
+                pending = []
+        if pending:
+            write_start = time.perf_counter()
+            self._vector_store.add(pending)
+            write_seconds += time.perf_counter() - write_start
+            written += len(pending)
+
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        stats = {
+            "chunks": written,
+            "tokens": tokens,
+            "seconds": elapsed,
+            "write_seconds": write_seconds,
+            "chunks_per_second": written / elapsed,
+            "tokens_per_second": tokens / elapsed,
+        }
+        logger.info(
+            f"Indexed {written} chunks ({tokens} tokens) in {elapsed:.2f}s: "
+            f"{stats['chunks_per_second']:.1f} chunks/s, {stats['tokens_per_second']:.0f} tokens/s, "
+            f"{write_seconds:.2f}s writing"
+        )
+        return stats
+
+    def sync(self, nodes: Sequence[BaseNode], manifest: ChunkManifest) -> Dict[str, float]:
+        '''
+        Bring the store in line with `nodes`: embed and write only the chunks
+        the manifest does not know, delete the ones that are gone, then save
+        the manifest. Without a usable manifest the store is rebuilt.
+        '''
+        model_name = self._embed_model.model_name
+        stored = manifest.load(model_name)
+        if stored is None:
+            logger.info(f"No index manifest at {manifest.path}, rebuilding the vector store")
+            clear_vector_store(self._vector_store)
+            stored = {}
+        new_nodes, stale_ids = manifest.diff(nodes, stored)
+        # new ids are deleted as well, in case an interrupted run already wrote them
+        delete_vector_nodes(self._vector_store, stale_ids + [node.node_id for node in new_nodes])
+        stats = self.run(new_nodes)
+        persist_vector_store(self._vector_store)
+        manifest.save(nodes, model_name)
+        stats.update(unchanged=len(nodes) - len(new_nodes), deleted=len(stale_ids))
+        logger.info(
+            f"Index sync: {len(new_nodes)} chunks embedded, {stats['unchanged']} unchanged, "
+            f"{len(stale_ids)} deleted"
+        )
+        return stats
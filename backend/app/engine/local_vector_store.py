@@ -0,0 +1,255 @@
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index.schema import BaseNode, MetadataMode
+from llama_index.vector_stores.types import (
+    FilterCondition,
+    FilterOperator,
+    MetadataFilters,
+    VectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from llama_index.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_FILE = "embeddings.npy"
+NODES_FILE = "nodes.json"
+
+
+def _object_array(values: Sequence[Any]) -> np.ndarray:
+    array = np.empty(len(values), dtype=object)
+    array[:] = list(values)
+    return array
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class LocalVectorStore(VectorStore):
+    '''
+    Array-backed vector store for running and benchmarking without MongoDB.
+
+    Embeddings are kept L2-normalized in one float32 matrix (memory-mapped
+    from `embeddings.npy` when loaded from disk), so a search is a single
+    vectorized dot product. Node metadata is also held column-wise, which
+    lets `location` / `uni_name` style filters be evaluated as array masks
+    before scoring.
+    '''
+
+    stores_text: bool = True
+    flat_metadata: bool = True
+
+    def __init__(self, persist_dir: Optional[str] = None):
+        self._persist_dir = persist_dir
+        self._lock = threading.RLock()
+        self._embeddings = np.zeros((0, 0), dtype=np.float32)
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._node_dicts: List[Dict[str, Any]] = []
+        self._columns: Dict[str, np.ndarray] = {}
+        self._ref_doc_ids = np.zeros(0, dtype=object)
+        self._alive = np.zeros(0, dtype=bool)
+        # rehydrating nodes from their dicts costs more than the search itself
+        self._node_cache: Dict[int, BaseNode] = {}
+        if persist_dir and os.path.exists(os.path.join(persist_dir, NODES_FILE)):
+            self._load(persist_dir)
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    def __len__(self) -> int:
+        return int(self._alive.sum())
+
+    def _load(self, persist_dir: str) -> None:
+        with open(os.path.join(persist_dir, NODES_FILE)) as f:
+            data = json.load(f)
+        self._embeddings = np.load(os.path.join(persist_dir, EMBEDDINGS_FILE), mmap_mode="r")
+        self._ids = data["ids"]
+        self._texts = data["texts"]
+        self._node_dicts = data["nodes"]
+        self._columns = {k: _object_array(v) for k, v in data["columns"].items()}
+        self._ref_doc_ids = _object_array(data["ref_doc_ids"])
+        self._alive = np.ones(len(self._ids), dtype=bool)
+        self._node_cache = {}
+        logger.info(f"Loaded {len(self._ids)} vectors from {persist_dir}")
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        vectors = _normalize(np.asarray([n.get_embedding() for n in nodes], dtype=np.float32))
+        ids = [n.node_id for n in nodes]
+        with self._lock:
+            n_old = len(self._ids)
+            if n_old == 0:
+                self._embeddings = vectors
+            else:
+                self._embeddings = np.concatenate([self._embeddings, vectors])
+            self._ids.extend(ids)
+            self._texts.extend(n.get_content(metadata_mode=MetadataMode.NONE) or "" for n in nodes)
+            self._node_dicts.extend(
+                node_to_metadata_dict(n, remove_text=True, flat_metadata=self.flat_metadata)
+                for n in nodes
+            )
+            keys = set(self._columns) | {k for n in nodes for k in n.metadata}
+            columns = {}
+            for key in keys:
+                old = self._columns.get(key)
+                if old is None:
+                    old = np.full(n_old, None, dtype=object)
+                columns[key] = np.concatenate([old, _object_array([n.metadata.get(key) for n in nodes])])
+            self._columns = columns
+            self._ref_doc_ids = np.concatenate(
+                [self._ref_doc_ids, _object_array([n.ref_doc_id for n in nodes])]
+            )
+            self._alive = np.concatenate([self._alive, np.ones(len(nodes), dtype=bool)])
+        return ids
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        with self._lock:
+            self._alive = self._alive & (self._ref_doc_ids != ref_doc_id)
+
+    def delete_nodes(self, node_ids: Sequence[str]) -> None:
+        with self._lock:
+            self._alive = self._alive & ~np.isin(_object_array(self._ids), list(node_ids))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._alive = np.zeros(len(self._ids), dtype=bool)
+
+    def _filter_mask(self, filters: Optional[MetadataFilters]) -> np.ndarray:
+        n = len(self._ids)
+        if filters is None or not filters.filters:
+            return np.ones(n, dtype=bool)
+        masks = []
+        for f in filters.filters:
+            column = self._columns.get(f.key)
+            if column is None:
+                masks.append(np.zeros(n, dtype=bool))
+                continue
+            operator = getattr(f, "operator", FilterOperator.EQ)
+            if operator == FilterOperator.EQ:
+                masks.append(column == f.value)
+            elif operator == FilterOperator.NE:
+                masks.append(column != f.value)
+            elif operator == FilterOperator.IN:
+                masks.append(np.isin(column, list(f.value)))
+            elif operator == FilterOperator.NIN:
+                masks.append(~np.isin(column, list(f.value)))
+            else:
+                compare = {
+                    FilterOperator.GT: lambda v: v > f.value,
+                    FilterOperator.LT: lambda v: v < f.value,
+                    FilterOperator.GTE: lambda v: v >= f.value,
+                    FilterOperator.LTE: lambda v: v <= f.value,
+                }[operator]
+                masks.append(np.array([v is not None and compare(v) for v in column], dtype=bool))
+        if filters.condition == FilterCondition.OR:
+            return np.logical_or.reduce(masks)
+        return np.logical_and.reduce(masks)
+
+    def _candidates(self, query: VectorStoreQuery) -> np.ndarray:
+        mask = self._alive & self._filter_mask(query.filters)
+        if query.node_ids:
+            mask &= np.isin(_object_array(self._ids), query.node_ids)
+        if query.doc_ids:
+            mask &= np.isin(self._ref_doc_ids, query.doc_ids)
+        return np.flatnonzero(mask)
+
+    def _node(self, row: int) -> BaseNode:
+        node = self._node_cache.get(row)
+        if node is None:
+            node = metadata_dict_to_node(self._node_dicts[row], text=self._texts[row])
+            self._node_cache[row] = node
+        # callers may annotate the nodes they get back
+        return node.copy()
+
+    def _score(self, candidates: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        if len(candidates) == len(self._ids):
+            # nothing filtered out, score the (possibly memory-mapped) matrix in place
+            return self._embeddings @ queries
+        return self._embeddings[candidates] @ queries
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        if k < len(scores):
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(scores))
+        return top[np.argsort(-scores[top])]
+
+    def batch_query(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        similarity_top_k: int,
+        filters: Optional[MetadataFilters] = None,
+    ) -> List[List[Tuple[str, float]]]:
+        '''
+        Top-k (node id, score) pairs for many query embeddings at once.
+        '''
+        with self._lock:
+            candidates = self._candidates(VectorStoreQuery(filters=filters))
+            queries = _normalize(np.asarray(query_embeddings, dtype=np.float32))
+            scores = self._score(candidates, queries.T)
+            results = []
+            for column in scores.T:
+                top = self._top_k(column, similarity_top_k)
+                results.append([(self._ids[candidates[i]], float(column[i])) for i in top])
+            return results
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.query_embedding is None:
+            raise ValueError("LocalVectorStore only supports embedding queries")
+        with self._lock:
+            candidates = self._candidates(query)
+            if len(candidates) == 0:
+                return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+            q = _normalize(np.asarray(query.query_embedding, dtype=np.float32))
+            scores = self._score(candidates, q)
+            top = self._top_k(scores, query.similarity_top_k)
+            rows = candidates[top]
+            nodes = [self._node(i) for i in rows]
+            return VectorStoreQueryResult(
+                nodes=nodes,
+                similarities=[float(s) for s in scores[top]],
+                ids=[self._ids[i] for i in rows],
+            )
+
+    def persist(self, persist_path: Optional[str] = None, fs: Any = None) -> None:
+        '''
+        Write the live rows to `persist_path` (a directory) and re-open the
+        embedding matrix memory-mapped from there.
+        '''
+        persist_dir = persist_path or self._persist_dir
+        if persist_dir is None:
+            raise ValueError("No persist directory given")
+        os.makedirs(persist_dir, exist_ok=True)
+        with self._lock:
+            keep = np.flatnonzero(self._alive)
+            embeddings = np.asarray(self._embeddings[keep]) if len(keep) else np.zeros((0, 0), np.float32)
+            data = {
+                "ids": [self._ids[i] for i in keep],
+                "texts": [self._texts[i] for i in keep],
+                "nodes": [self._node_dicts[i] for i in keep],
+                "columns": {k: v[keep].tolist() for k, v in self._columns.items()},
+                "ref_doc_ids": self._ref_doc_ids[keep].tolist(),
+            }
+            tmp_embeddings = os.path.join(persist_dir, EMBEDDINGS_FILE + ".tmp")
+            tmp_nodes = os.path.join(persist_dir, NODES_FILE + ".tmp")
+            with open(tmp_embeddings, "wb") as f:
+                np.save(f, embeddings)
+            with open(tmp_nodes, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_embeddings, os.path.join(persist_dir, EMBEDDINGS_FILE))
+            os.replace(tmp_nodes, os.path.join(persist_dir, NODES_FILE))
+            self._persist_dir = persist_dir
+            self._load(persist_dir)
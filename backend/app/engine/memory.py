@@ -0,0 +1,148 @@
+import hashlib
+import logging
+import os
+from typing import List, Optional, Sequence, Tuple
+
+from llama_index.llms.base import ChatMessage
+from llama_index.llms.llm import LLM
+from llama_index.llms.types import MessageRole
+from llama_index.prompts import PromptTemplate
+from llama_index.utils import get_tokenizer
+
+from app.engine.cache import TTLCache
+
+# tokens of recent history sent verbatim with every turn
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+# once older turns are folded, keep only this share of the budget verbatim so
+# the summary is extended every few turns instead of on every turn
+HISTORY_FOLD_RATIO = float(os.getenv("HISTORY_FOLD_RATIO", "0.5"))
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "1024"))
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", "86400"))
+
+# role / separator overhead OpenAI adds per chat message
+_MESSAGE_OVERHEAD = 4
+
+SUMMARY_PROMPT = PromptTemplate(
+    "You maintain a running summary of a conversation between a student and an "
+    "assistant answering questions about universities and their programmes.\n"
+    "Current summary:\n{summary}\n\n"
+    "New messages:\n{messages}\n\n"
+    "Rewrite the summary so it also covers the new messages. Keep the "
+    "universities, programmes, cities and figures that were asked about or "
+    "answered, drop formatting and repetition. At most {max_words} words.\n"
+    "Summary:"
+)
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+logger = logging.getLogger("uvicorn")
+
+
+def _prefix_keys(history: Sequence[ChatMessage]) -> List[str]:
+    '''
+    keys[i] identifies history[:i]; chained so each costs one small hash
+    '''
+    keys = [hashlib.sha256(b"").hexdigest()]
+    for message in history:
+        digest = hashlib.sha256(keys[-1].encode())
+        digest.update(f"{message.role}\0{message.content or ''}".encode())
+        keys.append(digest.hexdigest())
+    return keys
+
+
+class ConversationMemory:
+    '''
+    Keeps the prompt history of a conversation roughly flat in size: the most
+    recent messages go out verbatim within `token_budget` tokens, everything
+    older is replaced by a rolling summary sent as one system message.
+
+    Summaries are cached under a hash of the history prefix they cover, so
+    with a stateless client the same conversation finds its summary again on
+    the next turn. Extending it only costs an LLM call over the messages that
+    fell out of the verbatim window since, not over the whole history.
+    '''
+
+    def __init__(
+        self,
+        llm: LLM,
+        token_budget: int = HISTORY_TOKEN_BUDGET,
+        fold_ratio: float = HISTORY_FOLD_RATIO,
+        cache: Optional[TTLCache] = None,
+        max_summary_words: int = 200,
+    ):
+        self._llm = llm
+        self._token_budget = token_budget
+        self._fold_ratio = fold_ratio
+        self._cache = cache or TTLCache(SUMMARY_CACHE_SIZE, SUMMARY_CACHE_TTL)
+        self._max_summary_words = max_summary_words
+        self._tokenizer = get_tokenizer()
+
+    def _tokens(self, message: ChatMessage) -> int:
+        return len(self._tokenizer(message.content or "")) + _MESSAGE_OVERHEAD
+
+    def _split(self, history: Sequence[ChatMessage], start: int, budget: float) -> int:
+        '''
+        First index of the verbatim tail fitting `budget`, never before `start`
+        and always keeping the last message
+        '''
+        used = 0
+        split = len(history)
+        while split > start:
+            used += self._tokens(history[split - 1])
+            if used > budget and split < len(history):
+                break
+            split -= 1
+        return split
+
+    def _plan(
+        self, history: Sequence[ChatMessage]
+    ) -> Tuple[List[str], int, Optional[str], int]:
+        '''
+        (prefix keys, index covered by the newest cached summary, that summary,
+        index the verbatim tail should start at)
+        '''
+        keys = _prefix_keys(history)
+        covered, summary = 0, None
+        for i in range(len(history), 0, -1):
+            cached = self._cache.get(keys[i])
+            if cached is not None:
+                covered, summary = i, cached
+                break
+        split = covered
+        if self._split(history, covered, self._token_budget) > covered:
+            split = self._split(history, covered, self._token_budget * self._fold_ratio)
+        return keys, covered, summary, split
+
+    def _prompt(self, summary: Optional[str], messages: Sequence[ChatMessage]) -> str:
+        return SUMMARY_PROMPT.format(
+            summary=summary or "(empty)",
+            messages="\n".join(f"{m.role.value}: {m.content}" for m in messages),
+            max_words=self._max_summary_words,
+        )
+
+    def _assemble(
+        self, history: Sequence[ChatMessage], summary: Optional[str], split: int
+    ) -> List[ChatMessage]:
+        tail = list(history[split:])
+        if not summary:
+            return tail
+        return [ChatMessage(role=MessageRole.SYSTEM, content=f"{SUMMARY_PREFIX}{summary}")] + tail
+
+    def condense(self, history: Sequence[ChatMessage]) -> List[ChatMessage]:
+        keys, covered, summary, split = self._plan(history)
+        if split > covered:
+            summary = self._llm.complete(self._prompt(summary, history[covered:split])).text.strip()
+            self._cache.set(keys[split], summary)
+            logger.info(f"Folded {split - covered} messages into the conversation summary")
+        return self._assemble(history, summary, split)
+
+    async def acondense(self, history: Sequence[ChatMessage]) -> List[ChatMessage]:
+        keys, covered, summary, split = self._plan(history)
+        if split > covered:
+            response = await self._llm.acomplete(self._prompt(summary, history[covered:split]))
+            summary = response.text.strip()
+            self._cache.set(keys[split], summary)
+            logger.info(f"Folded {split - covered} messages into the conversation summary")
+        return self._assemble(history, summary, split)
+
+    def stats(self):
+        return self._cache.stats()
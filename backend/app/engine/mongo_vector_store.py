@@ -0,0 +1,95 @@
+import logging
+from typing import Any, Dict
+
+from llama_index.schema import TextNode
+from llama_index.vector_stores import MongoDBAtlasVectorSearch
+from llama_index.vector_stores.types import (
+    FilterCondition,
+    FilterOperator,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from llama_index.vector_stores.utils import legacy_metadata_dict_to_node, metadata_dict_to_node
+
+logger = logging.getLogger(__name__)
+
+_OPERATORS = {
+    FilterOperator.EQ: "$eq",
+    FilterOperator.NE: "$ne",
+    FilterOperator.GT: "$gt",
+    FilterOperator.LT: "$lt",
+    FilterOperator.GTE: "$gte",
+    FilterOperator.LTE: "$lte",
+    FilterOperator.IN: "$in",
+    FilterOperator.NIN: "$nin",
+}
+
+
+class AtlasVectorSearch(MongoDBAtlasVectorSearch):
+    '''
+    MongoDBAtlasVectorSearch whose metadata filters are pushed into
+    `$vectorSearch` as proper MQL: fields are addressed under the metadata
+    key, and IN / OR filters are supported (the stock store only turns
+    filters into a flat equality dict on top-level fields).
+
+    Every filtered field has to be declared as a `filter` field of the Atlas
+    vector search index.
+    '''
+
+    def _filter(self, filters: MetadataFilters) -> Dict[str, Any]:
+        clauses = []
+        for f in filters.filters:
+            operator = _OPERATORS[getattr(f, "operator", FilterOperator.EQ)]
+            value = list(f.value) if operator in ("$in", "$nin") else f.value
+            clauses.append({f"{self._metadata_key}.{f.key}": {operator: value}})
+        if len(clauses) == 1:
+            return clauses[0]
+        return {"$or" if filters.condition == FilterCondition.OR else "$and": clauses}
+
+    def _query(self, query: VectorStoreQuery) -> VectorStoreQueryResult:
+        params: Dict[str, Any] = {
+            "queryVector": query.query_embedding,
+            "path": self._embedding_key,
+            "numCandidates": query.similarity_top_k * 10,
+            "limit": query.similarity_top_k,
+            "index": self._index_name,
+        }
+        if query.filters and query.filters.filters:
+            params["filter"] = self._filter(query.filters)
+
+        pipeline = [
+            {"$vectorSearch": params},
+            {
+                "$project": {
+                    "score": {"$meta": "vectorSearchScore"},
+                    self._embedding_key: 0,
+                }
+            },
+        ]
+        logger.debug("Running query pipeline: %s", pipeline)
+        top_k_nodes = []
+        top_k_ids = []
+        top_k_scores = []
+        for res in self._collection.aggregate(pipeline):
+            text = res.pop(self._text_key)
+            score = res.pop("score")
+            id = res.pop(self._id_key)
+            metadata_dict = res.pop(self._metadata_key)
+            try:
+                node = metadata_dict_to_node(metadata_dict)
+                node.set_content(text)
+            except Exception:
+                metadata, node_info, relationships = legacy_metadata_dict_to_node(metadata_dict)
+                node = TextNode(
+                    text=text,
+                    id_=id,
+                    metadata=metadata,
+                    start_char_idx=node_info.get("start", None),
+                    end_char_idx=node_info.get("end", None),
+                    relationships=relationships,
+                )
+            top_k_ids.append(id)
+            top_k_nodes.append(node)
+            top_k_scores.append(score)
+        return VectorStoreQueryResult(nodes=top_k_nodes, similarities=top_k_scores, ids=top_k_ids)
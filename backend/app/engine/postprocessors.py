@@ -0,0 +1,117 @@
+import logging
+import os
+import re
+from collections import Counter
+from typing import List, Optional
+
+import numpy as np
+from llama_index.bridge.pydantic import Field
+from llama_index.postprocessor.types import BaseNodePostprocessor
+from llama_index.schema import MetadataMode, NodeWithScore, QueryBundle
+from llama_index.utils import get_tokenizer
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+MAX_CHUNKS_PER_SOURCE = int(os.getenv("MAX_CHUNKS_PER_SOURCE", "3"))
+
+logger = logging.getLogger("uvicorn")
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _source_key(node: NodeWithScore) -> Optional[str]:
+    metadata = node.node.metadata
+    return node.node.ref_doc_id or metadata.get("uni_name") or metadata.get("location")
+
+
+def _similarity_matrix(nodes: List[NodeWithScore]) -> np.ndarray:
+    '''
+    Pairwise chunk similarity: cosine over the embeddings when the store
+    returned them, word-set Jaccard otherwise.
+    '''
+    embeddings = [n.node.embedding for n in nodes]
+    if all(e is not None for e in embeddings):
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        return matrix @ matrix.T
+
+    words = [set(_WORD_RE.findall(n.node.get_content().lower())) for n in nodes]
+    size = len(nodes)
+    sims = np.eye(size, dtype=np.float32)
+    for i in range(size):
+        for j in range(i + 1, size):
+            union = len(words[i] | words[j])
+            sims[i, j] = sims[j, i] = len(words[i] & words[j]) / union if union else 0.0
+    return sims
+
+
+class BudgetedMMRPostprocessor(BaseNodePostprocessor):
+    '''
+    Select retrieved chunks for synthesis by maximal marginal relevance,
+    skipping near-duplicates and capping chunks taken from one source
+    article, until the context token budget is spent.
+    '''
+
+    token_budget: int = Field(default=CONTEXT_TOKEN_BUDGET)
+    lambda_mult: float = Field(default=MMR_LAMBDA)
+    dedup_threshold: float = Field(default=DEDUP_THRESHOLD)
+    max_per_source: int = Field(default=MAX_CHUNKS_PER_SOURCE)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "BudgetedMMRPostprocessor"
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        if not nodes:
+            return nodes
+
+        scores = np.array([n.score or 0.0 for n in nodes], dtype=np.float32)
+        spread = scores.max() - scores.min()
+        relevance = (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+        sims = _similarity_matrix(nodes)
+        tokenizer = get_tokenizer()
+        lengths = [
+            len(tokenizer(n.node.get_content(metadata_mode=MetadataMode.LLM)))
+            for n in nodes
+        ]
+
+        selected: List[int] = []
+        per_source: Counter = Counter()
+        remaining = set(range(len(nodes)))
+        used_tokens = 0
+        duplicates = 0
+        while remaining:
+            candidates = sorted(remaining)
+            if selected:
+                redundancy = sims[np.ix_(candidates, selected)].max(axis=1)
+            else:
+                redundancy = np.zeros(len(candidates))
+            mmr = self.lambda_mult * relevance[candidates] - (1 - self.lambda_mult) * redundancy
+            best = int(np.argmax(mmr))
+            index = candidates[best]
+            remaining.discard(index)
+
+            if selected and redundancy[best] >= self.dedup_threshold:
+                duplicates += 1
+                continue
+            source = _source_key(nodes[index])
+            if source is not None and per_source[source] >= self.max_per_source:
+                duplicates += 1
+                continue
+            if selected and used_tokens + lengths[index] > self.token_budget:
+                continue
+
+            selected.append(index)
+            per_source[source] += 1
+            used_tokens += lengths[index]
+
+        logger.info(
+            f"Retrieved {len(nodes)} chunks, using {len(selected)} "
+            f"({used_tokens} tokens, {duplicates} duplicates dropped)"
+        )
+        return [nodes[i] for i in selected]
@@ -0,0 +1,260 @@
+import os
+import re
+from functools import lru_cache
+from typing import List, Tuple
+
+from llama_index.utils import get_tokenizer
+
+# upper bound for the schema instructions appended to a user question
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1200"))
+
+# tables used when the question doesn't mention anything table specific
+DEFAULT_TABLES = ("University", "Programme")
+
+TABLE_SNIPPETS = {
+    "University": '''
+    **University Table:**
+    - **Columns:** 'uni_name,' 'location,' 'founded,' 'website,' 'overall_ranking,' 'International_Students,' 'Female_Male_Ratio,' 'total_students,' 'athletics,' 'contact,' 'research_funding,' 'airport_transportation,' 'bus_availability,' 'train_station_distance,' 'nearby_shopping_areas,' 'campus_facilities,' 'emergency_services,' 'student_housing,' 'Living costs,' 'student_clubs_organizations,' 'Public_Private.'
+    - **Overview:** Comprehensive details about universities, including rankings, demographics, and facilities.
+    - **Field Descriptions:**
+        - 'uni_name': University name.
+        - 'location': Geographical location.
+        - 'founded': Founding date.
+        - 'website': University website.
+        - 'overall_ranking': Overall ranking.
+        - 'International_Students': Number of international students.
+        - 'Female_Male_Ratio': Ratio of female to male students.
+        - 'total_students': Total number of students.
+        - 'athletics': Athletics information.
+        - 'contact': Contact details.
+        - 'research_funding': Research funding details.
+        - 'airport_transportation': Accessibility to airports.
+        - 'bus_availability': Availability of bus transportation.
+        - 'train_station_distance': Distance to train stations.
+        - 'nearby_shopping_areas': Proximity to shopping areas.
+        - 'campus_facilities': Facilities available on campus.
+        - 'emergency_services': Emergency services information.
+        - 'student_housing': Student housing details.
+        - 'Living costs': Cost of living information.
+        - 'student_clubs_organizations': Student clubs and organizations.
+        - 'Public_Private': Public or private designation.
+''',
+    "Programme": '''
+    **Programme Table:**
+    - **Columns:** 'programme_name,' 'duration,' 'description,' 'fees (annual),' 'admission_requirements,' 'degree_awarded,' 'mode_of_study,' 'on_off_campus,' 'scholarships,' 'language_of_instruction,' 'internship_opportunities,' 'study_abroad_opportunities.'
+    - **Overview:** In-depth insights into academic programs, covering duration, fees, and admission criteria.
+    - **Field Descriptions:**
+        - 'programme_name': Program name.
+        - 'duration': Program duration.
+        - 'description': Program description.
+        - 'fees (annual)': Annual fees.
+        - 'admission_requirements': Admission criteria.
+        - 'degree_awarded': Degree awarded upon completion.
+        - 'mode_of_study': Mode of study (e.g., full-time, part-time).
+        - 'on_off_campus': On-campus or off-campus status.
+        - 'scholarships': Available scholarships.
+        - 'language_of_instruction': Language of instruction.
+        - 'internship_opportunities': Opportunities for internships.
+        - 'study_abroad_opportunities': Opportunities for studying abroad.
+    - When displaying programs, ensure to join with 'ProgrammeDescription' for additional relevant information.
+''',
+    "ProgrammeDescription": '''
+    **ProgrammeDescription Table:**
+    - **Columns:** 'programme_name,' 'overview,' 'website,' 'learning_objectives,' 'program_structure,' 'specialisations,' 'career_opportunities.'
+    - **Overview:** Additional context for academic programs, including overviews, learning objectives, and career opportunities.
+    - **Field Descriptions:**
+        - 'programme_name': Program name.
+        - 'overview': Program overview.
+        - 'website': Program website.
+        - 'learning_objectives': Learning objectives.
+        - 'program_structure': Structure of the program.
+        - 'specialisations': Specializations available.
+        - 'career_opportunities': Career opportunities associated with the program.
+''',
+    "CourseDescription": '''
+    **CourseDescription Table:**
+    - **Columns:** 'programme_name,' 'course_name,' 'course_description,' 'course_objectives,' 'core_elective.'
+    - **Overview:** Breakdown of individual courses within academic programs, including detailed descriptions and core/elective categorization.
+    - **Field Descriptions:**
+        - 'programme_name': Program name.
+        - 'course_name': Course name.
+        - 'course_description': Course description.
+        - 'course_objectives': Objectives of the course.
+        - 'core_elective': Core or elective status.
+''',
+    "TestType": '''
+    **TestType Table:**
+    - **Columns:** 'programme_name,' 'test_name,' 'average_score,' 'minimum_score.'
+    - **Overview:** Captures data related to tests associated with academic programs, including average and minimum scores.
+    - **Field Descriptions:**
+        - 'programme_name': Program name.
+        - 'test_name': Test name.
+        - 'average_score': Average test score.
+        - 'minimum_score': Minimum required test score.
+''',
+}
+
+# words in a question that point at a table (matched after light stemming)
+TABLE_KEYWORDS = {
+    "University": {
+        "university", "uni", "college", "institute", "school", "location", "city",
+        "country", "where", "founded", "rank", "ranking", "international", "female",
+        "male", "ratio", "student", "athletic", "sport", "contact", "research",
+        "funding", "airport", "bus", "train", "station", "transport", "shopping",
+        "campus", "facility", "emergency", "housing", "accommodation", "living",
+        "cost", "rent", "club", "organization", "society", "public", "private",
+    },
+    "Programme": {
+        "program", "programme", "degree", "master", "bachelor", "msc", "bsc", "phd",
+        "duration", "long", "year", "fee", "tuition", "cost", "price", "expensive",
+        "cheap", "admission", "requirement", "apply", "mode", "full-time",
+        "part-time", "online", "scholarship", "funding", "language", "english",
+        "internship", "abroad", "exchange", "study",
+    },
+    "ProgrammeDescription": {
+        "overview", "objective", "learning", "structure", "specialisation",
+        "specialization", "track", "career", "job", "opportunity", "outcome",
+        "website", "about",
+    },
+    "CourseDescription": {
+        "course", "module", "class", "subject", "lecture", "core", "elective",
+        "optional", "compulsory", "mandatory", "curriculum", "syllabus",
+    },
+    "TestType": {
+        "test", "exam", "score", "ielts", "toefl", "gre", "gmat", "duolingo",
+        "pte", "cambridge", "minimum", "average", "grade",
+    },
+}
+
+JOIN_EXAMPLES = [
+    (frozenset({"University", "Programme"}), '''
+        - For questions related to universities and programs, use INNER JOINs on 'uni_name' and 'programme_name.'
+        Example:
+        ```sql
+        SELECT "University"."uni_name", "University"."location", "University"."founded", "Programme"."programme_name", "Programme"."description"
+        FROM "University"
+        INNER JOIN "Programme" ON "University"."uni_name" = "Programme"."uni_name";
+        ```
+'''),
+    (frozenset({"Programme", "ProgrammeDescription"}), '''
+        - To incorporate details from 'ProgrammeDescription,' utilize LEFT JOINs on 'programme_name.'
+        Example:
+        ```sql
+        SELECT "Programme"."programme_name", "Programme"."description", "ProgrammeDescription"."overview"
+        FROM "Programme"
+        LEFT JOIN "ProgrammeDescription" ON "Programme"."programme_name" = "ProgrammeDescription"."programme_name";
+        ```
+'''),
+    (frozenset({"Programme", "CourseDescription"}), '''
+        - When querying about courses, employ INNER JOINs on 'programme_name.'
+        Example:
+        ```sql
+        SELECT "Programme"."programme_name", "CourseDescription"."course_name", "CourseDescription"."course_description"
+        FROM "Programme"
+        INNER JOIN "CourseDescription" ON "Programme"."programme_name" = "CourseDescription"."programme_name";
+        ```
+'''),
+    (frozenset({"Programme", "TestType"}), '''
+        - For test-related queries, utilize INNER JOINs on 'programme_name.'
+        Example:
+        ```sql
+        SELECT "Programme"."programme_name", "TestType"."test_name", "TestType"."average_score"
+        FROM "Programme"
+        INNER JOIN "TestType" ON "Programme"."programme_name" = "TestType"."programme_name";
+        ```
+'''),
+]
+
+QUERY_INSTRUCTIONS = '''
+    **Query Instructions:**
+    - Enclose table names in double quotes (e.g., `SELECT * FROM "<TABLE_NAME>"`).
+    - Try to provide as much relevant information as possible with the correct joins.
+    - Utilize `ILIKE` for flexible matching instead of strict equality.
+    - Consider an `OR` condition to match both 'programme_name' and 'description.'
+    - Before selecting columns, specify the tables explicitly. For example:
+        ```sql
+        SELECT "University"."uni_name", "Programme"."programme_name", "Programme"."description"
+        FROM "University"
+        INNER JOIN "Programme" ON "University"."uni_name" = "Programme"."uni_name"
+        WHERE "Programme"."description" ILIKE '%computers%';
+        ```
+    - Tailor your JOINs based on the specific question to ensure optimal data retrieval.
+    - Present information in bulleted lists for clarity and readability.
+'''
+
+HEADER = '''
+    Description of the relevant tables in our educational database:
+'''
+
+_WORD_RE = re.compile(r"[a-z][a-z\-]*")
+
+
+def _stem(word: str) -> str:
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+@lru_cache(maxsize=None)
+def _token_count(text: str) -> int:
+    # the snippets are static, so every one is only ever tokenized once
+    return len(get_tokenizer()(text))
+
+
+def rank_tables(question: str) -> List[Tuple[str, int]]:
+    '''
+    Score every table by the number of its keywords found in the question.
+    '''
+    words = {_stem(w) for w in _WORD_RE.findall(question.lower())}
+    scores = [
+        (table, len(words & keywords)) for table, keywords in TABLE_KEYWORDS.items()
+    ]
+    ranked = sorted(
+        (s for s in scores if s[1] > 0), key=lambda s: s[1], reverse=True
+    )
+    if not ranked:
+        ranked = [(table, 0) for table in DEFAULT_TABLES]
+    return ranked
+
+
+@lru_cache(maxsize=256)
+def _assemble(tables: Tuple[str, ...], budget: int) -> str:
+    parts = [HEADER, QUERY_INSTRUCTIONS]
+    used = _token_count(HEADER) + _token_count(QUERY_INSTRUCTIONS)
+
+    included = []
+    for table in tables:
+        cost = _token_count(TABLE_SNIPPETS[table])
+        if used + cost > budget and included:
+            break
+        parts.insert(len(parts) - 1, TABLE_SNIPPETS[table])
+        used += cost
+        included.append(table)
+
+    joins = []
+    for join_tables, example in JOIN_EXAMPLES:
+        if join_tables <= set(included):
+            cost = _token_count(example)
+            if used + cost > budget:
+                continue
+            joins.append(example)
+            used += cost
+    if joins:
+        parts.append("\n    - When answering questions:" + "".join(joins))
+
+    return "".join(parts)
+
+
+def build_query_instructions(question: str, budget: int = PROMPT_TOKEN_BUDGET) -> str:
+    '''
+    Schema instructions for `question`: only the descriptions of the tables it
+    is about, plus the join examples between those tables, within `budget`
+    tokens. The result is cached per table combination.
+    '''
+    tables = tuple(table for table, _ in rank_tables(question))
+    # every other table joins through Programme on programme_name / uni_name
+    if len(tables) > 1 and "Programme" not in tables:
+        tables = tables + ("Programme",)
+    return _assemble(tables, budget)
@@ -0,0 +1,196 @@
+import hashlib
+import logging
+import os
+import pickle
+import time
+from typing import Any, Dict, List, Optional
+
+from llama_index import SQLDatabase
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+SCHEMA_SNAPSHOT_DIR = os.getenv("SCHEMA_SNAPSHOT_DIR", "storage/schema")
+# bump when the pickled layout changes so old files are ignored
+SNAPSHOT_FORMAT = 1
+
+logger = logging.getLogger("uvicorn")
+
+_POSTGRES_FINGERPRINT_SQL = '''
+    SELECT c.table_name, c.column_name, c.data_type, c.is_nullable, c.ordinal_position
+    FROM information_schema.columns c
+    WHERE c.table_schema = COALESCE(:schema, current_schema())
+    ORDER BY c.table_name, c.ordinal_position
+'''
+_POSTGRES_CONSTRAINTS_SQL = '''
+    SELECT tc.table_name, tc.constraint_name, tc.constraint_type
+    FROM information_schema.table_constraints tc
+    WHERE tc.table_schema = COALESCE(:schema, current_schema())
+    ORDER BY tc.table_name, tc.constraint_name
+'''
+_SQLITE_FINGERPRINT_SQL = '''
+    SELECT type, name, sql FROM sqlite_master
+    WHERE type IN ('table', 'view', 'index')
+    ORDER BY type, name
+'''
+
+
+def schema_fingerprint(engine: Engine, schema: Optional[str] = None) -> Optional[str]:
+    '''
+    Hash of the catalog rows describing every table and constraint, read in
+    one round trip. Returns None for dialects we cannot fingerprint cheaply,
+    in which case the caller should reflect as usual.
+    '''
+    dialect = engine.dialect.name
+    try:
+        with engine.connect() as conn:
+            if dialect == "postgresql":
+                rows = conn.execute(text(_POSTGRES_FINGERPRINT_SQL), {"schema": schema}).fetchall()
+                rows += conn.execute(text(_POSTGRES_CONSTRAINTS_SQL), {"schema": schema}).fetchall()
+            elif dialect == "sqlite":
+                rows = conn.execute(text(_SQLITE_FINGERPRINT_SQL)).fetchall()
+            else:
+                return None
+    except SQLAlchemyError as e:
+        logger.warning(f"Could not fingerprint schema, reflecting instead: {e}")
+        return None
+    digest = hashlib.sha256(f"{SNAPSHOT_FORMAT}:{dialect}".encode())
+    for row in rows:
+        digest.update(repr(tuple(row)).encode())
+    return digest.hexdigest()
+
+
+def _snapshot_path(engine: Engine, snapshot_dir: str, options: Dict[str, Any]) -> str:
+    url = engine.url
+    identity = f"{url.get_backend_name()}|{url.host}|{url.port}|{url.database}|{sorted(options.items())}"
+    key = hashlib.sha256(identity.encode()).hexdigest()[:16]
+    return os.path.join(snapshot_dir, f"schema-{key}.pkl")
+
+
+def _load_snapshot(path: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable schema snapshot {path}: {e}")
+        return None
+    if snapshot.get("fingerprint") != fingerprint:
+        logger.info("Database schema changed, schema snapshot is stale")
+        return None
+    return snapshot
+
+
+def _save_snapshot(path: str, snapshot: Dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+class SnapshotSQLDatabase(SQLDatabase):
+    '''
+    SQLDatabase that reuses a pickled copy of the reflected MetaData and the
+    text-to-SQL table descriptions instead of reflecting on every construction.
+
+    The snapshot is stored under `snapshot_dir` together with a fingerprint of
+    the database catalog; it is only rebuilt when that fingerprint changes
+    (i.e. when a data_pipe load altered a table definition).
+    '''
+
+    def __init__(
+        self,
+        engine: Engine,
+        schema: Optional[str] = None,
+        metadata=None,
+        ignore_tables: Optional[List[str]] = None,
+        include_tables: Optional[List[str]] = None,
+        sample_rows_in_table_info: int = 3,
+        indexes_in_table_info: bool = False,
+        custom_table_info: Optional[dict] = None,
+        view_support: bool = False,
+        max_string_length: int = 300,
+        snapshot_dir: Optional[str] = SCHEMA_SNAPSHOT_DIR,
+    ):
+        start = time.perf_counter()
+        options = {
+            "schema": schema,
+            "include_tables": tuple(sorted(include_tables or ())),
+            "ignore_tables": tuple(sorted(ignore_tables or ())),
+            "view_support": view_support,
+        }
+        fingerprint = None
+        snapshot = None
+        path = None
+        if snapshot_dir and metadata is None:
+            fingerprint = schema_fingerprint(engine, schema)
+            if fingerprint is not None:
+                path = _snapshot_path(engine, snapshot_dir, options)
+                snapshot = _load_snapshot(path, fingerprint)
+
+        if snapshot is None:
+            super().__init__(
+                engine,
+                schema=schema,
+                metadata=metadata,
+                ignore_tables=ignore_tables,
+                include_tables=include_tables,
+                sample_rows_in_table_info=sample_rows_in_table_info,
+                indexes_in_table_info=indexes_in_table_info,
+                custom_table_info=custom_table_info,
+                view_support=view_support,
+                max_string_length=max_string_length,
+            )
+            self._table_info = {
+                table: super(SnapshotSQLDatabase, self).get_single_table_info(table)
+                for table in self._usable_tables
+            }
+            self._table_columns = {
+                table: self._inspector.get_columns(table, schema=schema)
+                for table in self._usable_tables
+            }
+            if path is not None:
+                _save_snapshot(path, {
+                    "fingerprint": fingerprint,
+                    "all_tables": self._all_tables,
+                    "metadata": self._metadata,
+                    "table_info": self._table_info,
+                    "table_columns": self._table_columns,
+                })
+            logger.info(f"Reflected SQL schema in {time.perf_counter() - start:.2f}s")
+            return
+
+        # same state SQLDatabase.__init__ sets up, minus the reflection
+        self._engine = engine
+        self._schema = schema
+        self._inspector = inspect(engine)
+        self._all_tables = snapshot["all_tables"]
+        self._include_tables = set(include_tables) if include_tables else set()
+        missing_tables = self._include_tables - self._all_tables
+        if missing_tables:
+            raise ValueError(f"include_tables {missing_tables} not found in database")
+        self._ignore_tables = set(ignore_tables) if ignore_tables else set()
+        usable_tables = self.get_usable_table_names()
+        self._usable_tables = set(usable_tables) if usable_tables else self._all_tables
+        self._sample_rows_in_table_info = sample_rows_in_table_info
+        self._indexes_in_table_info = indexes_in_table_info
+        self._custom_table_info = custom_table_info
+        self._max_string_length = max_string_length
+        self._metadata = snapshot["metadata"]
+        self._table_info = snapshot["table_info"]
+        self._table_columns = snapshot["table_columns"]
+        logger.info(f"Loaded SQL schema snapshot in {time.perf_counter() - start:.2f}s")
+
+    def get_table_columns(self, table_name: str) -> List[Any]:
+        columns = self._table_columns.get(table_name)
+        if columns is None:
+            return super().get_table_columns(table_name)
+        return columns
+
+    def get_single_table_info(self, table_name: str) -> str:
+        info = self._table_info.get(table_name)
+        if info is None:
+            return super().get_single_table_info(table_name)
+        return info
@@ -0,0 +1,170 @@
+import os
+import re
+import threading
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import numpy as np
+from llama_index.embeddings.base import BaseEmbedding
+
+from app.engine.data_version import DataVersion
+from app.engine.executor import run_blocking
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "false").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "2048"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+
+_CHUNK_RE = re.compile(r"\S+\s*|\s+")
+
+
+class SemanticCache:
+    '''
+    Answer cache keyed on question embeddings.
+
+    Embeddings live in a fixed-size, L2-normalized matrix so a lookup is one
+    matrix-vector product. An entry is only served while the data version it
+    was answered under is current; when the cache is full the least recently
+    used entry is replaced.
+    '''
+
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        data_version: Optional[DataVersion] = None,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        capacity: int = SEMANTIC_CACHE_SIZE,
+        ttl: Optional[float] = SEMANTIC_CACHE_TTL,
+    ):
+        self._embed_model = embed_model
+        self._data_version = data_version
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._questions: List[Optional[str]] = [None] * capacity
+        self._answers: List[Optional[str]] = [None] * capacity
+        self._versions: List[Optional[str]] = [None] * capacity
+        self._created = np.zeros(capacity)
+        self._last_used = np.full(capacity, -np.inf)
+        self.hits = 0
+        self.misses = 0
+
+    def _version(self) -> str:
+        return self._data_version.current() if self._data_version else "0"
+
+    def embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(self._embed_model.get_query_embedding(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _free(self, slot: int) -> None:
+        self._questions[slot] = None
+        self._answers[slot] = None
+        self._versions[slot] = None
+        self._last_used[slot] = -np.inf
+        self._matrix[slot] = 0.0
+
+    def lookup(self, question: str, embedding: Optional[np.ndarray] = None) -> Optional[str]:
+        embedding = self.embed(question) if embedding is None else embedding
+        version = self._version()
+        now = time.monotonic()
+        with self._lock:
+            if self._matrix is None:
+                self.misses += 1
+                return None
+            scores = self._matrix @ embedding
+            for slot in np.argsort(-scores):
+                if scores[slot] < self.threshold:
+                    break
+                if self._answers[slot] is None:
+                    continue
+                expired = self.ttl is not None and now - self._created[slot] > self.ttl
+                if expired or self._versions[slot] != version:
+                    self._free(slot)
+                    continue
+                self._last_used[slot] = now
+                self.hits += 1
+                return self._answers[slot]
+            self.misses += 1
+            return None
+
+    def store(self, question: str, answer: str, embedding: Optional[np.ndarray] = None) -> None:
+        if not answer.strip():
+            return
+        embedding = self.embed(question) if embedding is None else embedding
+        version = self._version()
+        now = time.monotonic()
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.capacity, embedding.shape[0]), dtype=np.float32)
+            # least recently used slot; never-used slots sort first
+            slot = int(np.argmin(self._last_used))
+            self._matrix[slot] = embedding
+            self._questions[slot] = question
+            self._answers[slot] = answer
+            self._versions[slot] = version
+            self._created[slot] = now
+            self._last_used[slot] = now
+
+    def invalidate(self, question: str) -> int:
+        '''
+        Drop every entry the question would hit; returns the number removed.
+        '''
+        embedding = self.embed(question)
+        with self._lock:
+            if self._matrix is None:
+                return 0
+            slots = np.flatnonzero(self._matrix @ embedding >= self.threshold)
+            for slot in slots:
+                self._free(slot)
+            return len(slots)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._matrix = None
+            self._questions = [None] * self.capacity
+            self._answers = [None] * self.capacity
+            self._versions = [None] * self.capacity
+            self._last_used[:] = -np.inf
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": sum(a is not None for a in self._answers),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _embed_and_lookup(self, question: str) -> Tuple[Optional[str], np.ndarray]:
+        embedding = self.embed(question)
+        return self.lookup(question, embedding), embedding
+
+    async def alookup(self, question: str) -> Tuple[Optional[str], np.ndarray]:
+        # embedding and the version check are network calls
+        return await run_blocking(self._embed_and_lookup, question)
+
+
+async def replay(answer: str) -> AsyncIterator[str]:
+    '''
+    Stream a cached answer back in word-sized tokens.
+    '''
+    for chunk in _CHUNK_RE.findall(answer):
+        yield chunk
+
+
+async def record(
+    cache: SemanticCache, question: str, embedding: np.ndarray, token_gen: AsyncIterator[str]
+) -> AsyncIterator[str]:
+    '''
+    Pass tokens through and store the full answer once the stream completes.
+    '''
+    tokens = []
+    try:
+        async for token in token_gen:
+            tokens.append(token)
+            yield token
+    finally:
+        await token_gen.aclose()
+    # only reached when the client read the whole answer
+    await run_blocking(cache.store, question, "".join(tokens), embedding)
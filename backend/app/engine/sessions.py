@@ -0,0 +1,270 @@
+import fcntl
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+from llama_index.llms.base import ChatMessage
+from llama_index.llms.types import MessageRole
+
+from app.engine.cache import TTLCache
+from app.engine.executor import run_blocking
+
+# "memory" (per process) or "disk" (JSON files, shared by workers on one host)
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_DIR = os.getenv("SESSION_DIR", "storage/sessions")
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(24 * 3600)))
+# oldest messages are dropped beyond this, the prompt only sees a summary of them anyway
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "500"))
+
+logger = logging.getLogger("uvicorn")
+
+_SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+
+class Session:
+    def __init__(self, session_id: str, messages: Optional[List[ChatMessage]] = None):
+        self.id = session_id
+        self.messages: List[ChatMessage] = messages or []
+
+    def append(self, *messages: ChatMessage) -> None:
+        self.messages.extend(messages)
+        if len(self.messages) > SESSION_MAX_MESSAGES:
+            del self.messages[:len(self.messages) - SESSION_MAX_MESSAGES]
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "messages": [{"role": m.role.value, "content": m.content} for m in self.messages],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Session":
+        return cls(
+            data["id"],
+            [ChatMessage(role=MessageRole(m["role"]), content=m["content"]) for m in data["messages"]],
+        )
+
+
+class SessionStore(ABC):
+    '''
+    Server-side conversation histories, so a client only sends its new
+    message with a session id instead of the whole conversation.
+
+    Stores are bounded: the least recently used session is evicted beyond
+    `maxsize`, and sessions not written for `ttl` seconds expire.
+    '''
+
+    def create(self) -> Session:
+        session = Session(secrets.token_urlsafe(24))
+        self.save(session)
+        return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        if not _SESSION_ID_RE.match(session_id or ""):
+            return None
+        return self._get(session_id)
+
+    @abstractmethod
+    def _get(self, session_id: str) -> Optional[Session]:
+        ...
+
+    @abstractmethod
+    def save(self, session: Session) -> None:
+        ...
+
+    @abstractmethod
+    def append(self, session: Session, *messages: ChatMessage) -> None:
+        '''
+        Append `messages` to the stored copy of `session`, so overlapping turns
+        on one session all land. `session` is saved with them when the store
+        lost it meanwhile.
+        '''
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        ...
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        ...
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, maxsize: int = SESSION_MAX, ttl: Optional[float] = SESSION_TTL):
+        self._sessions = TTLCache(maxsize, ttl)
+        self._lock = threading.Lock()
+
+    def _get(self, session_id: str) -> Optional[Session]:
+        return self._sessions.get(session_id)
+
+    def save(self, session: Session) -> None:
+        self._sessions.set(session.id, session)
+
+    def append(self, session: Session, *messages: ChatMessage) -> None:
+        with self._lock:
+            # pop, not get: appending is no lookup for the hit/miss stats
+            stored = self._sessions.pop(session.id) or session
+            stored.append(*messages)
+            self._sessions.set(stored.id, stored)
+
+    def delete(self, session_id: str) -> None:
+        self._sessions.pop(session_id)
+
+    def stats(self) -> Dict[str, int]:
+        return self._sessions.stats()
+
+
+class DiskSessionStore(SessionStore):
+    '''
+    One JSON file per session. Lookups check the file itself, so workers
+    sharing the directory see each other's sessions. Recency is tracked in
+    memory (seeded from the file modification times on start), so eviction
+    never lists the directory; with several workers it is per worker.
+    '''
+
+    def __init__(self, directory: str = SESSION_DIR, maxsize: int = SESSION_MAX, ttl: Optional[float] = SESSION_TTL):
+        self._directory = directory
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # serializes appends across this worker's threads, the lock file across workers
+        self._append_lock = threading.Lock()
+        self._lock_path = os.path.join(directory, ".lock")
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith(".json"):
+                entries.append((entry.stat().st_mtime, entry.name[:-len(".json")]))
+        self._recency: "OrderedDict[str, float]" = OrderedDict(
+            (session_id, mtime) for mtime, session_id in sorted(entries)
+        )
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self._directory, f"{session_id}.json")
+
+    def _remove(self, session_id: str) -> None:
+        self._recency.pop(session_id, None)
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def _get(self, session_id: str) -> Optional[Session]:
+        # the file is the truth: other workers create, update and delete sessions too
+        try:
+            written_at = os.stat(self._path(session_id)).st_mtime
+        except FileNotFoundError:
+            written_at = None
+        with self._lock:
+            if written_at is not None and self._ttl is not None and time.time() - written_at > self._ttl:
+                self._remove(session_id)
+                written_at = None
+            if written_at is None:
+                self._recency.pop(session_id, None)
+                self.misses += 1
+                return None
+            self._recency[session_id] = written_at
+            self._recency.move_to_end(session_id)
+        try:
+            session = self._load(session_id)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Dropping unreadable session {session_id}: {e}")
+            with self._lock:
+                self._remove(session_id)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return session
+
+    def _load(self, session_id: str) -> Session:
+        with open(self._path(session_id), encoding="utf-8") as f:
+            return Session.from_dict(json.load(f))
+
+    def save(self, session: Session) -> None:
+        path = self._path(session.id)
+        # unique per worker process and thread, they may save the same session
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(session.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._recency[session.id] = time.time()
+            self._recency.move_to_end(session.id)
+            while len(self._recency) > self._maxsize:
+                self._remove(next(iter(self._recency)))
+                self.evictions += 1
+
+    @contextmanager
+    def _locked(self):
+        with self._append_lock, open(self._lock_path, "a") as lock_file:
+            # released when the file is closed
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def append(self, session: Session, *messages: ChatMessage) -> None:
+        # re-read under the lock: another turn may have been saved since `session` was loaded
+        with self._locked():
+            try:
+                stored = self._load(session.id)
+            except (OSError, ValueError, KeyError):
+                stored = session
+            stored.append(*messages)
+            self.save(stored)
+
+    def delete(self, session_id: str) -> None:
+        if _SESSION_ID_RE.match(session_id or ""):
+            with self._lock:
+                self._remove(session_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._recency),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def create_session_store(backend: str = None) -> SessionStore:
+    backend = backend or SESSION_STORE
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "disk":
+        return DiskSessionStore()
+    raise ValueError(f"Unknown SESSION_STORE backend: {backend}")
+
+
+async def remember(
+    store: SessionStore, session: Session, question: str, token_gen: AsyncIterator[str]
+) -> AsyncIterator[str]:
+    '''
+    Pass tokens through and append the turn to the session once the stream
+    completes.
+    '''
+    tokens = []
+    try:
+        async for token in token_gen:
+            tokens.append(token)
+            yield token
+    finally:
+        await token_gen.aclose()
+    # only reached when the client read the whole answer
+    await run_blocking(
+        store.append,
+        session,
+        ChatMessage(role=MessageRole.USER, content=question),
+        ChatMessage(role=MessageRole.ASSISTANT, content="".join(tokens)),
+    )
@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import os
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from llama_index.llms.base import ChatMessage
+
+from app.engine.sql_cache import normalize_question
+from app.metrics import COALESCED_REQUESTS
+
+# attach concurrent identical questions to one in-flight answer
+CHAT_COALESCE = os.getenv("CHAT_COALESCE", "true").lower() in ("1", "true", "yes")
+
+
+def flight_key(question: str, history: List[ChatMessage]) -> str:
+    '''
+    Requests with the same key get the same answer: the normalized question
+    over an identical history.
+    '''
+    digest = hashlib.sha256(normalize_question(question).encode("utf-8"))
+    for message in history:
+        digest.update(f"\0{message.role.value}\0{message.content or ''}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.tokens: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def publish(self, token: Optional[str] = None) -> None:
+        if token is not None:
+            self.tokens.append(token)
+        # a fresh event per change, waiters hold on to the one they saw
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+
+class SingleFlight:
+    '''
+    Coalesces concurrent requests for the same answer into one upstream
+    stream.
+
+    The first request for a key starts the producer as a task of its own,
+    and every request (the first one included) follows the tokens it
+    buffers, from the start, so requests joining mid-stream still get the
+    whole answer. Because no request owns the producer, a disconnecting
+    client leaves it running for the others; it is cancelled only once the
+    last follower is gone. Finished flights are forgotten, later requests
+    start a new one.
+    '''
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+
+    def stream(self, key: str, produce: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._run(key, flight, produce()))
+            COALESCED_REQUESTS.inc(role="leader")
+        else:
+            COALESCED_REQUESTS.inc(role="follower")
+        # counted right away, a leader leaving before a new follower's first
+        # read must not cancel the answer under it
+        flight.followers += 1
+        return self._follow(key, flight)
+
+    async def _run(self, key: str, flight: _Flight, token_gen: AsyncIterator[str]) -> None:
+        try:
+            async for token in token_gen:
+                flight.publish(token)
+        except asyncio.CancelledError:
+            # not re-raised into the followers, that would cancel their responses
+            flight.error = RuntimeError("The answer stream was cancelled")
+        except Exception as e:
+            flight.error = e
+        finally:
+            await token_gen.aclose()
+            flight.done = True
+            self._forget(key, flight)
+            flight.publish()
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def _follow(self, key: str, flight: _Flight) -> AsyncIterator[str]:
+        sent = 0
+        try:
+            while True:
+                changed = flight._changed
+                if sent < len(flight.tokens):
+                    sent += 1
+                    yield flight.tokens[sent - 1]
+                elif flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                else:
+                    await changed.wait()
+        finally:
+            flight.followers -= 1
+            if flight.followers == 0 and not flight.done:
+                # nobody is listening anymore, new requests start over
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._flights)}
@@ -0,0 +1,257 @@
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from llama_index import SQLDatabase
+from llama_index.indices.struct_store.sql_query import NLSQLTableQueryEngine
+from llama_index.indices.struct_store.sql_retriever import NLSQLRetriever
+from llama_index.schema import NodeWithScore, QueryBundle, QueryType, TextNode
+
+from app.engine.cache import TTLCache
+from app.engine.data_version import DataVersion
+from app.engine.schema_snapshot import SnapshotSQLDatabase
+from app.engine.sql_guard import GuardedSQLDatabase
+from app.metrics import timed
+
+SQL_CACHE_SIZE = int(os.getenv("SQL_CACHE_SIZE", "512"))
+SQL_CACHE_TTL = float(os.getenv("SQL_CACHE_TTL", "3600"))
+SQL_RESULT_CACHE_SIZE = int(os.getenv("SQL_RESULT_CACHE_SIZE", "256"))
+SQL_RESULT_CACHE_TTL = float(os.getenv("SQL_RESULT_CACHE_TTL", "600"))
+
+logger = logging.getLogger("uvicorn")
+
+_SPACE_RE = re.compile(r"\s+")
+_EDGE_PUNCT = " \t\n?!.,;:"
+_READ_ONLY_RE = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+
+
+def normalize_question(question: str) -> str:
+    return _SPACE_RE.sub(" ", question.lower()).strip(_EDGE_PUNCT)
+
+
+def normalize_sql(sql: str) -> str:
+    return _SPACE_RE.sub(" ", sql).strip().rstrip(";").strip()
+
+
+class SQLCache:
+    '''
+    Two-level cache for the text-to-SQL tool:
+
+    - `questions`: normalized question -> generated SQL
+    - `results`: normalized SQL text -> (result string, metadata)
+
+    Both are emptied as soon as the data version stamp changes.
+    '''
+
+    def __init__(
+        self,
+        data_version: DataVersion,
+        question_cache: Optional[TTLCache] = None,
+        result_cache: Optional[TTLCache] = None,
+    ):
+        self.data_version = data_version
+        self.questions = question_cache or TTLCache(SQL_CACHE_SIZE, SQL_CACHE_TTL)
+        self.results = result_cache or TTLCache(SQL_RESULT_CACHE_SIZE, SQL_RESULT_CACHE_TTL)
+        self._lock = threading.Lock()
+        self._version = None
+
+    def _check_version(self) -> str:
+        version = self.data_version.current()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    if self._version is not None:
+                        logger.info("Data reloaded, clearing SQL caches")
+                    self.questions.clear()
+                    self.results.clear()
+                    self._version = version
+        return version
+
+    def version(self) -> str:
+        '''
+        Data version to pass to `set_sql` / `set_result`, taken before the
+        statement is generated or run
+        '''
+        return self._check_version()
+
+    def _store(self, cache: TTLCache, key: str, value, version: str) -> None:
+        # work that started before a reload must not store what it read from
+        # the old data once the caches were cleared for the new one
+        if self._check_version() != version:
+            return
+        with self._lock:
+            if self._version == version:
+                cache.set(key, value)
+
+    def get_sql(self, question: str) -> Optional[str]:
+        self._check_version()
+        return self.questions.get(normalize_question(question))
+
+    def set_sql(self, question: str, sql: str, version: str) -> None:
+        self._store(self.questions, normalize_question(question), sql, version)
+
+    def forget_sql(self, question: str) -> None:
+        self.questions.pop(normalize_question(question))
+
+    def get_result(self, sql: str) -> Optional[Tuple[str, Dict]]:
+        self._check_version()
+        return self.results.get(normalize_sql(sql))
+
+    def set_result(self, sql: str, result: Tuple[str, Dict], version: str) -> None:
+        self._store(self.results, normalize_sql(sql), result, version)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {"sql": self.questions.stats(), "result": self.results.stats()}
+
+
+class CachedSQLDatabase(GuardedSQLDatabase, SnapshotSQLDatabase):
+    '''
+    GuardedSQLDatabase whose read-only statements are answered from the
+    result cache, built from the persisted schema snapshot when it is current.
+    '''
+
+    def __init__(self, *args, sql_cache: SQLCache, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._sql_cache = sql_cache
+
+    def run_sql(self, command: str) -> Tuple[str, Dict]:
+        if not _READ_ONLY_RE.match(command):
+            return super().run_sql(command)
+        version = self._sql_cache.version()
+        cached = self._sql_cache.get_result(command)
+        if cached is not None:
+            return cached
+        result = super().run_sql(command)
+        self._sql_cache.set_result(command, result, version)
+        return result
+
+
+class CachedNLSQLRetriever(NLSQLRetriever):
+    '''
+    NLSQLRetriever that skips the text-to-SQL LLM call for questions it has
+    already translated. A cached statement that fails to run is dropped so the
+    next ask regenerates it.
+    '''
+
+    def __init__(self, *args, sql_cache: SQLCache, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._sql_cache = sql_cache
+
+    def _text_to_sql(self, query_bundle: QueryBundle) -> str:
+        version = self._sql_cache.version()
+        sql_query_str = self._sql_cache.get_sql(query_bundle.query_str)
+        if sql_query_str is None:
+            table_desc_str = self._get_table_context(query_bundle)
+            with timed("text_to_sql"):
+                response_str = self._service_context.llm.predict(
+                    self._text_to_sql_prompt,
+                    query_str=query_bundle.query_str,
+                    schema=table_desc_str,
+                    dialect=self._sql_database.dialect,
+                )
+            sql_query_str = self._sql_parser.parse_response_to_sql(
+                response_str, query_bundle
+            )
+            self._sql_cache.set_sql(query_bundle.query_str, sql_query_str, version)
+        return sql_query_str
+
+    async def _atext_to_sql(self, query_bundle: QueryBundle) -> str:
+        version = self._sql_cache.version()
+        sql_query_str = self._sql_cache.get_sql(query_bundle.query_str)
+        if sql_query_str is None:
+            table_desc_str = self._get_table_context(query_bundle)
+            with timed("text_to_sql"):
+                response_str = await self._service_context.llm.apredict(
+                    self._text_to_sql_prompt,
+                    query_str=query_bundle.query_str,
+                    schema=table_desc_str,
+                    dialect=self._sql_database.dialect,
+                )
+            sql_query_str = self._sql_parser.parse_response_to_sql(
+                response_str, query_bundle
+            )
+            self._sql_cache.set_sql(query_bundle.query_str, sql_query_str, version)
+        return sql_query_str
+
+    def _error_result(self, query_bundle: QueryBundle, e: BaseException) -> Tuple[List[NodeWithScore], Dict]:
+        self._sql_cache.forget_sql(query_bundle.query_str)
+        if not self._handle_sql_errors:
+            raise e
+        return [NodeWithScore(node=TextNode(text=f"Error: {e!s}"))], {}
+
+    def retrieve_with_metadata(
+        self, str_or_query_bundle: QueryType
+    ) -> Tuple[List[NodeWithScore], Dict]:
+        if isinstance(str_or_query_bundle, str):
+            query_bundle = QueryBundle(str_or_query_bundle)
+        else:
+            query_bundle = str_or_query_bundle
+        sql_query_str = self._text_to_sql(query_bundle)
+
+        if self._sql_only:
+            retrieved_nodes = [NodeWithScore(node=TextNode(text=f"{sql_query_str}"))]
+            metadata = {"result": sql_query_str}
+        else:
+            try:
+                retrieved_nodes, metadata = self._sql_retriever.retrieve_with_metadata(
+                    sql_query_str
+                )
+            except BaseException as e:
+                retrieved_nodes, metadata = self._error_result(query_bundle, e)
+
+        return retrieved_nodes, {"sql_query": sql_query_str, **metadata}
+
+    async def aretrieve_with_metadata(
+        self, str_or_query_bundle: QueryType
+    ) -> Tuple[List[NodeWithScore], Dict]:
+        if isinstance(str_or_query_bundle, str):
+            query_bundle = QueryBundle(str_or_query_bundle)
+        else:
+            query_bundle = str_or_query_bundle
+        sql_query_str = await self._atext_to_sql(query_bundle)
+
+        if self._sql_only:
+            retrieved_nodes = [NodeWithScore(node=TextNode(text=f"{sql_query_str}"))]
+            metadata: Dict = {}
+        else:
+            try:
+                (
+                    retrieved_nodes,
+                    metadata,
+                ) = await self._sql_retriever.aretrieve_with_metadata(sql_query_str)
+            except BaseException as e:
+                retrieved_nodes, metadata = self._error_result(query_bundle, e)
+
+        return retrieved_nodes, {"sql_query": sql_query_str, **metadata}
+
+
+class CachedNLSQLTableQueryEngine(NLSQLTableQueryEngine):
+    '''
+    NLSQLTableQueryEngine backed by a CachedNLSQLRetriever.
+    '''
+
+    def __init__(self, sql_database: SQLDatabase, sql_cache: SQLCache, **kwargs):
+        super().__init__(sql_database=sql_database, **kwargs)
+        retriever_kwargs = {
+            k: kwargs[k]
+            for k in (
+                "text_to_sql_prompt",
+                "context_query_kwargs",
+                "tables",
+                "context_str_prefix",
+                "service_context",
+                "sql_only",
+                "verbose",
+            )
+            if k in kwargs
+        }
+        self._sql_retriever = CachedNLSQLRetriever(
+            sql_database, sql_cache=sql_cache, **retriever_kwargs
+        )
+        self._sql_cache = sql_cache
+
+    @property
+    def sql_cache(self) -> SQLCache:
+        return self._sql_cache
@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+import re
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+from llama_index import SQLDatabase
+from sqlalchemy import text
+from sqlalchemy.exc import InternalError, OperationalError, ProgrammingError
+
+from app.metrics import timed
+
+SQL_STATEMENT_TIMEOUT_MS = int(os.getenv("SQL_STATEMENT_TIMEOUT_MS", "10000"))
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "200"))
+SQL_FETCH_SIZE = int(os.getenv("SQL_FETCH_SIZE", "100"))
+# planner cost above which a statement is refused; unset disables EXPLAIN
+SQL_EXPLAIN_MAX_COST = float(os.getenv("SQL_EXPLAIN_MAX_COST")) if os.getenv("SQL_EXPLAIN_MAX_COST") else None
+
+logger = logging.getLogger("uvicorn")
+
+_READ_ONLY_RE = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+_STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+_TRAILING_LIMIT_RE = re.compile(
+    r"\blimit\s+(\d+|all)(\s+offset\s+\d+)?\s*$", re.IGNORECASE
+)
+
+
+class SQLGuardError(ValueError):
+    '''
+    Raised when a generated statement is refused or aborted by the guard.
+    '''
+
+
+def cap_limit(sql: str, max_rows: int) -> str:
+    '''
+    Make sure the outermost statement has a LIMIT no larger than `max_rows`.
+    '''
+    sql = sql.strip().rstrip(";").rstrip()
+    match = _TRAILING_LIMIT_RE.search(sql)
+    if match is None:
+        return f"{sql}\nLIMIT {max_rows}"
+    # Postgres' LIMIT ALL is no limit at all
+    if match.group(1).isdigit() and int(match.group(1)) <= max_rows:
+        return sql
+    return f"{sql[:match.start(1)]}{max_rows}{sql[match.end(1):]}"
+
+
+class GuardedSQLDatabase(SQLDatabase):
+    '''
+    SQLDatabase that only runs single read-only statements, with a per
+    statement timeout, a capped LIMIT, an optional EXPLAIN cost check and a
+    server-side cursor so at most `max_rows` rows are ever pulled into Python.
+
+    The SELECT/WITH prefix check only turns obvious writes away early; a
+    data-modifying CTE or SELECT INTO gets past it. Read-only is enforced by
+    the database: `SET TRANSACTION READ ONLY` on Postgres and
+    `PRAGMA query_only` on SQLite. Timeouts are enforced with
+    `SET LOCAL statement_timeout` on Postgres and a progress handler on
+    SQLite.
+    '''
+
+    def __init__(
+        self,
+        *args,
+        statement_timeout_ms: int = SQL_STATEMENT_TIMEOUT_MS,
+        max_rows: int = SQL_MAX_ROWS,
+        fetch_size: int = SQL_FETCH_SIZE,
+        max_plan_cost: Optional[float] = SQL_EXPLAIN_MAX_COST,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self._statement_timeout_ms = statement_timeout_ms
+        self._max_rows = max_rows
+        self._fetch_size = fetch_size
+        self._max_plan_cost = max_plan_cost
+
+    def _check_statement(self, command: str) -> str:
+        statement = command.strip().rstrip(";").strip()
+        if not _READ_ONLY_RE.match(statement):
+            raise SQLGuardError("Only SELECT statements are allowed.")
+        if ";" in _STRING_LITERAL_RE.sub("''", statement):
+            raise SQLGuardError("Only a single statement is allowed.")
+        return cap_limit(statement, self._max_rows)
+
+    @contextmanager
+    def _guarded(self, connection):
+        timeout_ms = self._statement_timeout_ms
+        if self.dialect == "postgresql":
+            # must come before any query of the transaction
+            connection.exec_driver_sql("SET TRANSACTION READ ONLY")
+            if timeout_ms:
+                connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+            yield
+        elif self.dialect == "sqlite":
+            raw = connection.connection.driver_connection
+            # per connection, so it is switched off again before the pool reuses it
+            raw.execute("PRAGMA query_only = ON")
+            if timeout_ms:
+                deadline = time.monotonic() + timeout_ms / 1000
+                raw.set_progress_handler(lambda: int(time.monotonic() > deadline), 1000)
+            try:
+                yield
+            finally:
+                raw.set_progress_handler(None, 0)
+                raw.execute("PRAGMA query_only = OFF")
+        else:
+            yield
+
+    def _check_plan(self, connection, statement: str) -> None:
+        if self._max_plan_cost is None or self.dialect != "postgresql":
+            return
+        plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {statement}")).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        cost = plan[0]["Plan"]["Total Cost"]
+        if cost > self._max_plan_cost:
+            logger.warning(f"Refusing SQL with plan cost {cost}: {statement}")
+            raise SQLGuardError(
+                f"Query is too expensive (estimated cost {cost:.0f}); "
+                "narrow it down with more specific filters."
+            )
+
+    def run_sql(self, command: str) -> Tuple[str, Dict]:
+        statement = self._check_statement(command)
+        with timed("sql"), self._engine.begin() as connection:
+            try:
+                with self._guarded(connection):
+                    self._check_plan(connection, statement)
+                    result = connection.execution_options(
+                        stream_results=True, max_row_buffer=self._fetch_size
+                    ).execute(text(statement))
+                    rows = []
+                    while len(rows) < self._max_rows:
+                        batch = result.fetchmany(min(self._fetch_size, self._max_rows - len(rows)))
+                        if not batch:
+                            break
+                        rows.extend(batch)
+                    col_keys = list(result.keys())
+                    result.close()
+            except (OperationalError, InternalError) as exc:
+                message = str(exc).lower()
+                if "read-only" in message or "readonly" in message:
+                    raise SQLGuardError("Only read-only statements are allowed.") from exc
+                if "cancel" in message or "interrupt" in message:
+                    raise SQLGuardError(
+                        f"Query exceeded the {self._statement_timeout_ms} ms time limit."
+                    ) from exc
+                raise NotImplementedError(
+                    f"Statement {statement!r} is invalid SQL."
+                ) from exc
+            except ProgrammingError as exc:
+                raise NotImplementedError(
+                    f"Statement {statement!r} is invalid SQL."
+                ) from exc
+        return str(rows), {"result": rows, "col_keys": col_keys}
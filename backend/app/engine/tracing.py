@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from llama_index.callbacks import CBEventType, EventPayload
+from llama_index.callbacks.base_handler import BaseCallbackHandler
+from llama_index.callbacks.token_counting import get_llm_token_counts
+from llama_index.utilities.token_counting import TokenCounter
+
+from app.metrics import LLM_TOKENS, TOOL_CALLS, current_trace, observe_stage
+
+logger = logging.getLogger("uvicorn")
+
+# callback events timed as pipeline stages
+STAGES = {
+    CBEventType.LLM: "llm",
+    CBEventType.EMBEDDING: "embedding",
+    CBEventType.RETRIEVE: "retrieve",
+    CBEventType.SYNTHESIZE: "synthesize",
+    CBEventType.QUERY: "query",
+    CBEventType.FUNCTION_CALL: "tool",
+    CBEventType.AGENT_STEP: "agent_step",
+}
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    '''
+    llama_index callback handler feeding the stage histograms, LLM token
+    counters and tool call counters in app.metrics, and the trace of the
+    request the event belongs to.
+
+    Tool calls are timed per tool (`tool:University_DB`, ...). Token counts
+    come from the usage OpenAI reports, estimated with the tokenizer for
+    streamed responses.
+    '''
+
+    def __init__(self):
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+        self._lock = threading.Lock()
+        # event id -> (stage, start)
+        self._starts: Dict[str, Tuple[str, float]] = {}
+        self._token_counter = TokenCounter()
+
+    def on_event_start(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        parent_id: str = "",
+        **kwargs: Any,
+    ) -> str:
+        stage = STAGES.get(event_type)
+        if stage is not None:
+            if event_type == CBEventType.FUNCTION_CALL and payload and EventPayload.TOOL in payload:
+                stage = f"tool:{payload[EventPayload.TOOL].name}"
+            with self._lock:
+                self._starts[event_id] = (stage, time.perf_counter())
+        return event_id
+
+    def on_event_end(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        **kwargs: Any,
+    ) -> None:
+        with self._lock:
+            start = self._starts.pop(event_id, None)
+        if start is None:
+            return
+        stage, started = start
+        observe_stage(stage, time.perf_counter() - started)
+        trace = current_trace()
+        if event_type == CBEventType.FUNCTION_CALL:
+            tool = stage.split(":", 1)[-1]
+            TOOL_CALLS.inc(tool=tool)
+            if trace is not None:
+                trace.add_tool_call(tool)
+        elif event_type == CBEventType.LLM and payload:
+            try:
+                counts = get_llm_token_counts(self._token_counter, payload, event_id)
+            except Exception as e:
+                logger.debug(f"Could not count LLM tokens: {e}")
+                return
+            for kind, count in (
+                ("prompt", counts.prompt_token_count),
+                ("completion", counts.completion_token_count),
+            ):
+                LLM_TOKENS.inc(count, kind=kind)
+                if trace is not None:
+                    trace.add_tokens(kind, count)
+
+    def start_trace(self, trace_id: Optional[str] = None) -> None:
+        pass
+
+    def end_trace(
+        self,
+        trace_id: Optional[str] = None,
+        trace_map: Optional[Dict[str, List[str]]] = None,
+    ) -> None:
+        pass
@@ -0,0 +1,62 @@
+import os
+from typing import Sequence
+
+from llama_index.vector_stores import MongoDBAtlasVectorSearch
+
+from app.engine.index_manifest import INDEX_MANIFEST_DIR, ChunkManifest
+from app.engine.local_vector_store import LocalVectorStore
+from app.engine.mongo_vector_store import AtlasVectorSearch
+
+# "mongodb" (Atlas vector search) or "local" (memory-mapped arrays on disk)
+VECTOR_STORE = os.getenv("VECTOR_STORE", "mongodb")
+LOCAL_VECTOR_DIR = os.getenv("LOCAL_VECTOR_DIR", "storage/vectors")
+
+
+def create_vector_store(backend: str = None):
+    backend = backend or VECTOR_STORE
+    if backend == "local":
+        return LocalVectorStore(persist_dir=LOCAL_VECTOR_DIR)
+    if backend == "mongodb":
+        return AtlasVectorSearch(
+            db_name=os.environ["MONGODB_DATABASE"],
+            collection_name=os.environ["MONGODB_VECTORS"],
+            index_name=os.environ["MONGODB_VECTOR_INDEX"],
+        )
+    raise ValueError(f"Unknown VECTOR_STORE backend: {backend}")
+
+
+def persist_vector_store(store) -> None:
+    # MongoDB writes through on insert, only the local store needs flushing
+    if isinstance(store, LocalVectorStore):
+        store.persist()
+
+
+def create_chunk_manifest(backend: str = None) -> ChunkManifest:
+    # one manifest per store the vectors live in
+    backend = backend or VECTOR_STORE
+    if backend == "mongodb":
+        name = f"mongodb-{os.environ['MONGODB_DATABASE']}-{os.environ['MONGODB_VECTORS']}"
+    else:
+        name = backend
+    return ChunkManifest(os.path.join(INDEX_MANIFEST_DIR, f"manifest-{name}.json"))
+
+
+def delete_vector_nodes(store, node_ids: Sequence[str]) -> None:
+    if not node_ids:
+        return
+    if isinstance(store, LocalVectorStore):
+        store.delete_nodes(node_ids)
+    elif isinstance(store, MongoDBAtlasVectorSearch):
+        # the store only deletes one document per ref_doc_id
+        store._collection.delete_many({store._id_key: {"$in": list(node_ids)}})
+    else:
+        store.delete_nodes(node_ids)
+
+
+def clear_vector_store(store) -> None:
+    if isinstance(store, LocalVectorStore):
+        store.clear()
+    elif isinstance(store, MongoDBAtlasVectorSearch):
+        store._collection.delete_many({})
+    else:
+        raise ValueError(f"Cannot clear a {type(store).__name__}")
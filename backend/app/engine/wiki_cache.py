@@ -0,0 +1,184 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+from llama_index.schema import Document
+
+WIKI_CACHE_DIR = os.getenv("WIKI_CACHE_DIR", "storage/wikipedia")
+WIKI_FETCH_WORKERS = int(os.getenv("WIKI_FETCH_WORKERS", "8"))
+# cached pages younger than this are used as is, older ones get a revision check
+WIKI_CACHE_MAX_AGE = float(os.getenv("WIKI_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+# read pages from the cache only, never touch the network
+WIKI_OFFLINE = os.getenv("WIKI_OFFLINE", "false").lower() in ("1", "true", "yes")
+
+# the MediaWiki API accepts up to 50 titles per query
+_REVISION_BATCH = 50
+
+logger = logging.getLogger()
+
+
+class WikiFetchError(RuntimeError):
+    '''
+    Raised when some pages could neither be fetched nor read from the cache.
+    '''
+
+
+class WikiPageCache:
+    '''
+    On-disk cache of Wikipedia page contents, one JSON file per requested
+    title holding the resolved page title, its revision id and the time it
+    was fetched.
+
+    `load` serves fresh entries from disk, asks the API for the current
+    revision of stale ones (one request per 50 titles) and only downloads the
+    pages that changed or were never fetched, `workers` at a time. With
+    `offline` it reads the cache only, so an index can be rebuilt without
+    network access.
+    '''
+
+    def __init__(
+        self,
+        cache_dir: str = WIKI_CACHE_DIR,
+        workers: int = WIKI_FETCH_WORKERS,
+        max_age: float = WIKI_CACHE_MAX_AGE,
+        offline: bool = WIKI_OFFLINE,
+    ):
+        self._cache_dir = cache_dir
+        self._workers = max(workers, 1)
+        self._max_age = max_age
+        self._offline = offline
+
+    def _path(self, title: str) -> str:
+        key = hashlib.sha256(title.encode()).hexdigest()[:32]
+        return os.path.join(self._cache_dir, f"{key}.json")
+
+    def _read(self, title: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(title), encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cache entry for {title!r}: {e}")
+            return None
+        return entry if entry.get("title") == title else None
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        os.makedirs(self._cache_dir, exist_ok=True)
+        path = self._path(entry["title"])
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _fetch(self, title: str) -> Dict[str, Any]:
+        import wikipedia
+
+        # same lookup as WikipediaReader (auto suggest and redirects on)
+        page = wikipedia.page(title)
+        entry = {
+            "title": title,
+            "page_title": page.title,
+            "revision_id": page.revision_id,
+            "fetched_at": time.time(),
+            "content": page.content,
+        }
+        self._write(entry)
+        return entry
+
+    def _current_revisions(self, page_titles: Sequence[str]) -> Dict[str, int]:
+        import wikipedia
+
+        revisions = {}
+        for i in range(0, len(page_titles), _REVISION_BATCH):
+            batch = page_titles[i:i + _REVISION_BATCH]
+            response = wikipedia.wikipedia._wiki_request({
+                "prop": "revisions",
+                "rvprop": "ids",
+                "titles": "|".join(batch),
+            })
+            for page in response.get("query", {}).get("pages", {}).values():
+                if page.get("revisions"):
+                    revisions[page["title"]] = page["revisions"][0]["revid"]
+        return revisions
+
+    def _revalidate(self, stale: Dict[str, Dict[str, Any]]) -> List[str]:
+        '''
+        Keep the stale entries whose page did not change since they were
+        fetched and return the titles that have to be downloaded again
+        '''
+        try:
+            revisions = self._current_revisions(
+                sorted({entry["page_title"] for entry in stale.values()})
+            )
+        except Exception as e:
+            logger.warning(f"Revision check failed, refetching {len(stale)} pages: {e}")
+            return list(stale)
+        refetch = []
+        for title, entry in stale.items():
+            if revisions.get(entry["page_title"]) == entry["revision_id"]:
+                entry["fetched_at"] = time.time()
+                self._write(entry)
+            else:
+                refetch.append(title)
+        return refetch
+
+    def load(self, titles: Sequence[str]) -> Dict[str, Document]:
+        '''
+        Documents for `titles`, keyed by title in the order given.
+
+        Every title is attempted before a WikiFetchError is raised for the
+        ones that failed, so a rerun only has to fetch those.
+        '''
+        start = time.perf_counter()
+        titles = list(dict.fromkeys(titles))
+        entries = {}
+        stale = {}
+        missing = []
+        now = time.time()
+        for title in titles:
+            entry = self._read(title)
+            if entry is None:
+                missing.append(title)
+            elif self._offline or now - entry["fetched_at"] < self._max_age:
+                entries[title] = entry
+            else:
+                stale[title] = entry
+
+        if self._offline:
+            if missing:
+                raise WikiFetchError(
+                    f"{len(missing)} pages are not cached and WIKI_OFFLINE is set: {missing}"
+                )
+        else:
+            if stale:
+                refetch = set(self._revalidate(stale))
+                entries.update({t: e for t, e in stale.items() if t not in refetch})
+                missing += [t for t in stale if t in refetch]
+            failed = {}
+            with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="wiki-fetch") as executor:
+                futures = {title: executor.submit(self._fetch, title) for title in missing}
+                for title, future in futures.items():
+                    try:
+                        entries[title] = future.result()
+                    except Exception as e:
+                        failed[title] = e
+            if failed:
+                raise WikiFetchError(
+                    f"Could not fetch {len(failed)} pages: "
+                    + "; ".join(f"{title!r}: {e}" for title, e in failed.items())
+                )
+
+        logger.info(
+            f"Loaded {len(titles)} Wikipedia pages ({len(titles) - len(missing)} from cache, "
+            f"{len(missing)} downloaded) in {time.perf_counter() - start:.2f}s"
+        )
+        # stable ids, so the chunks' source document is the same on every run
+        return {
+            title: Document(id_=f"wikipedia:{title}", text=entries[title]["content"])
+            for title in titles
+        }
@@ -0,0 +1,345 @@
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# log one JSON line per request with its stage timings
+CHAT_TRACE_LOG = os.getenv("CHAT_TRACE_LOG", "false").lower() in ("1", "true", "yes")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+logger = logging.getLogger("uvicorn")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _format_labels(labels: Labels, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # labels -> (per bucket counts, sum, count)
+        self._values: Dict[Labels, list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _labels(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(
+                        f"{self.name}_bucket{_format_labels(labels, [('le', _format_value(bound))])} {cumulative}"
+                    )
+                lines.append(f"{self.name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+# name, help, type, {labels: value}
+Sample = Tuple[str, str, str, Dict[Labels, float]]
+
+
+class MetricsRegistry:
+    '''
+    Minimal Prometheus-style registry: counters and histograms updated in
+    place, plus collectors called at scrape time for values that live
+    elsewhere (cache and pool statistics).
+    '''
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        metric = Counter(name, help)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+                continue
+            for name, help, kind, values in samples:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(values.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time from request start to the last response byte"
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "chat_stage_duration_seconds", "Time spent per pipeline stage (engine, llm, text_to_sql, sql, retrieve, tool, ...)"
+)
+TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "chat_time_to_first_token_seconds", "Time from request start to the first streamed token"
+)
+STREAM_TOKENS_PER_SECOND = REGISTRY.histogram(
+    "chat_stream_tokens_per_second", "Streamed tokens per second after the first one",
+    buckets=(1, 5, 10, 20, 40, 80, 160, 320),
+)
+LLM_TOKENS = REGISTRY.counter("chat_llm_tokens_total", "LLM tokens by kind (prompt, completion)")
+TOOL_CALLS = REGISTRY.counter("chat_tool_calls_total", "Agent tool calls by tool")
+COALESCED_REQUESTS = REGISTRY.counter(
+    "chat_coalesced_requests_total", "Chat requests that started (leader) or joined (follower) an in-flight answer"
+)
+TOOL_CALLS_PER_REQUEST = REGISTRY.histogram(
+    "chat_tool_calls_per_request", "Agent tool calls made for one chat request",
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12),
+)
+ADMISSION_WAIT_SECONDS = REGISTRY.histogram(
+    "chat_admission_wait_seconds", "Time chat requests waited in the admission queue",
+    buckets=(0, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+ADMISSION_REJECTED = REGISTRY.counter(
+    "chat_admission_rejected_total", "Chat requests answered with 429 by reason (queue_full, client_queue_full, timeout)"
+)
+UPSTREAM_RATE_LIMITS = REGISTRY.counter(
+    "chat_upstream_rate_limits_total", "OpenAI responses with status 429, retries included"
+)
+ADMISSION_LIMIT_DECREASES = REGISTRY.counter(
+    "chat_admission_limit_decreases_total", "Cuts of the adaptive concurrency limit by cause (rate_limit, latency)"
+)
+
+
+class RequestTrace:
+    '''
+    Everything recorded for one HTTP request: stage timings, token counts
+    and tool calls. Made current for the request by TimingMiddleware.
+    '''
+
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+        self.tokens: Dict[str, int] = {}
+        self.tool_calls: Dict[str, int] = {}
+        self.first_token: Optional[float] = None
+        self.streamed_tokens = 0
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages.append((stage, seconds))
+
+    def add_tokens(self, kind: str, count: int) -> None:
+        with self._lock:
+            self.tokens[kind] = self.tokens.get(kind, 0) + count
+
+    def add_tool_call(self, tool: str) -> None:
+        with self._lock:
+            self.tool_calls[tool] = self.tool_calls.get(tool, 0) + 1
+
+    def to_dict(self, status: int, seconds: float) -> Dict:
+        stages: Dict[str, Dict[str, float]] = {}
+        for stage, duration in self.stages:
+            entry = stages.setdefault(stage, {"count": 0, "seconds": 0.0})
+            entry["count"] += 1
+            entry["seconds"] = round(entry["seconds"] + duration, 4)
+        return {
+            "trace_id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "seconds": round(seconds, 4),
+            "time_to_first_token": round(self.first_token, 4) if self.first_token is not None else None,
+            "streamed_tokens": self.streamed_tokens,
+            "stages": stages,
+            "tokens": self.tokens,
+            "tool_calls": self.tool_calls,
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar(
+    "current_trace", default=None
+)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_stage(stage, seconds)
+
+
+class timed:
+    '''
+    Context manager recording the duration of its block as `stage`.
+    '''
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe_stage(self.stage, time.perf_counter() - self._start)
+        return False
+
+
+class TimingMiddleware:
+    '''
+    ASGI middleware timing each request up to its last body chunk, which for
+    the streamed chat answers is well after the handler returned. Sets the
+    request's RequestTrace as current and, with CHAT_TRACE_LOG, logs it.
+    '''
+
+    def __init__(self, app, trace_log: bool = CHAT_TRACE_LOG):
+        self.app = app
+        self.trace_log = trace_log
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+        trace = RequestTrace(scope["method"], scope["path"])
+        token = _current_trace.set(trace)
+        status = 500
+        finished = False
+
+        def finish():
+            nonlocal finished
+            if finished:
+                return
+            finished = True
+            seconds = time.perf_counter() - trace.started
+            # label by route template so session ids etc. don't become series
+            route = getattr(scope.get("route"), "path_format", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.observe(seconds, method=trace.method, path=route, status=str(status))
+            if trace.path.startswith("/api/chat") and trace.method == "POST":
+                TOOL_CALLS_PER_REQUEST.observe(sum(trace.tool_calls.values()))
+            if self.trace_log:
+                logger.info(f"trace {json.dumps(trace.to_dict(status, seconds))}")
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-trace-id", trace.id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            finish()
+            _current_trace.reset(token)
+
+
+async def measure_stream(token_gen):
+    '''
+    Pass streamed tokens through, recording time to first token and the
+    streaming rate on the current trace.
+    '''
+    trace = _current_trace.get()
+    started = trace.started if trace is not None else time.perf_counter()
+    first = None
+    count = 0
+    try:
+        async for token in token_gen:
+            now = time.perf_counter()
+            if first is None:
+                first = now
+                TIME_TO_FIRST_TOKEN.observe(first - started)
+                if trace is not None:
+                    trace.first_token = first - started
+            count += 1
+            yield token
+    finally:
+        await token_gen.aclose()
+        if trace is not None:
+            trace.streamed_tokens = count
+        if first is not None and count > 1:
+            elapsed = time.perf_counter() - first
+            if elapsed > 0:
+                STREAM_TOKENS_PER_SECOND.observe((count - 1) / elapsed)
@@ -0,0 +1,104 @@
+import json
+import os
+from typing import Dict, List, Optional
+
+BASELINE_PATH = os.getenv(
+    "BENCH_BASELINE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+)
+# allowed relative slowdown before a metric counts as a regression
+BENCH_TOLERANCE = float(os.getenv("BENCH_TOLERANCE", "0.35"))
+
+Results = Dict[str, Dict[str, float]]
+
+
+def higher_is_better(metric: str) -> bool:
+    return metric == "rps" or metric.endswith("_per_second")
+
+
+def percentile(values: List[float], q: float) -> float:
+    '''
+    Nearest-rank percentile, q in [0, 100]
+    '''
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(q / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def best(runs: List[Dict[str, float]]) -> Dict[str, float]:
+    '''
+    Best value of every metric over repeated runs, the least disturbed by
+    whatever else the machine was doing
+    '''
+    return {
+        metric: (max if higher_is_better(metric) else min)(run[metric] for run in runs)
+        for metric in runs[0]
+    }
+
+
+def load_baselines(path: str = BASELINE_PATH) -> Dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(suite: str, results: Results, profile: Dict, path: str = BASELINE_PATH) -> None:
+    baselines = load_baselines(path)
+    previous = baselines.get(suite)
+    if previous is not None and previous.get("profile") == profile:
+        # recording a subset of the benchmarks keeps the others
+        results = {**previous["results"], **results}
+    baselines[suite] = {"profile": profile, "results": results}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(
+    suite: str, results: Results, profile: Dict, tolerance: float = BENCH_TOLERANCE, path: str = BASELINE_PATH
+) -> Optional[List[str]]:
+    '''
+    Regressions of `results` against the stored baseline of `suite`, or None
+    when there is no baseline recorded with the same fake profile
+    '''
+    baseline = load_baselines(path).get(suite)
+    if baseline is None or baseline.get("profile") != profile:
+        return None
+    regressions = []
+    for name, metrics in baseline["results"].items():
+        for metric, expected in metrics.items():
+            actual = results.get(name, {}).get(metric)
+            if actual is None or not expected:
+                continue
+            if higher_is_better(metric):
+                failed = actual < expected * (1 - tolerance)
+            else:
+                failed = actual > expected * (1 + tolerance)
+            if failed:
+                regressions.append(f"{suite}/{name} {metric}: {actual:.4g} vs baseline {expected:.4g}")
+    return regressions
+
+
+def report(suite: str, results: Results, profile: Dict, update: bool, tolerance: float = BENCH_TOLERANCE) -> int:
+    '''
+    Print the comparison against the baseline (or record a new one) and
+    return the process exit code
+    '''
+    if update:
+        save_baseline(suite, results, profile)
+        print(f"Recorded {suite} baseline in {BASELINE_PATH}")
+        return 0
+    regressions = compare(suite, results, profile, tolerance)
+    if regressions is None:
+        print(f"No {suite} baseline for this profile, run with --update-baseline to record one")
+        return 0
+    if regressions:
+        print(f"{len(regressions)} regressions beyond {tolerance:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"No regressions against the {suite} baseline (tolerance {tolerance:.0%})")
+    return 0
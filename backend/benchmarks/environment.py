@@ -0,0 +1,175 @@
+import glob
+import os
+import random
+import sys
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_PIPE_DIR = os.path.join(BACKEND_DIR, "..", "data_pipe")
+UNI_DATA_DIR = os.path.join(DATA_PIPE_DIR, "uni_data")
+
+# words per synthetic Wikipedia article
+BENCH_ARTICLE_WORDS = int(os.getenv("BENCH_ARTICLE_WORDS", "4000"))
+
+_ARTICLE_VOCABULARY = (
+    "university campus students research faculty founded city river museum history "
+    "century college library science engineering medicine economics law students "
+    "international ranking nobel laureates alumni population transport railway "
+    "station airport culture festival music theatre architecture buildings park "
+    "housing rent cost living winter summer climate language english programme "
+    "degree master bachelor doctoral admissions scholarship tuition industry "
+    "technology startups hospital institute chancellor college society clubs sport"
+).split()
+
+
+def configure(workdir: str) -> Dict[str, str]:
+    '''
+    Point every backend setting at local, offline resources under `workdir`:
+    a SQLite copy of the tables, the local vector store and a pre-seeded
+    Wikipedia cache. The app reads its settings when its modules are imported,
+    so this has to run before anything from `app` is imported.
+    '''
+    os.makedirs(workdir, exist_ok=True)
+    env = {
+        "POSTGRES_URI": os.getenv("BENCH_DATABASE_URI") or f"sqlite:///{os.path.join(workdir, 'universities.db')}",
+        "VECTOR_STORE": "local",
+        "LOCAL_VECTOR_DIR": os.path.join(workdir, "vectors"),
+        "INDEX_MANIFEST_DIR": os.path.join(workdir, "index"),
+        "WIKI_CACHE_DIR": os.path.join(workdir, "wikipedia"),
+        "WIKI_OFFLINE": "true",
+        # shared by the uvicorn workers, a follow-up may land on another one
+        "SESSION_STORE": "disk",
+        "SESSION_DIR": os.path.join(workdir, "sessions"),
+        # every simulated user is its own client for the per-client admission cap
+        "ADMISSION_CLIENT_HEADER": "x-bench-user",
+        "OPENAI_API_KEY": "fake",
+        "ENVIRONMENT": "prod",
+    }
+    os.environ.update(env)
+    return env
+
+
+def workbooks() -> List[str]:
+    return sorted(glob.glob(os.path.join(UNI_DATA_DIR, "*.xlsx")))
+
+
+def data_pipe_reader(workers: int = 1):
+    '''
+    A data_pipe instance that has not run its pipeline (its __init__ loads
+    straight into Postgres)
+    '''
+    if DATA_PIPE_DIR not in sys.path:
+        sys.path.append(DATA_PIPE_DIR)
+    from data_converter import data_pipe
+
+    reader = data_pipe.__new__(data_pipe)
+    reader.workers = workers
+    reader.file_uni_names = {}
+    reader.coerced = {}
+    reader.filepaths = workbooks()
+    reader.tables = {table: None for table in data_pipe.tables}
+    return reader
+
+
+def _as_copied(table_df):
+    '''
+    COPY writes every value as CSV text, so cells such as timedeltas end up
+    as their string form in the VARCHAR columns; do the same for to_sql
+    '''
+    for col in table_df.columns[table_df.dtypes == object]:
+        table_df[col] = table_df[col].map(
+            lambda value: value if value is None or isinstance(value, (str, int, float)) else str(value)
+        )
+    return table_df
+
+
+def write_tables(reader, uri: str) -> Dict[str, int]:
+    '''
+    Write the parsed tables of a data_pipe `reader` to `uri` (SQLite, or a
+    scratch Postgres database), cleaned as data_pipe loads them. Returns the
+    row count per table.
+    '''
+    from sqlalchemy import text
+
+    from app.db import get_engine
+
+    engine = get_engine(uri)
+    counts = {}
+    with engine.begin() as conn:
+        for name, table in reader.tables.items():
+            table_df = _as_copied(reader.prepare_table(table, name))
+            table_df.to_sql(name, conn, if_exists="replace", index=False)
+            counts[name] = len(table_df)
+        conn.execute(text('DROP TABLE IF EXISTS "DataVersion"'))
+        conn.execute(text('CREATE TABLE "DataVersion" (id INTEGER PRIMARY KEY, version BIGINT NOT NULL)'))
+        conn.execute(text('INSERT INTO "DataVersion" (id, version) VALUES (1, 1)'))
+    return counts
+
+
+def build_database(uri: str, workers: int = 1) -> Dict[str, int]:
+    '''
+    Parse the workbooks with data_pipe and write its tables to `uri`
+    '''
+    reader = data_pipe_reader(workers)
+    reader.load_data()
+    return write_tables(reader, uri)
+
+
+def article(title: str, words: int = BENCH_ARTICLE_WORDS) -> str:
+    '''
+    Deterministic stand-in for the Wikipedia article about `title`
+    '''
+    rng = random.Random(zlib.crc32(title.encode()))
+    sentences = []
+    count = 0
+    while count < words:
+        length = rng.randint(8, 20)
+        sentence = [rng.choice(_ARTICLE_VOCABULARY) for _ in range(length)]
+        sentence[rng.randrange(length)] = title
+        sentences.append(" ".join(sentence).capitalize() + ".")
+        count += length
+    paragraphs = [" ".join(sentences[i:i + 6]) for i in range(0, len(sentences), 6)]
+    return f"{title}\n\n" + "\n\n".join(paragraphs)
+
+
+def seed_wiki_cache(titles: List[str], cache_dir: Optional[str] = None, words: int = BENCH_ARTICLE_WORDS) -> None:
+    '''
+    Write a synthetic article for every title into the Wikipedia page cache,
+    so generate_datasource runs with WIKI_OFFLINE
+    '''
+    from app.engine.wiki_cache import WIKI_CACHE_DIR, WikiPageCache
+
+    cache = WikiPageCache(cache_dir or WIKI_CACHE_DIR)
+    for title in titles:
+        cache._write({
+            "title": title,
+            "page_title": title,
+            "revision_id": zlib.crc32(title.encode()),
+            "fetched_at": time.time(),
+            "content": article(title, words),
+        })
+
+
+def entity_names(uri: Optional[str] = None) -> Tuple[List[str], List[str]]:
+    '''
+    (university names, cities) the index is built over
+    '''
+    from app.db import get_engine
+    from app.engine.entity_filter import load_universities
+
+    universities = load_universities(get_engine(uri))
+    return sorted(universities), sorted({city for city in universities.values() if city})
+
+
+def build_index(service_context) -> None:
+    '''
+    Run the real generate_datasource over the seeded cache into the local
+    vector store
+    '''
+    from app.engine.generate import generate_datasource
+
+    universities, cities = entity_names()
+    seed_wiki_cache(universities + cities)
+    generate_datasource(service_context)
@@ -0,0 +1,286 @@
+import asyncio
+import json
+import os
+import re
+import time
+import zlib
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index import ServiceContext
+from llama_index.bridge.pydantic import Field
+from llama_index.embeddings.base import BaseEmbedding
+from llama_index.llms import OpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ChatCompletionMessage
+from openai.types.completion_usage import CompletionUsage
+
+from app.engine.constants import CHUNK_OVERLAP, CHUNK_SIZE, EMBED_BATCH_SIZE
+
+# seconds before the first token of every completion
+BENCH_LLM_LATENCY = float(os.getenv("BENCH_LLM_LATENCY", "0.05"))
+# streaming rate after the first token
+BENCH_LLM_TOKENS_PER_SECOND = float(os.getenv("BENCH_LLM_TOKENS_PER_SECOND", "200"))
+# length of every answer (final answers, syntheses and summaries)
+BENCH_LLM_ANSWER_TOKENS = int(os.getenv("BENCH_LLM_ANSWER_TOKENS", "64"))
+# seconds per embedding request, whatever the batch size
+BENCH_EMBED_LATENCY = float(os.getenv("BENCH_EMBED_LATENCY", "0.01"))
+BENCH_EMBED_DIM = int(os.getenv("BENCH_EMBED_DIM", "1536"))
+
+# the agent also asks the vector tool when the question mentions one of these
+_LOCATION_WORDS = ("where", "city", "located", "history", "culture", "live")
+_SQL_TOOL = "University_DB"
+_VECTOR_TOOL = "Location and University"
+
+# valid on SQLite and Postgres, picked by a hash of the question
+_SQL_QUERIES = (
+    'SELECT uni_name, location, overall_ranking FROM "University" ORDER BY overall_ranking',
+    'SELECT uni_name, programme_name, duration, "fees (annual)" FROM "Programme" ORDER BY uni_name, programme_name',
+    'SELECT uni_name, programme_name, test_name, minimum_score FROM "TestType" ORDER BY uni_name, programme_name',
+    'SELECT uni_name, programme_name, career_opportunities FROM "ProgrammeDescription" ORDER BY uni_name',
+)
+
+_ANSWER_WORDS = (
+    "The programme is taught in English over two years and combines core modules "
+    "with electives, a research project and an optional internship in the city."
+).split()
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _stable_hash(value: str) -> int:
+    # str hashes are salted per process, crc32 is the same in every worker
+    return zlib.crc32(value.encode())
+
+
+def fake_profile() -> Dict[str, float]:
+    '''
+    The settings the fakes run with, stored next to the baselines so results
+    are only compared against runs with the same simulated latencies
+    '''
+    return {
+        "llm_latency": BENCH_LLM_LATENCY,
+        "llm_tokens_per_second": BENCH_LLM_TOKENS_PER_SECOND,
+        "llm_answer_tokens": BENCH_LLM_ANSWER_TOKENS,
+        "embed_latency": BENCH_EMBED_LATENCY,
+        "embed_dim": BENCH_EMBED_DIM,
+    }
+
+
+class _Reply:
+    '''
+    What the fake model answers: either text or tool calls.
+    '''
+
+    def __init__(self, text: Optional[str] = None, tool_calls: Sequence[Tuple[str, str]] = ()):
+        self.text = text
+        self.tool_calls = list(tool_calls)
+
+    @property
+    def tokens(self) -> int:
+        if self.text is not None:
+            return len(self.text.split())
+        return sum(len(arguments.split()) for _, arguments in self.tool_calls)
+
+
+class FakeOpenAI(OpenAI):
+    '''
+    OpenAI LLM whose client is replaced by a deterministic in-process fake, so
+    the agent, the streaming parser and the callbacks all run unchanged.
+
+    Every completion waits `latency` seconds for its first token and then
+    streams `tokens_per_second`. Agent turns call `University_DB`, plus the
+    vector tool for questions about places, and answer once the tool results
+    are in; text-to-SQL prompts get one of a few fixed statements.
+    '''
+
+    latency: float = Field(default=BENCH_LLM_LATENCY)
+    tokens_per_second: float = Field(default=BENCH_LLM_TOKENS_PER_SECOND)
+    answer_tokens: int = Field(default=BENCH_LLM_ANSWER_TOKENS)
+
+    def __init__(self, **kwargs: Any):
+        kwargs.setdefault("api_key", "fake")
+        super().__init__(**kwargs)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "fake_openai_llm"
+
+    def _get_client(self) -> Any:
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self._create)))
+
+    def _get_aclient(self) -> Any:
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self._acreate)))
+
+    def _reply(self, messages: List[Dict[str, Any]], tools: Optional[List[Dict]]) -> _Reply:
+        user_turns = [i for i, m in enumerate(messages) if m["role"] == "user"]
+        last_user = user_turns[-1] if user_turns else 0
+        question = (messages[last_user].get("content") or "").split("\n")[0]
+        answered = any(m["role"] == "tool" for m in messages[last_user + 1:])
+        if tools and not answered:
+            names = [tool["function"]["name"] for tool in tools]
+            chosen = [name for name in names if name == _SQL_TOOL]
+            if _VECTOR_TOOL in names and any(word in question.lower() for word in _LOCATION_WORDS):
+                chosen.append(_VECTOR_TOOL)
+            arguments = json.dumps({"input": question})
+            return _Reply(tool_calls=[(name, arguments) for name in chosen or names[:1]])
+
+        prompt = messages[-1].get("content") or ""
+        if "SQLQuery:" in prompt:
+            asked = prompt.rsplit("Question:", 1)[-1].split("\n")[0]
+            return _Reply(text=_SQL_QUERIES[_stable_hash(asked) % len(_SQL_QUERIES)])
+        words = [_ANSWER_WORDS[i % len(_ANSWER_WORDS)] for i in range(self.answer_tokens)]
+        return _Reply(text=" ".join(words))
+
+    def _seconds(self, reply: _Reply) -> float:
+        return self.latency + reply.tokens / self.tokens_per_second
+
+    def _completion(self, messages: List[Dict[str, Any]], reply: _Reply) -> ChatCompletion:
+        message = {"role": "assistant", "content": reply.text}
+        if reply.tool_calls:
+            message["tool_calls"] = [
+                {"id": f"call_{i}", "type": "function", "function": {"name": name, "arguments": arguments}}
+                for i, (name, arguments) in enumerate(reply.tool_calls)
+            ]
+        prompt_tokens = sum(len(str(m.get("content") or "").split()) for m in messages)
+        return ChatCompletion(
+            id="fake",
+            object="chat.completion",
+            created=int(time.time()),
+            model=self.model,
+            choices=[{
+                "index": 0,
+                "message": ChatCompletionMessage.model_validate(message),
+                "finish_reason": "tool_calls" if reply.tool_calls else "stop",
+            }],
+            usage=CompletionUsage(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=reply.tokens,
+                total_tokens=prompt_tokens + reply.tokens,
+            ),
+        )
+
+    def _chunk(self, delta: Dict[str, Any], finish_reason: Optional[str] = None) -> ChatCompletionChunk:
+        return ChatCompletionChunk(
+            id="fake",
+            object="chat.completion.chunk",
+            created=int(time.time()),
+            model=self.model,
+            choices=[{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        )
+
+    def _chunks(self, reply: _Reply) -> Iterator[Tuple[float, ChatCompletionChunk]]:
+        '''
+        (seconds to wait before it, chunk) in the shape OpenAI streams them
+        '''
+        if reply.tool_calls:
+            for i, (name, arguments) in enumerate(reply.tool_calls):
+                yield self.latency if i == 0 else 0.0, self._chunk({
+                    "role": "assistant",
+                    "tool_calls": [{
+                        "index": i,
+                        "id": f"call_{i}",
+                        "type": "function",
+                        "function": {"name": name, "arguments": arguments},
+                    }],
+                })
+            yield 0.0, self._chunk({}, "tool_calls")
+            return
+        yield self.latency, self._chunk({"role": "assistant", "content": ""})
+        for i, word in enumerate(reply.text.split()):
+            yield (0.0 if i == 0 else 1 / self.tokens_per_second), self._chunk(
+                {"content": word if i == 0 else f" {word}"}
+            )
+        yield 0.0, self._chunk({}, "stop")
+
+    def _create(self, messages: List[Dict[str, Any]], stream: bool = False, tools: Optional[List[Dict]] = None, **kwargs: Any):
+        reply = self._reply(messages, tools)
+        if not stream:
+            time.sleep(self._seconds(reply))
+            return self._completion(messages, reply)
+
+        def gen() -> Iterator[ChatCompletionChunk]:
+            for wait, chunk in self._chunks(reply):
+                if wait:
+                    time.sleep(wait)
+                yield chunk
+
+        return gen()
+
+    async def _acreate(self, messages: List[Dict[str, Any]], stream: bool = False, tools: Optional[List[Dict]] = None, **kwargs: Any):
+        reply = self._reply(messages, tools)
+        if not stream:
+            await asyncio.sleep(self._seconds(reply))
+            return self._completion(messages, reply)
+
+        async def gen() -> AsyncIterator[ChatCompletionChunk]:
+            for wait, chunk in self._chunks(reply):
+                if wait:
+                    await asyncio.sleep(wait)
+                yield chunk
+
+        return gen()
+
+
+class FakeEmbedding(BaseEmbedding):
+    '''
+    Deterministic hashed bag-of-words embedding: texts sharing words get
+    similar vectors, so retrieval, the entity prefilter and the semantic
+    cache behave plausibly. Every request (one text or one batch) waits
+    `latency` seconds.
+    '''
+
+    dim: int = Field(default=BENCH_EMBED_DIM)
+    latency: float = Field(default=BENCH_EMBED_LATENCY)
+
+    def __init__(self, **kwargs: Any):
+        kwargs.setdefault("model_name", "fake-embedding")
+        kwargs.setdefault("embed_batch_size", EMBED_BATCH_SIZE)
+        super().__init__(**kwargs)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeEmbedding"
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in _WORD_RE.findall(text.lower()):
+            h = _stable_hash(word)
+            vector[h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            vector[0] = 1.0
+            norm = 1.0
+        return (vector / norm).tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._vector(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        await asyncio.sleep(self.latency)
+        return self._vector(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._vector(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+
+def create_fake_service_context():
+    '''
+    Drop-in for app.engine.context.create_service_context
+    '''
+    return ServiceContext.from_defaults(
+        llm=FakeOpenAI(model=os.getenv("MODEL", "gpt-3.5-turbo")),
+        embed_model=FakeEmbedding(),
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+    )
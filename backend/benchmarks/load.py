@@ -0,0 +1,289 @@
+'''
+Load test of the chat API over deterministic fakes.
+
+Builds a SQLite copy of the tables from data_pipe/uni_data and a local
+vector index (with the fake embedding model), starts the real app under
+uvicorn with the fake OpenAI client, drives /api/chat concurrently and
+reports latency percentiles, time to first token, requests per second and
+memory per worker, failing on regressions against benchmarks/baselines.json.
+
+    python -m benchmarks.load [--scenario concurrent] [--workers 2] [--repeat 3] [--update-baseline]
+'''
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import httpx
+
+from benchmarks.baseline import BENCH_TOLERANCE, best, percentile, report
+from benchmarks.environment import BACKEND_DIR, configure
+
+BENCH_WORKERS = int(os.getenv("BENCH_WORKERS", "2"))
+SERVER_START_TIMEOUT = 120
+
+QUESTION_TEMPLATES = (
+    "What master's programmes does {uni} offer and how long do they take?",
+    "What are the annual tuition fees for programmes at {uni}?",
+    "Which language tests does {uni} accept and what are the minimum scores?",
+    "Where is {uni} located and what is the city like for students?",
+    "What career opportunities do graduates of {uni} programmes have?",
+    "Tell me about the history and culture of {uni}.",
+)
+
+
+class Scenario(NamedTuple):
+    concurrency: int
+    requests: int
+    # only ask the first `distinct` questions (cache hits), 0 for all of them
+    distinct: int = 0
+    # follow-up questions per server-side session, 1 for stateless requests
+    turns: int = 1
+
+
+SCENARIOS = {
+    "single": Scenario(concurrency=1, requests=20),
+    "concurrent": Scenario(concurrency=32, requests=256),
+    "repeated": Scenario(concurrency=32, requests=256, distinct=8),
+    "conversation": Scenario(concurrency=16, requests=128, turns=4),
+}
+
+
+def questions(universities: List[str], seed: int = 0) -> List[str]:
+    pool = [template.format(uni=uni) for uni in universities for template in QUESTION_TEMPLATES]
+    random.Random(seed).shuffle(pool)
+    return pool
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _proc_status(pid: int) -> Dict[str, int]:
+    values = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                values[key] = int(value.split()[0])
+    return values
+
+
+def worker_pids(pid: int) -> List[int]:
+    '''
+    uvicorn worker processes under the server `pid` (the server itself
+    when it runs a single worker)
+    '''
+    children = []
+    for path in glob.glob(f"/proc/{pid}/task/*/children"):
+        with open(path) as f:
+            children += [int(child) for child in f.read().split()]
+    workers = []
+    for child in children:
+        try:
+            with open(f"/proc/{child}/cmdline", "rb") as f:
+                if b"spawn_main" in f.read():
+                    workers.append(child)
+        except FileNotFoundError:
+            pass
+    return workers or [pid]
+
+
+def worker_memory(pid: int) -> Dict[str, float]:
+    '''
+    Largest current and peak resident memory over the workers, in MB
+    '''
+    if not os.path.exists(f"/proc/{pid}"):
+        return {}
+    statuses = []
+    for worker in worker_pids(pid):
+        try:
+            statuses.append(_proc_status(worker))
+        except FileNotFoundError:
+            pass
+    if not statuses:
+        return {}
+    return {
+        "worker_rss_mb": max(s["VmRSS"] for s in statuses) / 1024,
+        "worker_peak_rss_mb": max(s["VmHWM"] for s in statuses) / 1024,
+    }
+
+
+class Server:
+    '''
+    The app under uvicorn in a subprocess, serving the fakes
+    '''
+
+    def __init__(self, env: Dict[str, str], workers: int, log_path: str):
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self._log = open(log_path, "w")
+        self.log_path = log_path
+        self.process = subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "benchmarks.server:app",
+                "--host", "127.0.0.1", "--port", str(self.port),
+                "--workers", str(workers), "--no-access-log", "--log-level", "warning",
+            ],
+            cwd=BACKEND_DIR,
+            env={**os.environ, **env},
+            stdout=self._log,
+            stderr=subprocess.STDOUT,
+        )
+
+    def wait_ready(self, timeout: float = SERVER_START_TIMEOUT) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with {self.process.returncode}, see {self.log_path}")
+            try:
+                if httpx.get(f"{self.base_url}/metrics", timeout=1).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"Server did not start within {timeout:g}s, see {self.log_path}")
+
+    def stop(self) -> None:
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self._log.close()
+
+
+async def _ask(
+    client: httpx.AsyncClient, question: str, session_id: Optional[str] = None, user: str = "0"
+) -> Tuple[float, Optional[float], bool]:
+    '''
+    (seconds to the last byte, seconds to the first byte, succeeded)
+    '''
+    payload = {"messages": [{"role": "user", "content": question}]}
+    if session_id is not None:
+        payload["session_id"] = session_id
+    start = time.perf_counter()
+    first = None
+    try:
+        async with client.stream("POST", "/api/chat", json=payload, headers={"x-bench-user": user}) as response:
+            async for chunk in response.aiter_bytes():
+                if chunk and first is None:
+                    first = time.perf_counter() - start
+            ok = response.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    return time.perf_counter() - start, first, ok
+
+
+async def run_scenario(base_url: str, scenario: Scenario, pool: List[str]) -> Dict[str, float]:
+    pool = pool[:scenario.distinct] if scenario.distinct else pool
+    jobs = iter(range(scenario.requests))
+    samples = []
+
+    async def user(client: httpx.AsyncClient, name: str):
+        session_id = None
+        turn = 0
+        for job in jobs:
+            if scenario.turns > 1 and turn % scenario.turns == 0:
+                response = await client.post("/api/chat/sessions")
+                session_id = response.json()["session_id"]
+            turn += 1
+            samples.append(await _ask(client, pool[job % len(pool)], session_id, name))
+
+    limits = httpx.Limits(max_connections=scenario.concurrency, max_keepalive_connections=scenario.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(user(client, str(i)) for i in range(scenario.concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies = [latency for latency, _, ok in samples if ok]
+    ttfts = [first for _, first, ok in samples if ok and first is not None]
+    return {
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_p99": percentile(latencies, 99),
+        "ttft_p50": percentile(ttfts, 50),
+        "ttft_p95": percentile(ttfts, 95),
+        "ttft_p99": percentile(ttfts, 99),
+        "rps": len(latencies) / elapsed,
+        "errors": len(samples) - len(latencies),
+    }
+
+
+def prepare(workdir: str) -> List[str]:
+    '''
+    Build the database (once per workdir) and sync the index, return the
+    university names the questions are about
+    '''
+    from benchmarks.environment import build_database, build_index, entity_names
+    from benchmarks.fakes import create_fake_service_context
+
+    uri = os.environ["POSTGRES_URI"]
+    if uri.startswith("sqlite:///") and os.path.exists(uri[len("sqlite:///"):]):
+        print(f"Reusing {uri}")
+    else:
+        print(f"Building {uri} from data_pipe/uni_data")
+        build_database(uri)
+    build_index(create_fake_service_context())
+    return entity_names()[0]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="default: all")
+    parser.add_argument("--workers", type=int, default=BENCH_WORKERS)
+    parser.add_argument("--repeat", type=int, default=1, help="keep the best of this many runs per scenario")
+    parser.add_argument("--workdir", help="kept between runs to skip rebuilding the database")
+    parser.add_argument("--tolerance", type=float, default=BENCH_TOLERANCE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="chat-bench-")
+    env = configure(workdir)
+    universities = prepare(workdir)
+    pool = questions(universities)
+
+    from benchmarks.fakes import fake_profile
+
+    server = Server(env, args.workers, os.path.join(workdir, "server.log"))
+    results = {}
+    try:
+        server.wait_ready()
+        # every worker builds its engine on the first requests it gets
+        asyncio.run(run_scenario(server.base_url, Scenario(args.workers * 4, args.workers * 8), pool[::-1]))
+        for name in args.scenario or list(SCENARIOS):
+            runs = [
+                asyncio.run(run_scenario(server.base_url, SCENARIOS[name], pool))
+                for _ in range(max(args.repeat, 1))
+            ]
+            results[name] = best(runs)
+            results[name]["errors"] = sum(run["errors"] for run in runs)
+            results[name].update(worker_memory(server.process.pid))
+            print(f"{name}: " + ", ".join(f"{metric} {value:.4g}" for metric, value in results[name].items()))
+    finally:
+        server.stop()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    errors = sum(result["errors"] for result in results.values())
+    if errors:
+        print(f"{errors} requests failed, see {server.log_path}")
+        return 1
+    return report("load", results, {**fake_profile(), "workers": args.workers}, args.update_baseline, args.tolerance)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+'''
+Micro-benchmarks of the offline pipelines: data_pipe workbook parsing
+(DataFrame and streaming readers), writing the tables, and
+generate_datasource indexing (full rebuild and no-op incremental sync) with
+the fake embedding model. Fails on regressions against
+benchmarks/baselines.json.
+
+    python -m benchmarks.micro [--benchmark parse] [--repeat 3] [--update-baseline]
+'''
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Tuple
+
+from benchmarks.baseline import BENCH_TOLERANCE, best, report
+from benchmarks.environment import configure
+
+BENCH_PARSE_WORKERS = int(os.getenv("BENCH_PARSE_WORKERS", str(min(os.cpu_count() or 1, 4))))
+
+
+def _parse(workers: int) -> Tuple[float, int]:
+    from benchmarks.environment import data_pipe_reader
+
+    reader = data_pipe_reader(workers)
+    start = time.perf_counter()
+    reader.load_data()
+    elapsed = time.perf_counter() - start
+    return elapsed, sum(len(table) for table in reader.tables.values())
+
+
+def bench_parse() -> Dict[str, float]:
+    elapsed, rows = _parse(1)
+    return {"seconds": elapsed, "rows_per_second": rows / elapsed}
+
+
+def bench_parse_parallel() -> Dict[str, float]:
+    elapsed, rows = _parse(BENCH_PARSE_WORKERS)
+    return {"seconds": elapsed, "rows_per_second": rows / elapsed}
+
+
+def bench_stream() -> Dict[str, float]:
+    import openpyxl
+
+    from benchmarks.environment import data_pipe_reader
+
+    reader = data_pipe_reader()
+    rows = 0
+    start = time.perf_counter()
+    for path in reader.filepaths:
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            for table in reader.tables:
+                rows += sum(1 for _ in reader.iter_table(workbook[table], path, table))
+        finally:
+            workbook.close()
+    elapsed = time.perf_counter() - start
+    return {"seconds": elapsed, "rows_per_second": rows / elapsed}
+
+
+def bench_load() -> Dict[str, float]:
+    from benchmarks.environment import data_pipe_reader, write_tables
+
+    reader = data_pipe_reader()
+    reader.load_data()
+    directory = tempfile.mkdtemp(prefix="chat-bench-db-")
+    try:
+        start = time.perf_counter()
+        rows = sum(write_tables(reader, f"sqlite:///{os.path.join(directory, 'universities.db')}").values())
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {"seconds": elapsed, "rows_per_second": rows / elapsed}
+
+
+def _generate() -> float:
+    from app.engine.generate import generate_datasource
+    from benchmarks.fakes import create_fake_service_context
+
+    service_context = create_fake_service_context()
+    start = time.perf_counter()
+    generate_datasource(service_context)
+    return time.perf_counter() - start
+
+
+def _vector_count() -> int:
+    from app.engine.local_vector_store import LocalVectorStore
+
+    return len(LocalVectorStore(persist_dir=os.environ["LOCAL_VECTOR_DIR"]))
+
+
+def bench_index() -> Dict[str, float]:
+    shutil.rmtree(os.environ["LOCAL_VECTOR_DIR"], ignore_errors=True)
+    shutil.rmtree(os.environ["INDEX_MANIFEST_DIR"], ignore_errors=True)
+    elapsed = _generate()
+    return {"seconds": elapsed, "chunks_per_second": _vector_count() / elapsed}
+
+
+def bench_index_incremental() -> Dict[str, float]:
+    # nothing changed since bench_index (or the previous repeat), so nothing is embedded
+    return {"seconds": _generate()}
+
+
+BENCHMARKS: Dict[str, Callable[[], Dict[str, float]]] = {
+    "parse": bench_parse,
+    "parse_parallel": bench_parse_parallel,
+    "stream": bench_stream,
+    "load": bench_load,
+    "index": bench_index,
+    "index_incremental": bench_index_incremental,
+}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--benchmark", action="append", choices=list(BENCHMARKS), help="default: all")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--workdir")
+    parser.add_argument("--tolerance", type=float, default=BENCH_TOLERANCE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    configure(args.workdir or tempfile.mkdtemp(prefix="chat-bench-"))
+    from benchmarks.environment import build_database, entity_names, seed_wiki_cache
+    from benchmarks.fakes import fake_profile
+
+    names = args.benchmark or list(BENCHMARKS)
+    if {"index", "index_incremental"} & set(names):
+        uri = os.environ["POSTGRES_URI"]
+        if not (uri.startswith("sqlite:///") and os.path.exists(uri[len("sqlite:///"):])):
+            build_database(uri)
+        universities, cities = entity_names()
+        seed_wiki_cache(universities + cities)
+    if "index_incremental" in names and "index" not in names:
+        _generate()
+
+    results = {}
+    for name in names:
+        results[name] = best([BENCHMARKS[name]() for _ in range(max(args.repeat, 1))])
+        print(f"{name}: " + ", ".join(f"{metric} {value:.4g}" for metric, value in results[name].items()))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    profile = {**fake_profile(), "parse_workers": BENCH_PARSE_WORKERS}
+    return report("micro", results, profile, args.update_baseline, args.tolerance)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
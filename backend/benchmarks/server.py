@@ -0,0 +1,12 @@
+'''
+ASGI entry point serving the real app over the fakes, for
+`uvicorn benchmarks.server:app`. The environment has to be prepared by
+benchmarks.environment.configure (benchmarks.load passes it down).
+'''
+import app.engine.index as index
+from benchmarks.fakes import create_fake_service_context
+
+# the registry builds everything else (SQL, vector store, caches) as usual
+index.create_service_context = create_fake_service_context
+
+from main import app  # noqa: E402
@@ -5,11 +5,32 @@ load_dotenv()
 import logging
 import os
 import uvicorn
+from contextlib import asynccontextmanager
 from app.api.routers.chat import chat_router
+from app.admission import ADMISSION_ENABLED, AdmissionMiddleware, admission
+from app.db import dispose_engines
+from app.engine.agent import shutdown_tool_executor
+from app.engine.executor import shutdown_executor
+from app.engine.index import registry
+from app.metrics import REGISTRY, TimingMiddleware
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # build the shared LLM / vector store / SQL components once per process
+    await run_in_threadpool(registry.warm)
+    yield
+    registry.close()
+    shutdown_executor()
+    shutdown_tool_executor()
+    dispose_engines()
+
+
+app = FastAPI(lifespan=lifespan)
 
 environment = os.getenv("ENVIRONMENT", "dev")  # Default to 'development' if not set
 
@@ -25,8 +46,19 @@ if environment == "dev":
         allow_headers=["*"],
     )
 
+if ADMISSION_ENABLED:
+    # inside TimingMiddleware, so queueing and 429s are timed and traced too
+    app.add_middleware(AdmissionMiddleware)
+    registry.response_hooks.append(admission.observe_response)
+app.add_middleware(TimingMiddleware)
+
 app.include_router(chat_router, prefix="/api/chat")
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     uvicorn.run(app="main:app", host="0.0.0.0", reload=True)
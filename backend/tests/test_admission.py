@@ -0,0 +1,236 @@
+import asyncio
+
+import httpx
+import pytest
+from llama_index.llms.openai import OpenAI
+from llama_index.tools import FunctionTool
+
+from app import admission as admission_module
+from app.admission import AdmissionController, AdmissionMiddleware, Overloaded
+from app.context import with_response_hooks
+from app.engine.agent import ParallelOpenAIAgent
+from app.engine.executor import stream_chat
+
+
+def _controller(**kwargs) -> AdmissionController:
+    kwargs.setdefault("max_limit", 2)
+    kwargs.setdefault("min_limit", 1)
+    kwargs.setdefault("per_client", 2)
+    kwargs.setdefault("queue_size", 2)
+    kwargs.setdefault("queue_timeout", 5)
+    kwargs.setdefault("latency_target", 1)
+    kwargs.setdefault("cooldown", 0)
+    return AdmissionController(**kwargs)
+
+
+def _state(controller: AdmissionController):
+    # (requests holding a slot, requests waiting)
+    return controller.active, len(controller._waiters)
+
+
+async def _queued(controller: AdmissionController, client: str) -> asyncio.Task:
+    task = asyncio.ensure_future(controller.acquire(client))
+    await asyncio.sleep(0)
+    return task
+
+
+def test_requests_queue_for_a_slot_in_order():
+    async def main():
+        controller = _controller()
+        await controller.acquire("a")
+        await controller.acquire("b")
+        first = await _queued(controller, "c")
+        second = await _queued(controller, "d")
+        assert _state(controller) == (2, 2)
+
+        controller.release("a", 0.1, 0.1)
+        await first
+        assert not second.done()
+        controller.release("b", 0.1, 0.1)
+        assert await second >= 0
+        assert _state(controller) == (2, 0)
+
+    asyncio.run(main())
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    async def main():
+        controller = _controller(queue_size=1)
+        await controller.acquire("a")
+        await controller.acquire("b")
+        waiting = await _queued(controller, "c")
+        with pytest.raises(Overloaded) as error:
+            await controller.acquire("d")
+        assert error.value.reason == "queue_full"
+        assert 1 <= error.value.retry_after <= 60
+        waiting.cancel()
+
+    asyncio.run(main())
+
+
+def test_client_over_its_cap_waits_and_is_rejected_beyond_its_queue():
+    async def main():
+        controller = _controller(max_limit=4, per_client=1, queue_size=4)
+        await controller.acquire("a")
+        # "a" is at its cap, its next request waits although slots are free
+        waiting = await _queued(controller, "a")
+        assert not waiting.done()
+        with pytest.raises(Overloaded) as error:
+            await controller.acquire("a")
+        assert error.value.reason == "client_queue_full"
+        # other clients are not held up behind it
+        assert await controller.acquire("b") == 0.0
+        controller.release("a", 0.1, 0.1)
+        await waiting
+        assert controller.active == 2
+
+    asyncio.run(main())
+
+
+def test_queued_request_times_out():
+    async def main():
+        controller = _controller(max_limit=1, queue_timeout=0.05)
+        await controller.acquire("a")
+        with pytest.raises(Overloaded) as error:
+            await controller.acquire("b")
+        assert error.value.reason == "timeout"
+        assert _state(controller) == (1, 0)
+
+    asyncio.run(main())
+
+
+def test_cancelled_queued_request_gives_up_its_place():
+    async def main():
+        controller = _controller(max_limit=1)
+        await controller.acquire("a")
+        gone = await _queued(controller, "b")
+        waiting = await _queued(controller, "c")
+        gone.cancel()
+        await asyncio.sleep(0)
+        assert _state(controller) == (1, 1)
+        controller.release("a", 0.1, 0.1)
+        await waiting
+        assert _state(controller) == (1, 0)
+
+    asyncio.run(main())
+
+
+def test_slow_answers_cut_the_limit():
+    async def main():
+        controller = _controller(max_limit=10, min_limit=4, backoff=0.5)
+        await controller.acquire("a")
+        controller.release("a", 5, 5)
+        assert controller.limit == 5
+        await controller.acquire("a")
+        controller.release("a", 5, 5)
+        assert controller.limit == 4
+
+    asyncio.run(main())
+
+
+def test_saturated_successes_grow_the_limit_back():
+    async def main():
+        controller = _controller(max_limit=10)
+        controller.limit = 5.0
+        for client in "abcde":
+            await controller.acquire(client)
+        # every finished request is replaced right away, as under load:
+        # one slot per limit's worth of requests completed at capacity
+        for client in "abcde":
+            controller.release(client, 0.1, 0.1)
+            await controller.acquire(client)
+        assert 5.8 < controller.limit < 6
+        for client in "abcde":
+            controller.release(client, 0.1, 0.1)
+        # and none without load
+        limit = controller.limit
+        await controller.acquire("a")
+        controller.release("a", 0.1, 0.1)
+        assert controller.limit == limit
+
+    asyncio.run(main())
+
+
+def test_empty_answers_do_not_grow_the_limit():
+    async def main():
+        controller = _controller(max_limit=4, backoff=0.5)
+        controller.limit = 2.0
+        await controller.acquire("a")
+        await controller.acquire("b")
+        controller.release("a", 0.01, 0.01, succeeded=False)
+        assert controller.limit == 2.0
+
+    asyncio.run(main())
+
+
+def test_cuts_are_limited_by_the_cooldown():
+    async def main():
+        controller = _controller(max_limit=10, backoff=0.5, cooldown=60)
+        for client in "ab":
+            await controller.acquire(client)
+        controller.release("a", 5, 5)
+        controller.release("b", 5, 5)
+        assert controller.limit == 5
+
+    asyncio.run(main())
+
+
+def test_clients_are_identified_by_the_entry_the_trusted_proxy_appended(monkeypatch):
+    monkeypatch.setattr(admission_module, "ADMISSION_CLIENT_HEADER", "x-forwarded-for")
+    middleware = AdmissionMiddleware(None, _controller())
+
+    def client(*forwarded, hops=1):
+        monkeypatch.setattr(admission_module, "ADMISSION_TRUSTED_HOPS", hops)
+        headers = [(b"x-forwarded-for", value.encode()) for value in forwarded]
+        return middleware._client({"headers": headers, "client": ("10.0.0.2", 5000)})
+
+    # whatever the caller puts first, the proxy appends the real address
+    assert client("1.1.1.1, 203.0.113.7") == "203.0.113.7"
+    assert client("2.2.2.2, 203.0.113.7") == "203.0.113.7"
+    assert client("1.1.1.1", "203.0.113.7") == "203.0.113.7"
+    assert client("1.1.1.1, 203.0.113.7, 10.0.0.1", hops=2) == "203.0.113.7"
+    # not passed through every trusted proxy
+    assert client("203.0.113.7", hops=2) == "10.0.0.2"
+    assert client() == "10.0.0.2"
+
+
+def test_rate_limits_seen_while_a_request_ran_cut_the_limit():
+    async def main():
+        controller = _controller(max_limit=10, backoff=0.5)
+        controller.note_rate_limit()
+        await asyncio.sleep(0.02)
+        # a 429 from before the request started says nothing about it
+        await controller.acquire("a")
+        controller.release("a", 0.01, 0.01)
+        assert controller.limit == 10
+        await controller.acquire("a")
+        controller.note_rate_limit()
+        controller.release("a", 0.01, 0.01)
+        assert controller.limit == 5
+
+    asyncio.run(main())
+
+
+def test_rate_limit_swallowed_by_the_agent_stream_still_cuts_the_limit():
+    controller = _controller(max_limit=10, backoff=0.5)
+    calls = []
+
+    def rate_limited(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.path)
+        return httpx.Response(429, json={"error": {"message": "Rate limit reached", "type": "requests"}})
+
+    llm = with_response_hooks(OpenAI(api_key="fake", max_retries=0), [controller.observe_response])
+    llm._aclient._client._transport = httpx.MockTransport(rate_limited)
+    tool = FunctionTool.from_defaults(fn=lambda name: name, name="University_DB", description="Universities")
+    agent = ParallelOpenAIAgent.from_tools([tool], llm=llm)
+
+    async def main():
+        await controller.acquire("a")
+        tokens = [token async for token in stream_chat(agent, "What is TUM?", [], mode="async")]
+        # llama_index logs the error and ends the stream, nothing is raised
+        assert tokens == []
+        controller.release("a", 0.05, 0.05, succeeded=bool(tokens))
+
+    asyncio.run(main())
+    assert calls
+    assert controller.limit == 5
@@ -0,0 +1,43 @@
+import time
+
+from llama_index.llms.openai import OpenAI
+from llama_index.tools import FunctionTool
+from openai.types.chat.chat_completion_message_tool_call import ChatCompletionMessageToolCall, Function
+
+from app.engine.agent import ParallelOpenAIAgentWorker
+
+
+def lookup(name: str) -> str:
+    '''Look up a university'''
+    if name == "slow":
+        time.sleep(1)
+    return f"{name} found"
+
+
+def _tool_call(name: str) -> ChatCompletionMessageToolCall:
+    return ChatCompletionMessageToolCall(
+        id=f"call_{name}",
+        type="function",
+        function=Function(name="lookup", arguments=f'{{"name": "{name}"}}'),
+    )
+
+
+def _worker(tools, tool_timeout: float) -> ParallelOpenAIAgentWorker:
+    return ParallelOpenAIAgentWorker(
+        tools, OpenAI(api_key="fake"), prefix_messages=[], tool_timeout=tool_timeout
+    )
+
+
+def test_results_keep_the_order_of_the_calls():
+    tools = [FunctionTool.from_defaults(fn=lookup)]
+    results = _worker(tools, 5)._call_functions(tools, [_tool_call("TUM"), _tool_call("ETH")])
+    assert [output.content for _, output in results] == ["TUM found", "ETH found"]
+    assert [message.additional_kwargs["tool_call_id"] for message, _ in results] == ["call_TUM", "call_ETH"]
+
+
+def test_a_single_call_times_out():
+    tools = [FunctionTool.from_defaults(fn=lookup)]
+    start = time.perf_counter()
+    results = _worker(tools, 0.1)._call_functions(tools, [_tool_call("slow")])
+    assert time.perf_counter() - start < 0.9
+    assert "timed out" in results[0][1].content
@@ -0,0 +1,46 @@
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from app.engine.data_version import VERSION_TABLE, DataVersion
+
+
+class FlakyEngine:
+    '''
+    Engine whose connections fail while `down` is set
+    '''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.down = False
+
+    def connect(self):
+        if self.down:
+            raise OperationalError("SELECT 1", {}, Exception("connection refused"))
+        return self.engine.connect()
+
+
+def _engine(version=None):
+    engine = create_engine("sqlite://")
+    if version is not None:
+        with engine.begin() as conn:
+            conn.execute(text(f'CREATE TABLE "{VERSION_TABLE}" (id INTEGER PRIMARY KEY, version TEXT)'))
+            conn.execute(text(f'INSERT INTO "{VERSION_TABLE}" VALUES (1, :version)'), {"version": version})
+    return engine
+
+
+def test_reads_the_stamp():
+    assert DataVersion(_engine("7"), poll_interval=0).current() == "7"
+
+
+def test_missing_table_is_version_zero():
+    assert DataVersion(_engine(), poll_interval=0).current() == "0"
+
+
+def test_transient_error_keeps_the_last_version():
+    engine = FlakyEngine(_engine("7"))
+    version = DataVersion(engine, poll_interval=0)
+    assert version.current() == "7"
+    engine.down = True
+    assert version.current() == "7"
+    engine.down = False
+    assert version.current() == "7"
@@ -0,0 +1,76 @@
+from llama_index.vector_stores.types import FilterCondition
+
+from app.engine.entity_filter import EntityMatcher
+
+UNIVERSITIES = {
+    "Technical University of Munich": "Munich",
+    "University of Munich": "Munich",
+    "ETH Zürich": "Zurich",
+    "University of Zurich": "Zurich",
+    "University College London": "London",
+    "UCL": "London",
+    "University of Bern": "Bern",
+}
+
+
+def _filter_values(filters):
+    return {(f.key, f.value) for f in filters.filters}
+
+
+def test_exact_names_are_matched_regardless_of_case_and_accents():
+    matcher = EntityMatcher(UNIVERSITIES)
+    assert matcher.match("What does eth zurich teach?") == ({"ETH Zürich"}, set())
+    assert matcher.match("Is London expensive?") == (set(), {"London"})
+
+
+def test_longer_names_win_over_the_names_inside_them():
+    matcher = EntityMatcher(UNIVERSITIES)
+    universities, locations = matcher.match("What are the fees at the Technical University of Munich?")
+    assert universities == {"Technical University of Munich"}
+    assert locations == set()
+    # on its own the shorter name still matches
+    assert matcher.match("What are the fees at the University of Munich?")[0] == {"University of Munich"}
+
+
+def test_misspelled_names_are_matched_fuzzily():
+    matcher = EntityMatcher(UNIVERSITIES)
+    assert matcher.match("Fees at the Techincal Universty of Munich?")[0] == {"Technical University of Munich"}
+    assert matcher.match("Fees at the Technical College of Berlin?") == (set(), set())
+
+
+def test_acronyms_of_university_names():
+    matcher = EntityMatcher(UNIVERSITIES)
+    assert matcher.match("Which master programmes does TUM offer?")[0] == {"Technical University of Munich"}
+    assert matcher.match("Which master programmes does UCL offer?")[0] == {"UCL", "University College London"}
+    # only upper-case words are read as acronyms
+    assert matcher.match("Is there a tum in the city?") == (set(), set())
+
+
+def test_short_names_are_only_matched_exactly():
+    matcher = EntityMatcher(UNIVERSITIES)
+    assert matcher.match("Is Bern expensive?")[1] == {"Bern"}
+    assert matcher.match("Is Berne expensive?") == (set(), set())
+    assert matcher.match("How about UCLA?") == (set(), set())
+
+
+def test_a_city_brings_in_its_universities():
+    matcher = EntityMatcher(UNIVERSITIES)
+    filters = matcher.filters("Which universities are there in Zurich?")
+    assert filters.condition == FilterCondition.OR
+    assert _filter_values(filters) == {
+        ("uni_name", "ETH Zürich"),
+        ("uni_name", "University of Zurich"),
+        ("location", "Zurich"),
+    }
+
+
+def test_a_university_brings_in_its_city():
+    matcher = EntityMatcher(UNIVERSITIES)
+    filters = matcher.filters("What does the University of Bern cost?")
+    assert _filter_values(filters) == {("uni_name", "University of Bern"), ("location", "Bern")}
+
+
+def test_no_filters_without_a_known_entity():
+    matcher = EntityMatcher(UNIVERSITIES)
+    assert matcher.filters("Which programmes need an IELTS score?") is None
+    assert EntityMatcher({}).filters("What does TUM cost?") is None
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from app.engine import executor
+from app.engine.executor import stream_chat
+
+TOKENS = [f"t{i} " for i in range(200)]
+
+
+class BlockingEngine:
+    '''
+    Chat engine with only the blocking stream_chat, like the agents in thread mode
+    '''
+
+    def __init__(self, fail_after: int = None):
+        self.fail_after = fail_after
+        self.produced = 0
+        self.finished = threading.Event()
+
+    def _tokens(self):
+        try:
+            for i, token in enumerate(TOKENS):
+                if i == self.fail_after:
+                    raise RuntimeError("upstream failed")
+                self.produced += 1
+                yield token
+        finally:
+            self.finished.set()
+
+    def stream_chat(self, message, history):
+        return SimpleNamespace(response_gen=self._tokens())
+
+
+@pytest.fixture(autouse=True)
+def small_buffer(monkeypatch):
+    monkeypatch.setattr(executor, "STREAM_BUFFER", 4)
+
+
+def test_slow_reader_gets_every_token_once_and_in_order():
+    async def main():
+        engine = BlockingEngine()
+        tokens = []
+        async for token in stream_chat(engine, "q", [], mode="thread"):
+            tokens.append(token)
+            if len(tokens) % 10 == 0:
+                # let the worker run into the full buffer
+                await asyncio.sleep(0.01)
+                # the buffer plus the token the blocked worker holds
+                assert engine.produced - len(tokens) <= executor.STREAM_BUFFER + 1
+        assert tokens == TOKENS
+
+    asyncio.run(main())
+
+
+def test_errors_are_raised_to_the_reader():
+    async def main():
+        tokens = []
+        with pytest.raises(RuntimeError, match="upstream failed"):
+            async for token in stream_chat(BlockingEngine(fail_after=3), "q", [], mode="thread"):
+                tokens.append(token)
+        assert tokens == TOKENS[:3]
+
+    asyncio.run(main())
+
+
+def test_reader_leaving_stops_the_worker():
+    async def main():
+        engine = BlockingEngine()
+        stream = stream_chat(engine, "q", [], mode="thread")
+        await stream.__anext__()
+        await asyncio.sleep(0.01)
+        await stream.aclose()
+        assert await asyncio.to_thread(engine.finished.wait, 0.5)
+        assert engine.produced < len(TOKENS)
+
+    asyncio.run(main())
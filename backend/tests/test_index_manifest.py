@@ -0,0 +1,81 @@
+import json
+
+from llama_index.schema import NodeRelationship, RelatedNodeInfo, TextNode
+
+from app.engine.index_manifest import ChunkManifest, assign_content_ids
+from app.engine.indexing import IndexingPipeline
+from app.engine.local_vector_store import LocalVectorStore
+from benchmarks.fakes import FakeEmbedding
+
+
+def _chunks(*texts: str, uni: str = "TUM"):
+    nodes = [TextNode(text=text, metadata={"uni_name": uni}) for text in texts]
+    for previous, node in zip(nodes, nodes[1:]):
+        node.relationships[NodeRelationship.PREVIOUS] = RelatedNodeInfo(node_id=previous.node_id)
+        previous.relationships[NodeRelationship.NEXT] = RelatedNodeInfo(node_id=node.node_id)
+    return assign_content_ids(nodes)
+
+
+def _stored_texts(store: LocalVectorStore):
+    return sorted(text for text, alive in zip(store._texts, store._alive) if alive)
+
+
+def test_content_ids_are_stable_and_unique():
+    first, second = _chunks("fees", "location"), _chunks("fees", "location")
+    assert [n.node_id for n in first] == [n.node_id for n in second]
+    # the same text about another university is another chunk
+    assert _chunks("fees", uni="ETH")[0].node_id != first[0].node_id
+    # relationships follow the new ids, repeated chunks are dropped
+    assert first[1].relationships[NodeRelationship.PREVIOUS].node_id == first[0].node_id
+    assert len(_chunks("fees", "fees", "location")) == 2
+
+
+def test_diff():
+    stored = {node.node_id: "hash" for node in _chunks("fees", "location", "history")}
+    nodes = _chunks("fees", "new location", "rankings")
+    new_nodes, stale_ids = ChunkManifest.diff(nodes, stored)
+    assert sorted(n.text for n in new_nodes) == ["new location", "rankings"]
+    assert sorted(stale_ids) == sorted(n.node_id for n in _chunks("location", "history"))
+
+
+def test_manifest_is_tied_to_its_embedding_model_and_format(tmp_path):
+    manifest = ChunkManifest(str(tmp_path / "manifest.json"))
+    assert manifest.load("model-a") is None
+    nodes = _chunks("fees")
+    manifest.save(nodes, "model-a")
+    assert list(manifest.load("model-a")) == [nodes[0].node_id]
+    assert manifest.load("model-b") is None
+
+    data = json.loads((tmp_path / "manifest.json").read_text())
+    data["format"] = 0
+    (tmp_path / "manifest.json").write_text(json.dumps(data))
+    assert manifest.load("model-a") is None
+
+
+def test_sync_embeds_only_what_changed(tmp_path):
+    store = LocalVectorStore(persist_dir=str(tmp_path / "vectors"))
+    manifest = ChunkManifest(str(tmp_path / "manifest.json"))
+    pipeline = IndexingPipeline(FakeEmbedding(dim=32, latency=0), store)
+
+    stats = pipeline.sync(_chunks("fees", "location", "history"), manifest)
+    assert (stats["chunks"], stats["unchanged"], stats["deleted"]) == (3, 0, 0)
+
+    # "location" changed, "history" is gone, "fees" is unchanged
+    stats = pipeline.sync(_chunks("fees", "new location"), manifest)
+    assert (stats["chunks"], stats["unchanged"], stats["deleted"]) == (1, 1, 2)
+    assert _stored_texts(store) == ["fees", "new location"]
+
+    stats = pipeline.sync(_chunks("fees", "new location"), manifest)
+    assert (stats["chunks"], stats["unchanged"], stats["deleted"]) == (0, 2, 0)
+
+
+def test_embedding_model_change_rebuilds_the_store(tmp_path):
+    store = LocalVectorStore(persist_dir=str(tmp_path / "vectors"))
+    manifest = ChunkManifest(str(tmp_path / "manifest.json"))
+    IndexingPipeline(FakeEmbedding(dim=32, latency=0), store).sync(_chunks("fees", "location"), manifest)
+
+    other_model = FakeEmbedding(dim=32, latency=0, model_name="other-embedding")
+    stats = IndexingPipeline(other_model, store).sync(_chunks("fees", "location"), manifest)
+    assert (stats["chunks"], stats["unchanged"]) == (2, 0)
+    assert _stored_texts(store) == ["fees", "location"]
+    assert manifest.load("other-embedding") is not None
@@ -0,0 +1,119 @@
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+import main
+from app.engine import index
+from app.metrics import REGISTRY, MetricsRegistry, TimingMiddleware, measure_stream
+
+
+async def _get(app, path: str) -> httpx.Response:
+    # what TestClient does, without tying the test to one httpx release
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        return await client.get(path)
+
+
+def _samples(text: str):
+    return {
+        line.rsplit(" ", 1)[0]: line.rsplit(" ", 1)[1]
+        for line in text.splitlines()
+        if line and not line.startswith("#")
+    }
+
+
+def test_render_format():
+    registry = MetricsRegistry()
+    counter = registry.counter("requests_total", "Requests")
+    counter.inc(kind="a")
+    counter.inc(2, kind='say "hi"\n')
+    histogram = registry.histogram("wait_seconds", "Wait", buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+    registry.register_collector(lambda: [("size", "Size", "gauge", {(("cache", "sql"),): 3, (): 1.5})])
+
+    def broken():
+        raise RuntimeError("collector failed")
+        yield
+
+    registry.register_collector(broken)
+
+    text = registry.render()
+    assert text.endswith("\n")
+    lines = text.splitlines()
+    assert lines[:2] == ["# HELP requests_total Requests", "# TYPE requests_total counter"]
+    assert "# TYPE wait_seconds histogram" in lines
+    assert "# TYPE size gauge" in lines
+    assert _samples(text) == {
+        'requests_total{kind="a"}': "1",
+        'requests_total{kind="say \\"hi\\" "}': "2",
+        # buckets are cumulative and le is inclusive
+        'wait_seconds_bucket{le="0.1"}': "2",
+        'wait_seconds_bucket{le="1"}': "3",
+        'wait_seconds_bucket{le="+Inf"}': "4",
+        "wait_seconds_sum": "3.65",
+        "wait_seconds_count": "4",
+        "size": "1.5",
+        'size{cache="sql"}': "3",
+    }
+
+
+def test_metrics_endpoint_and_trace_header():
+    async def main_():
+        response = await _get(main.app, "/no-such-page")
+        assert response.status_code == 404
+        assert len(response.headers["x-trace-id"]) == 16
+
+        metrics = await _get(main.app, "/metrics")
+        assert metrics.status_code == 200
+        assert metrics.headers["content-type"].startswith("text/plain; version=0.0.4")
+        # the scrape itself is not traced
+        assert "x-trace-id" not in metrics.headers
+        samples = _samples(metrics.text)
+        assert int(samples['http_request_duration_seconds_count{method="GET",path="unmatched",status="404"}']) >= 1
+        assert "chat_admission_limit" in samples
+
+    asyncio.run(main_())
+
+
+def test_requests_are_labelled_by_route_and_streams_are_measured():
+    app = FastAPI()
+    app.add_middleware(TimingMiddleware)
+
+    async def tokens():
+        for token in ("a", "b", "c"):
+            yield token
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: str):
+        return StreamingResponse(measure_stream(tokens()))
+
+    def count(sample: str) -> int:
+        return int(_samples(REGISTRY.render()).get(sample, 0))
+
+    route = 'http_request_duration_seconds_count{method="GET",path="/items/{item_id}",status="200"}'
+    before = count(route), count("chat_time_to_first_token_seconds_count")
+
+    async def main_():
+        for item_id in ("1", "2"):
+            response = await _get(app, f"/items/{item_id}")
+            assert response.text == "abc"
+
+    asyncio.run(main_())
+    # one series for the route, not one per id
+    assert count(route) == before[0] + 2
+    assert count("chat_time_to_first_token_seconds_count") == before[1] + 2
+    assert 'path="/items/1"' not in REGISTRY.render()
+
+
+def test_pool_totals_are_counters(monkeypatch):
+    stats = {"connects_total": 3, "checkout_wait_seconds_total": 0.5, "checked_out": 1, "pool_size": 5}
+    monkeypatch.setattr(index, "pool_metrics", lambda: {"chat": stats})
+    kinds = {name: kind for name, _, kind, _ in index.registry.metrics() if name.startswith("db_pool_")}
+    assert kinds == {
+        "db_pool_connects_total": "counter",
+        "db_pool_checkout_wait_seconds_total": "counter",
+        "db_pool_checked_out": "gauge",
+        "db_pool_pool_size": "gauge",
+    }
@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.engine import semantic_cache
+from app.engine.semantic_cache import SemanticCache
+from benchmarks.fakes import FakeEmbedding
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+class Version:
+    def __init__(self, value: str = "1"):
+        self.value = value
+
+    def current(self) -> str:
+        return self.value
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(semantic_cache, "time", SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def _cache(**kwargs) -> SemanticCache:
+    kwargs.setdefault("threshold", 0.9)
+    return SemanticCache(FakeEmbedding(dim=256, latency=0), **kwargs)
+
+
+def test_hit_and_miss_at_the_threshold(clock):
+    question = "What are the tuition fees at TUM?"
+    similar = "What are the tuition fees at TUM for international students?"
+    cache = _cache()
+    score = float(cache.embed(question) @ cache.embed(similar))
+    assert 0 < score < 1
+
+    # just below and just above the similarity of the two questions
+    cache.threshold = score - 1e-4
+    cache.store(question, "1500 EUR per semester")
+    assert cache.lookup(similar) == "1500 EUR per semester"
+
+    cache.threshold = score + 1e-3
+    assert cache.lookup(similar) is None
+    assert cache.lookup(question) == "1500 EUR per semester"
+    assert cache.stats() == {"size": 1, "hits": 2, "misses": 1}
+
+
+def test_unrelated_question_misses(clock):
+    cache = _cache()
+    cache.store("What are the tuition fees at TUM?", "1500 EUR")
+    assert cache.lookup("Which language tests does ETH accept?") is None
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = _cache(ttl=60)
+    cache.store("What are the tuition fees at TUM?", "1500 EUR")
+    clock.now += 59
+    assert cache.lookup("What are the tuition fees at TUM?") == "1500 EUR"
+    clock.now += 2
+    assert cache.lookup("What are the tuition fees at TUM?") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_entries_from_an_older_data_version_are_dropped(clock):
+    version = Version("1")
+    cache = _cache(data_version=version)
+    cache.store("What are the tuition fees at TUM?", "1500 EUR")
+    version.value = "2"
+    assert cache.lookup("What are the tuition fees at TUM?") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_full_cache_reuses_the_least_recently_used_slot(clock):
+    cache = _cache(capacity=2)
+    cache.store("What are the tuition fees at TUM?", "fees")
+    clock.now += 1
+    cache.store("Which language tests does ETH accept?", "tests")
+    clock.now += 1
+    # touching the first entry makes the second the least recently used
+    assert cache.lookup("What are the tuition fees at TUM?") == "fees"
+    clock.now += 1
+    cache.store("Where is the University of Oslo located?", "Oslo")
+
+    assert cache.lookup("What are the tuition fees at TUM?") == "fees"
+    assert cache.lookup("Which language tests does ETH accept?") is None
+    assert cache.lookup("Where is the University of Oslo located?") == "Oslo"
+    assert cache.stats()["size"] == 2
+
+
+def test_empty_answers_are_not_stored(clock):
+    cache = _cache()
+    cache.store("What are the tuition fees at TUM?", "  \n")
+    assert cache.lookup("What are the tuition fees at TUM?") is None
+    assert cache.stats()["size"] == 0
@@ -0,0 +1,100 @@
+import os
+import threading
+
+import pytest
+
+from llama_index.llms.base import ChatMessage
+from llama_index.llms.types import MessageRole
+
+from app.engine.sessions import DiskSessionStore, MemorySessionStore
+
+
+def _turn(question: str):
+    return (
+        ChatMessage(role=MessageRole.USER, content=question),
+        ChatMessage(role=MessageRole.ASSISTANT, content=f"answer to {question}"),
+    )
+
+
+def test_workers_sharing_a_directory_see_each_others_sessions(tmp_path):
+    # two stores over one directory, as two uvicorn workers have
+    first = DiskSessionStore(str(tmp_path))
+    second = DiskSessionStore(str(tmp_path))
+
+    session = first.create()
+    session.append(ChatMessage(role=MessageRole.USER, content="Hello"))
+    first.save(session)
+
+    loaded = second.get(session.id)
+    assert loaded is not None
+    assert [m.content for m in loaded.messages] == ["Hello"]
+
+    second.delete(session.id)
+    assert first.get(session.id) is None
+
+
+def test_expired_sessions_are_dropped(tmp_path):
+    store = DiskSessionStore(str(tmp_path), ttl=60)
+    session = store.create()
+    path = os.path.join(str(tmp_path), f"{session.id}.json")
+    os.utime(path, (0, 0))
+    assert store.get(session.id) is None
+    assert not os.path.exists(path)
+
+
+def test_least_recently_used_session_is_evicted(tmp_path):
+    store = DiskSessionStore(str(tmp_path), maxsize=2)
+    first, second = store.create(), store.create()
+    store.get(first.id)
+    third = store.create()
+    assert store.get(second.id) is None
+    assert store.get(first.id) is not None
+    assert store.get(third.id) is not None
+    assert store.stats()["evictions"] == 1
+
+
+def test_invalid_ids_never_touch_the_filesystem(tmp_path):
+    store = DiskSessionStore(str(tmp_path))
+    assert store.get("../../etc/passwd") is None
+    assert sorted(os.listdir(str(tmp_path))) == []
+
+
+def test_overlapping_turns_on_one_session_are_all_kept(tmp_path):
+    first = DiskSessionStore(str(tmp_path))
+    second = DiskSessionStore(str(tmp_path))
+    session = first.create()
+    # both requests loaded the session before either answer finished
+    a, b = first.get(session.id), second.get(session.id)
+    first.append(a, *_turn("a"))
+    second.append(b, *_turn("b"))
+    assert [m.content for m in first.get(session.id).messages] == ["a", "answer to a", "b", "answer to b"]
+
+
+@pytest.mark.parametrize("disk", [True, False])
+def test_concurrent_appends_lose_nothing(tmp_path, disk):
+    if disk:
+        stores = [DiskSessionStore(str(tmp_path)), DiskSessionStore(str(tmp_path))]
+    else:
+        stores = [MemorySessionStore()] * 2
+    session = stores[0].create()
+
+    def turns(store, worker):
+        for i in range(20):
+            store.append(store.get(session.id), *_turn(f"{worker}-{i}"))
+
+    threads = [threading.Thread(target=turns, args=(stores[w % 2], w)) for w in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    questions = [m.content for m in stores[1].get(session.id).messages if m.role == MessageRole.USER]
+    assert sorted(questions) == sorted(f"{w}-{i}" for w in range(4) for i in range(20))
+
+
+def test_a_session_lost_meanwhile_is_saved_with_the_turn(tmp_path):
+    store = DiskSessionStore(str(tmp_path))
+    session = store.create()
+    loaded = store.get(session.id)
+    store.delete(session.id)
+    store.append(loaded, *_turn("a"))
+    assert [m.content for m in store.get(session.id).messages] == ["a", "answer to a"]
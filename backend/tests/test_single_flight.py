@@ -0,0 +1,162 @@
+import asyncio
+
+from llama_index.llms.base import ChatMessage
+from llama_index.llms.types import MessageRole
+
+from app.engine.single_flight import SingleFlight, flight_key
+
+TOKENS = [f"t{i} " for i in range(6)]
+
+
+class Producer:
+    '''
+    Upstream answer streaming TOKENS, counting how often it runs
+    '''
+
+    def __init__(self, fail_after: int = None):
+        self.runs = 0
+        self.closed = 0
+        self.fail_after = fail_after
+        self._gate = asyncio.Semaphore(0)
+
+    def allow(self, tokens: int = len(TOKENS)) -> None:
+        for _ in range(tokens):
+            self._gate.release()
+
+    async def __call__(self):
+        self.runs += 1
+        try:
+            for i, token in enumerate(TOKENS):
+                if i == self.fail_after:
+                    raise RuntimeError("upstream failed")
+                await self._gate.acquire()
+                yield token
+        finally:
+            self.closed += 1
+
+
+async def _collect(token_gen):
+    return "".join([token async for token in token_gen])
+
+
+async def _step(times: int = 5):
+    for _ in range(times):
+        await asyncio.sleep(0)
+
+
+def test_key_normalizes_the_question_and_includes_the_history():
+    history = [ChatMessage(role=MessageRole.USER, content="Hi"), ChatMessage(role=MessageRole.ASSISTANT, content="Hello")]
+    assert flight_key("What is TUM?", []) == flight_key("  what is   TUM ", [])
+    assert flight_key("What is TUM?", history) == flight_key("what is tum", list(history))
+    assert flight_key("What is TUM?", history) != flight_key("What is TUM?", [])
+    assert flight_key("What is TUM?", []) != flight_key("What is ETH?", [])
+
+
+def test_concurrent_requests_share_one_run():
+    async def main():
+        flights = SingleFlight()
+        producer = Producer()
+        streams = [flights.stream("k", producer) for _ in range(5)]
+        producer.allow()
+        answers = await asyncio.gather(*(_collect(s) for s in streams))
+        assert answers == ["".join(TOKENS)] * 5
+        assert producer.runs == 1
+        assert flights.stats() == {"in_flight": 0}
+
+    asyncio.run(main())
+
+
+def test_late_joiner_gets_the_whole_answer():
+    async def main():
+        flights = SingleFlight()
+        producer = Producer()
+        leader = flights.stream("k", producer)
+        producer.allow(2)
+        first = [await leader.__anext__(), await leader.__anext__()]
+        follower = flights.stream("k", producer)
+        producer.allow()
+        rest = await _collect(leader)
+        assert "".join(first) + rest == "".join(TOKENS)
+        assert await _collect(follower) == "".join(TOKENS)
+        assert producer.runs == 1
+
+    asyncio.run(main())
+
+
+def test_leader_disconnect_hands_the_stream_to_the_followers():
+    async def main():
+        flights = SingleFlight()
+        producer = Producer()
+        leader = flights.stream("k", producer)
+        producer.allow(1)
+        await leader.__anext__()
+        follower = flights.stream("k", producer)
+        # the leader's client goes away mid-stream
+        await leader.aclose()
+        producer.allow()
+        assert await _collect(follower) == "".join(TOKENS)
+        assert producer.runs == 1
+
+    asyncio.run(main())
+
+
+def test_leader_leaving_before_a_follower_reads_keeps_the_answer():
+    async def main():
+        flights = SingleFlight()
+        producer = Producer()
+        leader = flights.stream("k", producer)
+        follower = flights.stream("k", producer)
+        await _step()
+        await leader.aclose()
+        producer.allow()
+        assert await _collect(follower) == "".join(TOKENS)
+        assert producer.runs == 1
+
+    asyncio.run(main())
+
+
+def test_last_follower_leaving_cancels_the_run():
+    async def main():
+        flights = SingleFlight()
+        producer = Producer()
+        streams = [flights.stream("k", producer) for _ in range(2)]
+        producer.allow(1)
+        for stream in streams:
+            await stream.__anext__()
+        for stream in streams:
+            await stream.aclose()
+        await _step()
+        assert producer.closed == 1
+        assert flights.stats() == {"in_flight": 0}
+        # nothing is left to join, the next request starts over
+        producer.allow()
+        assert await _collect(flights.stream("k", producer)) == "".join(TOKENS)
+        assert producer.runs == 2
+
+    asyncio.run(main())
+
+
+def test_errors_reach_every_follower():
+    async def main():
+        flights = SingleFlight()
+        producer = Producer(fail_after=3)
+        producer.allow()
+        streams = [flights.stream("k", producer) for _ in range(3)]
+        results = await asyncio.gather(*(_collect(s) for s in streams), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) and str(r) == "upstream failed" for r in results)
+        assert producer.runs == 1
+        assert flights.stats() == {"in_flight": 0}
+
+    asyncio.run(main())
+
+
+def test_different_keys_do_not_share():
+    async def main():
+        flights = SingleFlight()
+        producer = Producer()
+        producer.allow(2 * len(TOKENS))
+        answers = await asyncio.gather(_collect(flights.stream("a", producer)), _collect(flights.stream("b", producer)))
+        assert answers == ["".join(TOKENS)] * 2
+        assert producer.runs == 2
+
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy import create_engine, event, text
+
+from app.engine.sql_cache import CachedSQLDatabase, SQLCache
+
+
+class Version:
+    def __init__(self, value: str = "1"):
+        self.value = value
+
+    def current(self) -> str:
+        return self.value
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'cache.db'}")
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE "University" (id INTEGER PRIMARY KEY, uni_name TEXT)'))
+        conn.execute(text('INSERT INTO "University" (uni_name) VALUES (\'TUM\')'))
+    yield engine
+    engine.dispose()
+
+
+def test_entries_are_dropped_when_the_data_version_changes():
+    version = Version("1")
+    cache = SQLCache(version)
+    cache.set_sql("What is TUM?", "SELECT 1", cache.version())
+    cache.set_result("SELECT 1", ("1", {}), cache.version())
+    assert cache.get_sql("  what is tum") == "SELECT 1"
+    assert cache.get_result("SELECT 1;") == ("1", {})
+    version.value = "2"
+    assert cache.get_sql("What is TUM?") is None
+    assert cache.get_result("SELECT 1") is None
+
+
+def test_writes_started_before_a_reload_are_dropped():
+    version = Version("1")
+    cache = SQLCache(version)
+    started = cache.version()
+    # another request sees the reload and clears the caches meanwhile
+    version.value = "2"
+    assert cache.get_result("SELECT 1") is None
+    cache.set_sql("What is TUM?", "SELECT 1", started)
+    cache.set_result("SELECT 1", ("old", {}), started)
+    assert cache.get_sql("What is TUM?") is None
+    assert cache.get_result("SELECT 1") is None
+    # nor is a write that is the first to notice the reload kept
+    version.value = "3"
+    cache.set_result("SELECT 1", ("old", {}), started)
+    assert cache.stats()["result"]["size"] == 0
+
+
+def test_results_read_while_the_data_was_reloaded_are_not_cached(engine):
+    version = Version("1")
+    cache = SQLCache(version)
+    db = CachedSQLDatabase(engine, include_tables=["University"], sql_cache=cache, snapshot_dir=None)
+    query = 'SELECT uni_name FROM "University"'
+
+    def reload(*args):
+        version.value = "2"
+
+    event.listen(engine, "before_cursor_execute", reload)
+    db.run_sql(query)
+    event.remove(engine, "before_cursor_execute", reload)
+    assert cache.stats()["result"]["size"] == 0
+
+    db.run_sql(query)
+    assert cache.get_result(query) is not None
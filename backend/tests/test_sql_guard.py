@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from app.engine.sql_guard import GuardedSQLDatabase, SQLGuardError, cap_limit
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'guard.db'}")
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE "University" (id INTEGER PRIMARY KEY, uni_name TEXT)'))
+        conn.execute(
+            text('INSERT INTO "University" (uni_name) VALUES (:name)'),
+            [{"name": f"University {i}"} for i in range(500)],
+        )
+    yield engine
+    engine.dispose()
+
+
+def _count(engine) -> int:
+    with engine.connect() as conn:
+        return conn.execute(text('SELECT count(*) FROM "University"')).scalar()
+
+
+def test_cap_limit():
+    assert cap_limit("SELECT * FROM t;", 50) == "SELECT * FROM t\nLIMIT 50"
+    assert cap_limit("SELECT * FROM t LIMIT 10", 50) == "SELECT * FROM t LIMIT 10"
+    assert cap_limit("SELECT * FROM t LIMIT 1000", 50) == "SELECT * FROM t LIMIT 50"
+    assert cap_limit("SELECT * FROM t limit 1000 offset 20", 50) == "SELECT * FROM t limit 50 offset 20"
+    assert cap_limit("SELECT * FROM t LIMIT ALL;", 50) == "SELECT * FROM t LIMIT 50"
+    assert cap_limit("SELECT * FROM t limit all offset 5", 50) == "SELECT * FROM t limit 50 offset 5"
+
+
+def test_only_single_select_statements_pass_the_check(engine):
+    db = GuardedSQLDatabase(engine, max_rows=50)
+    assert db._check_statement("WITH u AS (SELECT 1) SELECT * FROM u") == "WITH u AS (SELECT 1) SELECT * FROM u\nLIMIT 50"
+    assert db._check_statement("SELECT ';' AS s;").startswith("SELECT ';' AS s")
+    with pytest.raises(SQLGuardError):
+        db._check_statement('DELETE FROM "University"')
+    with pytest.raises(SQLGuardError):
+        db._check_statement('SELECT 1; DROP TABLE "University"')
+
+
+def test_rows_are_truncated_to_max_rows(engine):
+    db = GuardedSQLDatabase(engine, max_rows=10, fetch_size=3)
+    # the LIMIT is capped and the rows pulled are bounded independently of it
+    _, metadata = db.run_sql('SELECT uni_name FROM "University" ORDER BY id LIMIT 400')
+    assert len(metadata["result"]) == 10
+    assert metadata["col_keys"] == ["uni_name"]
+    assert metadata["result"][0][0] == "University 0"
+
+
+def test_slow_statements_are_interrupted(engine):
+    db = GuardedSQLDatabase(engine, statement_timeout_ms=50)
+    endless = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT count(*) FROM c"
+    with pytest.raises(SQLGuardError, match="time limit"):
+        db.run_sql(endless)
+
+
+def test_data_modifying_statements_are_refused(engine):
+    db = GuardedSQLDatabase(engine)
+    # passes the SELECT/WITH prefix check, the database refuses it
+    with pytest.raises(SQLGuardError, match="read-only"):
+        db.run_sql('WITH u AS (SELECT 1 AS id, \'x\' AS uni_name) INSERT INTO "University" SELECT 1000, uni_name FROM u')
+    assert _count(engine) == 500
+    # the pooled connection is writable again for everyone else
+    with engine.begin() as conn:
+        conn.execute(text('DELETE FROM "University" WHERE id = 1'))
+    assert _count(engine) == 499
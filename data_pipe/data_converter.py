@@ -13,17 +13,77 @@
 ###################################
 ###################################
 # LIBRARIES
+import csv
+import hashlib
+import math
 import os
+import sys
+import time
+from datetime import timedelta
+from io import StringIO
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
 
 from glob import glob
+import openpyxl
 import pandas as pd
-import psycopg2
-from sqlalchemy import create_engine
 # from pymongo import MongoClient
+
+# share the pooled engine module with the chat backend
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+from app.db import get_engine
+
+# worker processes used to parse workbooks, defaults to one per CPU
+DATA_PIPE_WORKERS = int(os.getenv('DATA_PIPE_WORKERS', '0')) or os.cpu_count() or 1
+# rows per COPY statement
+COPY_BATCH_ROWS = int(os.getenv('COPY_BATCH_ROWS', '10000'))
+STAGING_SUFFIX = '__staging'
+OLD_SUFFIX = '__old'
+CSV_NULL = '\\N'
+INCOMING_SUFFIX = '__incoming'
+# set to rebuild every table from all workbooks instead of only the changed ones
+DATA_PIPE_FULL_RELOAD = os.getenv('DATA_PIPE_FULL_RELOAD', 'false').lower() in ('1', 'true', 'yes')
+# read workbooks row by row and COPY them in batches instead of building DataFrames,
+# memory then depends on COPY_BATCH_ROWS rather than on the size of the workbooks
+DATA_PIPE_STREAMING = os.getenv('DATA_PIPE_STREAMING', 'false').lower() in ('1', 'true', 'yes')
+# strings pd.read_excel reads as missing values
+NA_STRINGS = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+    '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+}
 ###################################
 ###################################
 
+def _cell_value(value):
+    '''
+    Convert an openpyxl cell value the way pd.read_excel does
+    '''
+    if isinstance(value, str):
+        return None if value in NA_STRINGS else value
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        return int(value) if value.is_integer() else value
+    if isinstance(value, timedelta):
+        return pd.Timedelta(value)
+    return value
+
+
+def _to_number(value):
+    '''
+    pd.to_numeric(errors='coerce') for a single value
+    '''
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        number = float(str(value).strip())
+    except ValueError:
+        return None
+    return None if math.isnan(number) else number
+
+
 class data_pipe:
     '''
     data class
@@ -66,6 +126,22 @@ class data_pipe:
             'programme_name', 'test_name', 'average_score', 'minimum_score'
         ]
     }
+    # primary key of each table, rows missing any part of it are not loaded
+    tables_keys = {
+        'University': ['uni_name'],
+        'Programme': ['uni_name', 'programme_name'],
+        'ProgrammeDescription': ['uni_name', 'programme_name'],
+        'CourseDescription': ['uni_name', 'programme_name', 'course_name'],
+        'TestType': ['uni_name', 'programme_name', 'test_name']
+    }
+    # columns declared numeric in the DDL, coerced before loading
+    tables_numeric = {
+        'University': {
+            'founded': 'Int64', 'overall_ranking': 'Int64',
+            'International_Students': 'float64', 'total_students': 'float64'
+        },
+        'TestType': {'average_score': 'float64'}
+    }
     uni_name = ''
 
     #Helper Function
@@ -76,17 +152,16 @@ class data_pipe:
         for f in glob('uni_data/*.xlsx'):
             self.filepaths.append(f)
     
-    def read_table(self, file_path: str, table: str) -> pd.DataFrame:
+    def read_table(self, file_path: str, table: str, workbook: pd.ExcelFile = None) -> pd.DataFrame:
         '''
-        Reading in the table
+        Reading in the table, from the already opened `workbook` when given
         '''
-
-        print(table)
+        io = workbook if workbook is not None else file_path
 
         if table == 'University':
             table_df = pd.DataFrame(columns=self.tables_headers[table])
             temp = pd.read_excel(
-                io=file_path,
+                io=io,
                 header=None,
                 sheet_name=table,
                 skiprows=0
@@ -114,13 +189,11 @@ class data_pipe:
                 if col is not None:
                     table_df[col] = temp[col].values
 
-            print(table_df)
-
             return table_df
         
         elif table == 'Programme':
             table_df = pd.read_excel(
-                io= file_path,
+                io= io,
                 sheet_name= table,
                 names= self.tables_headers[table],
                 header= 2 if 'Munich' == file_path.split(' ')[-1].split('.')[0] else None,
@@ -139,7 +212,7 @@ class data_pipe:
         
         elif table in ['ProgrammeDescription', 'CourseDescription', 'TestType']:
             table_df = pd.read_excel(
-                io= file_path,
+                io= io,
                 sheet_name= table,
                 names= self.tables_headers[table],
                 header= None,
@@ -158,7 +231,7 @@ class data_pipe:
             return table_df.drop_duplicates()
 
         return pd.read_excel(
-            io= file_path,
+            io= io,
             sheet_name= table,
             names= self.tables_headers[table],
             header= None
@@ -174,58 +247,53 @@ class data_pipe:
         URI = os.getenv('POSTGRES_URI')
         print(URI)
 
-        # Create an SQLAlchemy engine from the uri
-        engine = create_engine(URI)
+        # Shared, pooled SQLAlchemy engine for the uri
+        engine = get_engine(URI)
 
-        # Connect to the PostgreSQL database using psycopg2
-        conn = psycopg2.connect(URI)
+        # psycopg2 connection checked out of the same pool
+        conn = engine.raw_connection()
 
         return conn, engine
     
-    def create_tables_in_postgres(self, conn):
+    def create_tables_in_postgres(self, cursor, suffix: str = ''):
         '''
-        function to create tables in PostgreSQL
+        function to create (empty) tables in PostgreSQL, named `<table><suffix>`
         '''
-        cursor = conn.cursor()
+        for table in reversed(list(self.tables.keys())):
+            cursor.execute(f'DROP TABLE IF EXISTS "{table}{suffix}" CASCADE;')
 
         # Create University table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS University (
+        cursor.execute(f'''
+            CREATE TABLE "University{suffix}" (
                 uni_name VARCHAR PRIMARY KEY,
                 location VARCHAR,
                 founded INTEGER,
                 website VARCHAR,
                 overall_ranking INTEGER,
-                International_Students INTEGER,
-                Female_Male_Ratio FLOAT,
-                total_students INTEGER,
+                "International_Students" DOUBLE PRECISION,
+                "Female_Male_Ratio" VARCHAR,
+                total_students DOUBLE PRECISION,
                 athletics VARCHAR,
                 contact VARCHAR,
-                research_funding FLOAT,
+                research_funding VARCHAR,
                 airport_transportation VARCHAR,
                 bus_availability VARCHAR,
-                train_station_distance FLOAT,
+                train_station_distance VARCHAR,
                 nearby_shopping_areas VARCHAR,
                 campus_facilities VARCHAR,
                 emergency_services VARCHAR,
                 student_housing VARCHAR,
-                "Living costs" FLOAT,
+                "Living costs" VARCHAR,
                 student_clubs_organizations VARCHAR,
-                Public_Private VARCHAR
+                "Public_Private" VARCHAR
             );
         ''')
 
-        # Add unique constraint to uni_name in University table
-        # cursor.execute('''
-        #     ALTER TABLE University
-        #     ADD CONSTRAINT uni_name_unique UNIQUE (uni_name);
-        # ''')
-
-        # Create Programme table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS Programme (
-                uni_name VARCHAR,
-                programme_name VARCHAR PRIMARY KEY,
+        # Programme names repeat across universities, so every key starts with uni_name
+        cursor.execute(f'''
+            CREATE TABLE "Programme{suffix}" (
+                uni_name VARCHAR REFERENCES "University{suffix}"(uni_name),
+                programme_name VARCHAR,
                 duration VARCHAR,
                 description VARCHAR,
                 "fees (annual)" VARCHAR,
@@ -237,89 +305,520 @@ class data_pipe:
                 language_of_instruction VARCHAR,
                 internship_opportunities VARCHAR,
                 study_abroad_opportunities VARCHAR,
-                FOREIGN KEY (uni_name) REFERENCES University(uni_name)
+                PRIMARY KEY (uni_name, programme_name)
             );
         ''')
 
-        # Create ProgrammeDescription table (similar modifications for other tables)
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ProgrammeDescription (
-                uni_name VARCHAR,
-                programme_name VARCHAR PRIMARY KEY,
+        # The description sheets also list programmes missing from the Programme
+        # sheet, so they only reference University
+        cursor.execute(f'''
+            CREATE TABLE "ProgrammeDescription{suffix}" (
+                uni_name VARCHAR REFERENCES "University{suffix}"(uni_name),
+                programme_name VARCHAR,
                 overview VARCHAR,
                 website VARCHAR,
                 learning_objectives VARCHAR,
                 program_structure VARCHAR,
                 specialisations VARCHAR,
                 career_opportunities VARCHAR,
-                FOREIGN KEY (uni_name) REFERENCES University(uni_name),
-                FOREIGN KEY (programme_name) REFERENCES Programme(programme_name)
+                PRIMARY KEY (uni_name, programme_name)
             );
         ''')
 
-        # Create CourseDescription table (similar modifications for other tables)
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS CourseDescription (
-                uni_name VARCHAR,
+        cursor.execute(f'''
+            CREATE TABLE "CourseDescription{suffix}" (
+                uni_name VARCHAR REFERENCES "University{suffix}"(uni_name),
                 programme_name VARCHAR,
-                course_name VARCHAR PRIMARY KEY,
+                course_name VARCHAR,
                 course_description VARCHAR,
                 course_objectives VARCHAR,
                 core_elective VARCHAR,
-                FOREIGN KEY (uni_name) REFERENCES University(uni_name),
-                FOREIGN KEY (programme_name) REFERENCES Programme(programme_name)
+                PRIMARY KEY (uni_name, programme_name, course_name)
             );
         ''')
 
-        # Create TestType table (similar modifications for other tables)
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS TestType (
-                uni_name VARCHAR,
+        # minimum_score holds grades ("B2") and links as well as numbers
+        cursor.execute(f'''
+            CREATE TABLE "TestType{suffix}" (
+                uni_name VARCHAR REFERENCES "University{suffix}"(uni_name),
                 programme_name VARCHAR,
                 test_name VARCHAR,
-                average_score FLOAT,
-                minimum_score FLOAT,
-                PRIMARY KEY (uni_name, programme_name, test_name),
-                FOREIGN KEY (uni_name) REFERENCES University(uni_name),
-                FOREIGN KEY (programme_name) REFERENCES Programme(programme_name)
+                average_score DOUBLE PRECISION,
+                minimum_score VARCHAR,
+                PRIMARY KEY (uni_name, programme_name, test_name)
             );
         ''')
 
-        conn.commit()
+    def table_columns(self, table_name: str) -> list:
+        '''
+        Columns of a table in DDL order
+        '''
+        headers = self.tables_headers[table_name]
+        return headers if 'uni_name' in headers else ['uni_name'] + headers
 
+    def prepare_table(self, table: pd.DataFrame, table_name: str) -> pd.DataFrame:
+        '''
+        Shape a parsed table for COPY: DDL column order, rows with a missing or
+        repeated key dropped, numeric columns coerced
+        '''
+        columns = self.table_columns(table_name)
+        keys = self.tables_keys[table_name]
+
+        table_df = table.reindex(columns=columns).drop_duplicates()
+        no_key = table_df[keys].isna().any(axis=1)
+        table_df = table_df[~no_key]
+        repeated = table_df.duplicated(subset=keys, keep='first')
+        table_df = table_df[~repeated].copy()
+
+        for col, dtype in self.tables_numeric.get(table_name, {}).items():
+            values = pd.to_numeric(table_df[col], errors='coerce')
+            dropped = int((values.isna() & table_df[col].notna()).sum())
+            if dropped:
+                print(f'{table_name}.{col}: {dropped} non-numeric values loaded as NULL')
+            table_df[col] = values.round().astype(dtype) if dtype == 'Int64' else values.astype(dtype)
+
+        if no_key.any() or repeated.any():
+            print(f'{table_name}: skipped {int(no_key.sum())} rows without a key, {int(repeated.sum())} repeated keys')
+        return table_df
+
+    def copy_table(self, cursor, table_df: pd.DataFrame, table_name: str):
+        '''
+        Stream a DataFrame into `table_name` with COPY FROM STDIN, in batches
+        so the CSV buffer stays small
+        '''
+        columns = ', '.join(f'"{col}"' for col in table_df.columns)
+        copy_sql = f'COPY "{table_name}" ({columns}) FROM STDIN WITH (FORMAT csv, NULL \'{CSV_NULL}\')'
+        for start in range(0, len(table_df), COPY_BATCH_ROWS):
+            buffer = StringIO()
+            table_df.iloc[start:start + COPY_BATCH_ROWS].to_csv(
+                buffer, index=False, header=False, na_rep=CSV_NULL
+            )
+            buffer.seek(0)
+            cursor.copy_expert(copy_sql, buffer)
 
-    def connect_to_postgres_and_insert(self, table, table_name):
+    def swap_tables(self, cursor):
         '''
-        function to connect to PostgreSQL and insert data
+        Replace the live tables with the staging tables. Runs inside the load
+        transaction, so readers see either the old or the new tables, never a mix
         '''
-        conn, engine = self.connect_to_postgres()
+        for table in self.tables.keys():
+            cursor.execute(f'DROP TABLE IF EXISTS "{table}{OLD_SUFFIX}" CASCADE;')
+            cursor.execute(f'ALTER TABLE IF EXISTS "{table}" RENAME TO "{table}{OLD_SUFFIX}";')
+            cursor.execute(f'ALTER TABLE "{table}{STAGING_SUFFIX}" RENAME TO "{table}";')
+        for table in self.tables.keys():
+            cursor.execute(f'DROP TABLE IF EXISTS "{table}{OLD_SUFFIX}" CASCADE;')
+        # free the staging index names for the next load
+        for table in self.tables.keys():
+            cursor.execute(f'ALTER INDEX "{table}{STAGING_SUFFIX}_pkey" RENAME TO "{table}_pkey";')
+
+    def load_into_postgres(self, cursor):
+        '''
+        function to bulk load every table into staging tables and swap them in
+        '''
+        start = time.perf_counter()
+        total_rows = 0
+        self.create_tables_in_postgres(cursor, suffix=STAGING_SUFFIX)
+        for name, table in self.tables.items():
+            table_df = self.prepare_table(table, name)
+            table_start = time.perf_counter()
+            self.copy_table(cursor, table_df, f'{name}{STAGING_SUFFIX}')
+            elapsed = time.perf_counter() - table_start
+            total_rows += len(table_df)
+            print(f'{name}: {len(table_df)} rows in {elapsed:.2f}s ({len(table_df) / max(elapsed, 1e-9):.0f} rows/s)')
+        self.swap_tables(cursor)
+
+        elapsed = time.perf_counter() - start
+        print(f'Loaded {total_rows} rows in {elapsed:.2f}s ({total_rows / max(elapsed, 1e-9):.0f} rows/s)')
+
+    def copy_incoming(self, cursor):
+        '''
+        function to copy the parsed tables into temporary `__incoming` tables
+        '''
+        for name, table in self.tables.items():
+            table_df = self.prepare_table(table, name)
+            cursor.execute(f'CREATE TEMP TABLE "{name}{INCOMING_SUFFIX}" (LIKE "{name}") ON COMMIT DROP;')
+            self.copy_table(cursor, table_df, f'{name}{INCOMING_SUFFIX}')
+
+    def incoming_rows(self, name: str, deduplicate: bool = False) -> str:
+        '''
+        SELECT over the incoming rows of a table. Streamed rows are not cleaned
+        up front, so there rows without a key are dropped here and repeated
+        keys keep the first row read, as prepare_table does
+        '''
+        column_list = ', '.join(f'"{col}"' for col in self.table_columns(name))
+        if not deduplicate:
+            return f'SELECT {column_list} FROM "{name}{INCOMING_SUFFIX}"'
+        keys = self.tables_keys[name]
+        key_list = ', '.join(f'"{key}"' for key in keys)
+        return f'''
+            SELECT DISTINCT ON ({key_list}) {column_list} FROM "{name}{INCOMING_SUFFIX}"
+            WHERE {' AND '.join(f'"{key}" IS NOT NULL' for key in keys)}
+            ORDER BY {key_list}, _row
+        '''
+
+    def upsert_into_postgres(self, cursor, uni_names: list, deduplicate: bool = False):
+        '''
+        function to upsert the incoming rows by primary key and delete the rows
+        of `uni_names` that are no longer in their workbook
+        '''
+        start = time.perf_counter()
+        written = {}
+        # parents first on the way in ...
+        for name in self.tables.keys():
+            keys = self.tables_keys[name]
+            columns = self.table_columns(name)
+            values = [col for col in columns if col not in keys]
+            cursor.execute(f'''
+                INSERT INTO "{name}" ({', '.join(f'"{col}"' for col in columns)})
+                {self.incoming_rows(name, deduplicate)}
+                ON CONFLICT ({', '.join(f'"{key}"' for key in keys)}) DO UPDATE
+                SET {', '.join(f'"{col}" = EXCLUDED."{col}"' for col in values)}
+                WHERE ({', '.join(f'"{name}"."{col}"' for col in values)})
+                    IS DISTINCT FROM ({', '.join(f'EXCLUDED."{col}"' for col in values)});
+            ''')
+            written[name] = cursor.rowcount
+
+        # ... children first on the way out
+        for name in reversed(list(self.tables.keys())):
+            keys = self.tables_keys[name]
+            match = ' AND '.join(f'i."{key}" = t."{key}"' for key in keys)
+            cursor.execute(f'''
+                DELETE FROM "{name}" t
+                WHERE t.uni_name = ANY(%s::varchar[])
+                AND NOT EXISTS (SELECT 1 FROM "{name}{INCOMING_SUFFIX}" i WHERE {match});
+            ''', (uni_names,))
+            print(f'{name}: {written[name]} rows inserted or updated, {cursor.rowcount} deleted')
+
+        print(f'Upserted {len(uni_names)} universities in {time.perf_counter() - start:.2f}s')
+
+    def iter_table(self, worksheet, file_path: str, table: str):
+        '''
+        Row-by-row version of read_table for the streaming mode: same header
+        matching, forward fill and filters, yielding rows in DDL column order
+        '''
+        headers = self.tables_headers[table]
+        columns = self.table_columns(table)
+        numeric = self.tables_numeric.get(table, {})
+        # header=2 of the Munich Programme sheet counts blank rows too
+        skip = 3 if table == 'Programme' and 'Munich' == file_path.split(' ')[-1].split('.')[0] else 0
+        rows = (
+            tuple(_cell_value(value) for value in row)
+            for row in worksheet.iter_rows(min_row=skip + 1, values_only=True)
+        )
+        # like read_excel, skip rows without any value
+        rows = (row for row in rows if any(value is not None for value in row))
 
-        # Insert data into PostgreSQL
-        self.create_tables_in_postgres(conn)
+        def coerce(record):
+            for col, dtype in numeric.items():
+                value = _to_number(record.get(col))
+                if value is None and record.get(col) is not None:
+                    self.coerced[f'{table}.{col}'] = self.coerced.get(f'{table}.{col}', 0) + 1
+                record[col] = round(value) if value is not None and dtype == 'Int64' else value
+            return tuple(record.get(col) for col in columns)
 
-        # Insert data into the created table
-        table.to_sql(table_name, con=engine, if_exists='replace', index=False)
+        if table == 'University':
+            by_key = {str(col).replace('_', '').lower(): col for col in headers}
+            record = {}
+            first = True
+            for row in rows:
+                label = row[0]
+                if label is None:
+                    continue
+                value = row[1] if len(row) > 1 else None
+                if first:
+                    self.uni_name = value
+                    first = False
+                col = by_key.get(str(label).strip().replace('_', '').lower())
+                if col is not None:
+                    record[col] = value
+            yield coerce(record)
+            return
+
+        # read_excel pads every row to the widest one and, when that is wider than
+        # the headers, makes the surplus leading columns the index: the headers
+        # name the last columns. Find the width with a first, cheap pass.
+        width = 0
+        for row in worksheet.iter_rows(values_only=True):
+            filled = [i for i, value in enumerate(row) if value is not None and value != '']
+            if filled:
+                width = max(width, filled[-1] + 1)
+        offset = max(width - len(headers), 0)
+
+        fill_down = table in ['ProgrammeDescription', 'CourseDescription', 'TestType']
+        programme_name = None
+        for row in rows:
+            record = dict(zip(headers, row[offset:offset + len(headers)]))
+            if fill_down:
+                if record.get('programme_name') is None:
+                    record['programme_name'] = programme_name
+                programme_name = record['programme_name']
+            if record.get('programme_name') is None or record['programme_name'] in headers:
+                continue
+            if table == 'Programme' and record.get('degree_awarded') is None:
+                continue
+            record['uni_name'] = self.uni_name
+            yield coerce(record)
+
+    def copy_rows(self, cursor, rows: list, table_name: str, columns: list):
+        '''
+        COPY a batch of row tuples into `table_name`
+        '''
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(CSV_NULL if value is None else value for value in row)
+        buffer.seek(0)
+        column_list = ', '.join(f'"{col}"' for col in columns)
+        cursor.copy_expert(
+            f'COPY "{table_name}" ({column_list}) FROM STDIN WITH (FORMAT csv, NULL \'{CSV_NULL}\')',
+            buffer
+        )
 
-        conn.commit()
+    def stream_workbook(self, cursor, file_path: str) -> dict:
+        '''
+        Read a workbook with openpyxl in read-only mode and COPY its rows into
+        the `__incoming` tables in batches of COPY_BATCH_ROWS
+        '''
+        counts = {}
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            # University goes first, it sets the uni_name the other sheets are tagged with
+            for table in self.tables.keys():
+                columns = self.table_columns(table)
+                batch = []
+                counts[table] = 0
+                for row in self.iter_table(workbook[table], file_path, table):
+                    batch.append(row)
+                    if len(batch) >= COPY_BATCH_ROWS:
+                        self.copy_rows(cursor, batch, f'{table}{INCOMING_SUFFIX}', columns)
+                        counts[table] += len(batch)
+                        batch = []
+                if batch:
+                    self.copy_rows(cursor, batch, f'{table}{INCOMING_SUFFIX}', columns)
+                    counts[table] += len(batch)
+        finally:
+            workbook.close()
+        self.file_uni_names[os.path.basename(file_path)] = self.uni_name
+        return counts
+
+    def stream_into_postgres(self, cursor, filepaths: list, full_reload: bool, uni_names: set):
+        '''
+        function to load workbooks without holding them in memory: rows are
+        streamed into unkeyed temporary tables and cleaned up in SQL
+        '''
+        start = time.perf_counter()
+        self.coerced = {}
+        if full_reload:
+            self.create_tables_in_postgres(cursor, suffix=STAGING_SUFFIX)
+        source_suffix = STAGING_SUFFIX if full_reload else ''
+        for name in self.tables.keys():
+            cursor.execute(f'''
+                CREATE TEMP TABLE "{name}{INCOMING_SUFFIX}" ON COMMIT DROP
+                AS SELECT * FROM "{name}{source_suffix}" WITH NO DATA;
+            ''')
+            # keeps the read order, so deduplication keeps the first row like pandas
+            cursor.execute(f'ALTER TABLE "{name}{INCOMING_SUFFIX}" ADD COLUMN _row BIGSERIAL;')
+
+        total_rows = 0
+        for f in filepaths:
+            file_start = time.perf_counter()
+            counts = self.stream_workbook(cursor, f)
+            total_rows += sum(counts.values())
+            print(
+                f'{os.path.basename(f)}: {sum(counts.values())} rows in {time.perf_counter() - file_start:.2f}s ('
+                + ', '.join(f'{table} {count}' for table, count in counts.items())
+                + ')'
+            )
+        for col, count in self.coerced.items():
+            print(f'{col}: {count} non-numeric values loaded as NULL')
+
+        if full_reload:
+            for name in self.tables.keys():
+                cursor.execute(f'''
+                    INSERT INTO "{name}{STAGING_SUFFIX}" ({', '.join(f'"{col}"' for col in self.table_columns(name))})
+                    {self.incoming_rows(name, deduplicate=True)};
+                ''')
+                print(f'{name}: {cursor.rowcount} rows after dropping missing and repeated keys')
+            self.swap_tables(cursor)
+        else:
+            uni_names = uni_names | set(self.file_uni_names.values())
+            self.upsert_into_postgres(cursor, sorted(u for u in uni_names if u is not None), deduplicate=True)
+
+        elapsed = time.perf_counter() - start
+        print(f'Streamed {total_rows} rows in {elapsed:.2f}s ({total_rows / max(elapsed, 1e-9):.0f} rows/s)')
+
+    def file_hashes(self) -> dict:
+        '''
+        Content hash of every workbook, keyed by file name
+        '''
+        hashes = {}
+        for f in self.filepaths:
+            digest = hashlib.sha256()
+            with open(f, 'rb') as fh:
+                for chunk in iter(lambda: fh.read(1 << 20), b''):
+                    digest.update(chunk)
+            hashes[os.path.basename(f)] = digest.hexdigest()
+        return hashes
+
+    def read_manifest(self, cursor) -> dict:
+        '''
+        function to read what was loaded last time: file name -> (hash, uni_name)
+        '''
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS "DataManifest" (
+                file_name VARCHAR PRIMARY KEY,
+                sha256 VARCHAR NOT NULL,
+                uni_name VARCHAR,
+                loaded_at TIMESTAMP NOT NULL DEFAULT now()
+            );
+        ''')
+        cursor.execute('SELECT file_name, sha256, uni_name FROM "DataManifest";')
+        return {file_name: (sha256, uni_name) for file_name, sha256, uni_name in cursor.fetchall()}
 
-        # Close the connection
-        conn.close()
+    def write_manifest(self, cursor, hashes: dict, removed: list):
+        '''
+        function to record the workbooks just loaded and forget removed ones
+        '''
+        cursor.execute('DELETE FROM "DataManifest" WHERE file_name = ANY(%s::varchar[]);', (removed,))
+        for file_name, uni_name in self.file_uni_names.items():
+            cursor.execute('''
+                INSERT INTO "DataManifest" (file_name, sha256, uni_name) VALUES (%s, %s, %s)
+                ON CONFLICT (file_name) DO UPDATE
+                SET sha256 = EXCLUDED.sha256, uni_name = EXCLUDED.uni_name, loaded_at = now();
+            ''', (file_name, hashes[file_name], uni_name))
+
+    def tables_exist(self, cursor) -> bool:
+        for table in self.tables.keys():
+            cursor.execute('SELECT to_regclass(%s);', (f'"{table}"',))
+            if cursor.fetchone()[0] is None:
+                return False
+        return True
+
+    def sync(self):
+        '''
+        Load the workbooks that changed since the last run: a full reload the
+        first time (or when asked), otherwise an upsert of the changed
+        universities and a delete of the removed ones
+        '''
+        hashes = self.file_hashes()
+        conn, engine = self.connect_to_postgres()
+        try:
+            cursor = conn.cursor()
+            manifest = self.read_manifest(cursor)
+            full_reload = self.full_reload or not manifest or not self.tables_exist(cursor)
+            conn.commit()
+        finally:
+            conn.close()
+
+        if full_reload:
+            changed = self.filepaths
+            removed = list(manifest)
+        else:
+            changed = [f for f in self.filepaths if manifest.get(os.path.basename(f), (None,))[0] != hashes[os.path.basename(f)]]
+            removed = [file_name for file_name in manifest if file_name not in hashes]
+        print(f'{len(changed)} new or changed workbooks, {len(removed)} removed, {len(self.filepaths) - len(changed)} unchanged')
+        if not changed and not removed:
+            return
+
+        if not self.streaming:
+            self.load_data(changed)
+
+        # a changed workbook may have renamed its university, clear the old name too
+        old_uni_names = {manifest[name][1] for name in removed}
+        old_uni_names |= {
+            manifest[os.path.basename(f)][1] for f in changed if os.path.basename(f) in manifest
+        }
+
+        conn, engine = self.connect_to_postgres()
+        cursor = conn.cursor()
+        try:
+            if self.streaming:
+                self.stream_into_postgres(cursor, changed, full_reload, old_uni_names)
+            elif full_reload:
+                self.load_into_postgres(cursor)
+            else:
+                self.copy_incoming(cursor)
+                uni_names = old_uni_names | set(self.file_uni_names.values())
+                self.upsert_into_postgres(cursor, sorted(u for u in uni_names if u is not None))
+            self.write_manifest(cursor, hashes, removed)
+            self.bump_data_version(cursor)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            # Return the connection to the pool
+            conn.close()
+
+    def bump_data_version(self, cursor):
+        '''
+        function to bump the data version stamp the chat backend uses to
+        invalidate its SQL / answer caches after a reload
+        '''
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS "DataVersion" (
+                id INTEGER PRIMARY KEY,
+                version BIGINT NOT NULL,
+                updated_at TIMESTAMP NOT NULL DEFAULT now()
+            );
+        ''')
+        cursor.execute('''
+            INSERT INTO "DataVersion" (id, version) VALUES (1, 1)
+            ON CONFLICT (id) DO UPDATE
+            SET version = "DataVersion".version + 1, updated_at = now();
+        ''')
 
-    def load_data(self):
+    def read_workbook(self, file_path: str):
         '''
-        Driver function
+        Open a workbook once and read all of its sheets, timing each one
         '''
-        for f in self.filepaths[:]:
-            print(f)
+        timings = {}
+        sheets = {}
+        start = time.perf_counter()
+        with pd.ExcelFile(file_path, engine='openpyxl') as workbook:
+            timings['open'] = time.perf_counter() - start
+            # University goes first, it sets the uni_name the other sheets are tagged with
             for table in self.tables.keys():
-                
-                self.tables[table] = pd.concat([self.tables[table], self.read_table(file_path=f, table=table)])
-                
-                # table_name = f"{table}"
-                # self.connect_to_postgres_and_insert(self.tables[table], table_name)
+                sheet_start = time.perf_counter()
+                sheets[table] = self.read_table(file_path=file_path, table=table, workbook=workbook)
+                timings[table] = time.perf_counter() - sheet_start
+        timings['total'] = time.perf_counter() - start
+        return sheets, timings
+
+    def load_data(self, filepaths: list = None):
+        '''
+        Driver function: parse the workbooks (all of them by default) in
+        parallel and build every table with a single concat
+        '''
+        filepaths = self.filepaths if filepaths is None else filepaths
+        start = time.perf_counter()
+        parts = {table: [] for table in self.tables.keys()}
+        workers = min(self.workers, len(filepaths)) or 1
+
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                # map keeps the file order, so the tables come out the same on every run
+                results = list(pool.map(parse_workbook, filepaths))
+        else:
+            results = [self.read_workbook(f) for f in filepaths]
+
+        for f, (sheets, timings) in zip(filepaths, results):
+            for table, table_df in sheets.items():
+                parts[table].append(table_df)
+            university = sheets['University']
+            self.file_uni_names[os.path.basename(f)] = university.uni_name.iloc[0] if len(university) else None
+            print(
+                f'{os.path.basename(f)}: {timings["total"]:.2f}s '
+                f'(open {timings["open"]:.2f}s, '
+                + ', '.join(f'{table} {timings[table]:.2f}s' for table in sheets)
+                + ')'
+            )
+
+        for table, table_parts in parts.items():
+            if table_parts:
+                self.tables[table] = pd.concat(table_parts)
+
+        print(f'Parsed {len(filepaths)} workbooks with {workers} workers in {time.perf_counter() - start:.2f}s')
 
     # def load_data(self) -> None:
     #     '''
@@ -355,18 +854,28 @@ class data_pipe:
         # except Exception as e:
         #     print(e)
         
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        workers: int = DATA_PIPE_WORKERS,
+        full_reload: bool = DATA_PIPE_FULL_RELOAD,
+        streaming: bool = DATA_PIPE_STREAMING
+    ) -> None:
+        self.workers = workers
+        self.full_reload = full_reload
+        self.streaming = streaming
+        self.file_uni_names = {}
         self.load_files()
-        self.load_data()
-        # print(self.tables)
-        for name, table in self.tables.items():
+        self.sync()
 
-            table.reset_index(drop= True, inplace= True)
-            table.drop_duplicates(inplace= True)
-            
-            # self.connect_to_mongo(table, name)
-            print(table)
-            self.connect_to_postgres_and_insert(table, name)
+
+def parse_workbook(file_path: str):
+    '''
+    Process pool entry point: parse one workbook in a fresh reader
+    '''
+    # skip __init__, it runs the whole pipeline
+    reader = data_pipe.__new__(data_pipe)
+    return reader.read_workbook(file_path)
 
 
-data_pipe()
+if __name__ == '__main__':
+    data_pipe()